@@ -0,0 +1,154 @@
+# asgi.py — mode ASGI optionnel : uvicorn asgi:app --host 0.0.0.0 --port $PORT
+# Dépendance en plus (hors requirements) : pip install uvicorn
+# L'app reste Flask (WSGI). Pas de asgiref.WsgiToAsgi : il passe par sync_to_async(thread_sensitive=True),
+# donc toutes les requêtes partagent UN thread et un /create-video sync bloquerait /jobs et /healthz.
+# Ici chaque requête tourne sur un thread d'un pool dédié (ASGI_THREADS, comme les threads gthread),
+# les rendus sur main.SCHEDULER : la boucle événementielle n'attend jamais un rendu.
+# Démarrage (reprise des jobs, outbox, purges) sur l'événement lifespan.startup : garder le lifespan actif.
+import os, sys, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+import main
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", os.getenv("GUNICORN_THREADS", "32")))
+
+
+class _Body:
+    """
+    wsgi.input lu à la demande depuis receive() (thread du pool -> boucle) : le corps n'est jamais
+    mis en tampon ici, SpoolRequest l'écrit directement dans SPOOL_DIR au fil du parsing multipart.
+    Borné à MAX_CONTENT_LENGTH pendant la réception (chunked sans Content-Length compris).
+    """
+
+    def __init__(self, receive, loop, limit: Optional[int]):
+        self._receive, self._loop, self._limit = receive, loop, limit
+        self._buf, self._more, self._seen = bytearray(), True, 0
+
+    def _pull(self):
+        msg = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if msg["type"] == "http.disconnect":
+            self._more = False
+            raise ClientDisconnected()
+        chunk = msg.get("body", b"")
+        self._seen += len(chunk)
+        if self._limit is not None and self._seen > self._limit:
+            self._more = False
+            raise RequestEntityTooLarge()
+        self._buf += chunk
+        self._more = bool(msg.get("more_body"))
+
+    def _take(self, n: int) -> bytes:
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        while self._more and (size is None or size < 0 or len(self._buf) < size):
+            self._pull()
+        return self._take(len(self._buf) if size is None or size < 0 else size)
+
+    def readline(self, size: Optional[int] = -1) -> bytes:
+        while self._more and b"\n" not in self._buf and (size is None or size < 0 or len(self._buf) < size):
+            self._pull()
+        i = self._buf.find(b"\n")
+        n = len(self._buf) if i < 0 else i + 1
+        return self._take(n if size is None or size < 0 else min(n, size))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def _environ(scope, body) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0], "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0], "REMOTE_PORT": str(client[1] or 0),
+        "wsgi.version": (1, 0), "wsgi.url_scheme": scope.get("scheme", "http"),
+        # corps lu jusqu'à more_body=False : fin de flux fiable même sans Content-Length (chunked)
+        "wsgi.input": body, "wsgi.input_terminated": True, "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+    for k, v in scope.get("headers", []):
+        k, v = k.decode("latin-1").upper().replace("-", "_"), v.decode("latin-1")
+        if k not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            k = "HTTP_" + k
+            v = f"{env[k]},{v}" if k in env else v
+        env[k] = v
+    return env
+
+
+class WsgiPool:
+    """Adaptateur ASGI -> WSGI : une requête = un thread du pool, réponse streamée par morceaux."""
+
+    def __init__(self, wsgi, threads: int):
+        self.wsgi = wsgi
+        self.pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                msg = await receive()
+                if msg["type"] == "lifespan.startup":
+                    main.startup()
+                    await send({"type": "lifespan.startup.complete"})
+                elif msg["type"] == "lifespan.shutdown":
+                    self.pool.shutdown(wait=False)
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            raise ValueError(f"type ASGI non géré : {scope['type']}")
+
+        loop = asyncio.get_running_loop()
+        body = _Body(receive, loop, getattr(self.wsgi, "config", {}).get("MAX_CONTENT_LENGTH"))
+        await loop.run_in_executor(self.pool, self._run, scope, body, send, loop)
+
+    def _run(self, scope, body, send, loop):
+        # thread du pool : chaque message ASGI est renvoyé sur la boucle et attendu (contre-pression)
+        def _send(msg):
+            asyncio.run_coroutine_threadsafe(send(msg), loop).result()
+
+        head, started = {}, [False]
+
+        def _start():
+            if not started[0]:
+                _send({"type": "http.response.start", "status": head["status"], "headers": head["headers"]})
+                started[0] = True
+
+        def _write(data: bytes):
+            _start()
+            _send({"type": "http.response.body", "body": data, "more_body": True})
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started[0]:
+                raise exc_info[1].with_traceback(exc_info[2])
+            head["status"] = int(status.split(" ", 1)[0])
+            head["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+            return _write
+
+        it = self.wsgi(_environ(scope, body), start_response)
+        try:
+            for chunk in it:
+                if chunk:
+                    _write(chunk)
+            _start()
+            _send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+
+
+# main.SYNC_MAX_INFLIGHT rendus sync au plus : le pool garde toujours des threads pour /jobs, /healthz…
+app = WsgiPool(main.app, max(ASGI_THREADS, main.SYNC_MAX_INFLIGHT + 4))
@@ -0,0 +1,413 @@
+# bench.py — micro-benchmarks maison (aucune dépendance en plus)
+# Usage : python bench.py            -> tous les benchs
+#         python bench.py captions   -> seulement ceux nommés
+import os, re, sys, time, json, random
+from typing import Callable, Dict
+
+BENCHES: Dict[str, Callable[[], None]] = {}
+
+def bench(name: str):
+    def deco(fn):
+        BENCHES[name] = fn
+        return fn
+    return deco
+
+def _best(fn: Callable[[], object], repeat: int = 5) -> float:
+    """Meilleur temps (s) sur `repeat` exécutions."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def _report(name: str, **cols):
+    parts = []
+    for k, v in cols.items():
+        parts.append(f"{k}={v*1000:.2f}ms" if isinstance(v, float) else f"{k}={v}")
+    print(f"{name:<28} " + "  ".join(parts))
+
+def _fake_words(n: int, seed: int = 0):
+    """Narration synthétique type Whisper : quelques chevauchements et mots trop courts."""
+    rnd = random.Random(seed)
+    t, out = 0.0, []
+    for i in range(n):
+        st = t + rnd.uniform(-0.05, 0.25)
+        en = st + rnd.choice([0.0, 0.05, rnd.uniform(0.1, 0.6)])
+        out.append({"word": rnd.choice(["alors", "on", "{va}", "voir", "ça", "l&apos;idée"]),
+                    "start": round(st, 3), "end": round(en, 3)})
+        t = max(t, st) + 0.2
+    return out
+
+# ---------------- captions : moteur de timing ----------------
+
+def _legacy_ass_time(t: float) -> str:
+    if t < 0:
+        t = 0.0
+    h = int(t // 3600); t -= 3600 * h
+    m = int(t // 60);   t -= 60 * m
+    s = int(t)
+    cs = int(round((t - s) * 100))
+    return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
+
+def _legacy_clean(arr):
+    # copie de l'ancien captions._clean (boucles Python sur des dicts), référence du bench
+    raw = []
+    for w in arr:
+        try:
+            word = str(w.get("word", "")).strip()
+            st = float(w.get("start", 0.0))
+            en = float(w.get("end", st))
+            raw.append({"word": word, "start": st, "end": en})
+        except Exception:
+            continue
+    raw = [w for w in raw if w["word"]]
+    if not raw:
+        return []
+    raw.sort(key=lambda x: (x["start"], x["end"]))
+    MIN_DUR, MIN_GAP = 0.16, 0.01
+    for i, w in enumerate(raw):
+        if i == 0:
+            if w["end"] <= w["start"]:
+                w["end"] = w["start"] + MIN_DUR
+            continue
+        prev = raw[i - 1]
+        if w["start"] < prev["start"]:
+            w["start"] = prev["start"]
+        if w["start"] < prev["end"] + MIN_GAP:
+            w["start"] = prev["end"] + MIN_GAP
+        if w["end"] <= w["start"]:
+            w["end"] = w["start"] + MIN_DUR
+    n = len(raw)
+    for i, w in enumerate(raw):
+        desired_end = w["start"] + MIN_DUR
+        if w["end"] >= desired_end:
+            continue
+        if i < n - 1:
+            max_end = max(w["start"] + 0.05, raw[i + 1]["start"] - MIN_GAP)
+            w["end"] = min(desired_end, max_end)
+            if w["end"] <= w["start"]:
+                w["end"] = w["start"] + MIN_DUR * 0.6
+        else:
+            w["end"] = desired_end
+    return raw
+
+def _legacy_build(words):
+    import captions
+    S = captions.STYLE
+    lines = []
+    for w in _legacy_clean(words):
+        ass_text = "{\\an" + str(S.align) + "\\bord" + str(S.outline) + "\\shad" + str(S.shadow) + "}" + captions._escape.__wrapped__(w["word"])
+        lines.append(f"Dialogue: 0,{_legacy_ass_time(w['start'])},{_legacy_ass_time(w['end'])},{S.name},,{ass_text}")
+    return captions.ASS_HEADER + "\n".join(lines)
+
+@bench("captions")
+def bench_captions():
+    import captions
+    for n in (1_000, 10_000, 50_000):
+        words = _fake_words(n)
+        payload = json.dumps({"words": words})
+        new = captions.build_ass_from_srt(payload)
+        old = _legacy_build(json.loads(payload)["words"])
+        assert new == old, "sortie ASS différente de la référence"
+        t_old = _best(lambda: _legacy_build(json.loads(payload)["words"]))
+        t_new = _best(lambda: captions.build_ass_from_srt(payload))
+        _report(f"captions.build n={n}", legacy=t_old, columnar=t_new,
+                speedup=f"x{t_old / t_new:.1f}", identical="yes")
+
+# ---------------- captions : parsing du payload words[] ----------------
+
+def _legacy_parse_raw(payload: str):
+    # copie de l'ancien captions._parse_words (json -> ast -> regex), sans le _clean
+    import ast, re
+    txt = payload.strip()
+    for load in (json.loads, ast.literal_eval):
+        try:
+            obj = load(txt)
+            if isinstance(obj, dict) and isinstance(obj.get("words"), list):
+                return obj["words"]
+            if isinstance(obj, list):
+                return obj
+        except Exception:
+            pass
+    pairs = re.findall(
+        r"word['\"]?\s*:\s*['\"]([^'^\"]+)['\"].*?start['\"]?\s*:\s*([0-9.]+).*?end['\"]?\s*:\s*([0-9.]+)",
+        txt, flags=re.I | re.S
+    )
+    return [{"word": w, "start": float(s), "end": float(e)} for (w, s, e) in pairs]
+
+@bench("captions-parse")
+def bench_captions_parse():
+    import captions
+    words = _fake_words(10_000)
+    full = {"task": "transcribe", "language": "fr", "text": " ".join(w["word"] for w in words),
+            "words": words, "segments": [{"id": i, "text": "x" * 200} for i in range(500)]}
+    payloads = {
+        "json": json.dumps(full),
+        "python-repr": repr(words),
+        "json-truncated": json.dumps(full)[: len(json.dumps({"words": words})) // 2],
+    }
+    for kind, payload in payloads.items():
+        n_old = len(captions._clean(_legacy_parse_raw(payload)))
+        n_new = len(captions._clean(captions._parse_raw(payload)))
+        t_old = _best(lambda: _legacy_parse_raw(payload), repeat=3)
+        t_new = _best(lambda: captions._parse_raw(payload), repeat=3)
+        _report(f"parse 10k {kind}", legacy=t_old, stream=t_new,
+                speedup=f"x{t_old / t_new:.1f}", words=f"{n_old}/{n_new}")
+
+@bench("captions-presets")
+def bench_captions_presets():
+    import captions
+    payload = json.dumps({"words": _fake_words(10_000)})
+    base = None
+    for name in captions.PRESETS:
+        ass = captions.build_ass_from_srt(payload, preset=name)
+        events = ass.count("\nDialogue:")
+        base = base or events
+        t = _best(lambda: captions.build_ass_from_srt(payload, preset=name), repeat=3)
+        _report(f"preset {name}", build=t, events=events, reduction=f"x{base / events:.1f}")
+
+# ---------------- captions : libass vs sprites overlay ----------------
+
+def _have_ffmpeg() -> bool:
+    import shutil
+    return bool(shutil.which("ffmpeg"))
+
+def _test_video(path: str, dur: float, width: int = 1080, height: int = 1920, fps: int = 30):
+    import subprocess
+    if not os.path.exists(path):
+        subprocess.check_call(
+            f"ffmpeg -y -hide_banner -loglevel error -f lavfi -i testsrc2=s={width}x{height}:r={fps}:d={dur} "
+            f"-f lavfi -i sine=d={dur} -c:v libx264 -preset ultrafast -pix_fmt yuv420p -c:a aac -shortest {path}",
+            shell=True)
+    return path
+
+@bench("captions-burn")
+def bench_captions_burn():
+    if not _have_ffmpeg():
+        return print("captions-burn: ffmpeg absent, bench ignoré")
+    import tempfile, shutil, logging
+    logging.disable(logging.WARNING)
+    import main
+    wd = tempfile.mkdtemp(prefix="bench_burn_")
+    try:
+        dur, W, H = 10.0, 540, 960
+        src = _test_video(os.path.join(wd, "in.mp4"), dur, W, H)
+        words = [w for w in _fake_words(200) if w["end"] < dur]
+        payload = json.dumps({"words": words})
+        for preset in ("default", "phrase"):
+            for engine in ("ass", "overlay"):
+                t = _best(lambda: main._burn_captions(src, wd, payload, preset, fps=30, width=W,
+                                                      height=H, engine=engine, req_id="bench"), repeat=2)
+                _report(f"burn {dur:.0f}s {preset}/{engine}", wall=t, words=len(words))
+    finally:
+        shutil.rmtree(wd, ignore_errors=True)
+
+# ---------------- text_overlay : polices + layout ----------------
+
+def _legacy_layout(text, max_w, font_path, size, stroke_width):
+    # ancien chemin : truetype() à chaque appel, image brouillon, textbbox par ligne candidate puis par ligne
+    from PIL import Image, ImageDraw, ImageFont
+    font = ImageFont.truetype(font_path, size=size)
+    d = ImageDraw.Draw(Image.new("RGBA", (max_w, 10), (0, 0, 0, 0)))
+    lines, cur = [], ""
+    for w in text.split():
+        test = (cur + " " + w).strip()
+        if d.textbbox((0, 0), test, font=font, stroke_width=stroke_width)[2] > max_w and cur:
+            lines.append(cur); cur = w
+        else:
+            cur = test
+    if cur: lines.append(cur)
+    for ln in lines:
+        d.textbbox((0, 0), ln, font=font, stroke_width=stroke_width)
+    return lines
+
+@bench("text-layout")
+def bench_text_layout():
+    from utils import text_overlay as to
+    if not to.font_path():
+        return print("text-layout: aucune police TrueType, bench ignoré")
+    rnd = random.Random(0)
+    vocab = ["alors", "on", "va", "voir", "ça", "ensemble", "maintenant", "l'idée", "simple", "vidéo"]
+    texts = [" ".join(rnd.choice(vocab) for _ in range(rnd.randint(3, 25))) for _ in range(200)]
+    jobs = texts * 5  # mêmes textes rendus plusieurs fois (plusieurs overlays / jobs)
+    t_old = _best(lambda: [_legacy_layout(t, 990, to.font_path(), 56, 4) for t in jobs], repeat=3)
+    to._measure_cached.cache_clear(); to._truetype.cache_clear()
+    t_cold = _best(lambda: [to._measure(t, 990, to._load_font(56), 4) for t in jobs], repeat=3)
+    t_new = _best(lambda: [to._layout(t, 990, to._load_font(56), 4) for t in jobs], repeat=3)
+    _report(f"layout x{len(jobs)}", legacy=t_old, incremental=t_cold, memoized=t_new,
+            speedup=f"x{t_old / t_cold:.1f}/x{t_old / t_new:.0f}")
+
+# ---------------- styles : coût par segment ----------------
+
+def _legacy_philo(need_dur, width, height, fps, mask_path):
+    # ancien philo : masque plein cadre en -loop 1 décodé à chaque frame + alphamerge en RGBA
+    inner = min(width, height)
+    extra = f'-loop 1 -t {need_dur:.3f} -i "{mask_path}"'
+    fc = (f"[0:v]crop='min(iw,ih)':'min(iw,ih)':'(iw-min(iw,ih))/2':'(ih-min(ih,iw))/2',"
+          f"scale={inner}:{inner}:flags=bicubic,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,"
+          f"fps={fps},setsar=1,format=rgba[base];[1:v]format=gray,scale={width}:{height}[mask];"
+          f"[base][mask]alphamerge,format=yuv420p[v]")
+    return extra, fc, "[v]"
+
+@bench("styles")
+def bench_styles():
+    if not _have_ffmpeg():
+        return print("styles: ffmpeg absent, bench ignoré")
+    import tempfile, shutil, subprocess, shlex
+    from PIL import Image, ImageDraw
+    import styles
+    wd = tempfile.mkdtemp(prefix="bench_styles_")
+    try:
+        W, H, fps, dur = 720, 1280, 30, 4.0
+        src = _test_video(os.path.join(wd, "src.mp4"), dur, 640, 480, 25)
+        mask = os.path.join(wd, "mask.png")
+        img = Image.new("L", (W, H), 0)
+        ImageDraw.Draw(img).rounded_rectangle((0, 0, W, H), radius=48, fill=255)
+        img.save(mask)
+
+        def enc(extra, fc, label):
+            cmd = (f"ffmpeg -y -hide_banner -loglevel error -stream_loop -1 -t {dur} -i {src} {extra} "
+                   f'-filter_complex "{fc}" -map {label} -c:v libx264 -preset superfast -crf 26 '
+                   f"-threads 1 {os.path.join(wd, 'out.mp4')}")
+            subprocess.check_call(shlex.split(cmd))
+
+        cases = {
+            "default (fallback)": styles.build("default", dur, W, H, fps, wd),
+            "philo legacy": _legacy_philo(dur, W, H, fps, mask),
+            "philo corners": styles.build("philo", dur, W, H, fps, wd),
+        }
+        base = None
+        for name, graph in cases.items():
+            t = _best(lambda: enc(*graph), repeat=2)
+            base = base or t
+            _report(f"segment {W}x{H} {name}", wall=t, vs_default=f"x{t / base:.2f}")
+    finally:
+        shutil.rmtree(wd, ignore_errors=True)
+
+# ---------------- video_generator : chaîne de filtres par défaut ----------------
+
+@bench("scale-chain")
+def bench_scale_chain():
+    if not _have_ffmpeg():
+        return print("scale-chain: ffmpeg absent, bench ignoré")
+    import tempfile, shutil, subprocess, shlex
+    import video_generator as vg
+    wd = tempfile.mkdtemp(prefix="bench_vf_")
+    try:
+        W, H, fps, dur = 1080, 1920, 30, 6.0
+        sources = {
+            "mp4 1080x1080@30": (os.path.join(wd, "sq.mp4"), 1080, 1080, "yuv420p", False),
+            "mp4 1920x1080@30": (os.path.join(wd, "wide.mp4"), 1920, 1080, "yuv420p", False),
+            "mp4 1280x720@60": (os.path.join(wd, "hfr.mp4"), 1280, 720, "yuv420p", False),
+            "gif 320x240@10": (os.path.join(wd, "low.gif"), 320, 240, "bgra", True),
+        }
+        for name, (path, w, h, pix, gif) in sources.items():
+            rate = 10 if gif else (60 if "@60" in name else 30)
+            if gif:
+                subprocess.check_call(shlex.split(
+                    f"ffmpeg -y -hide_banner -loglevel error -f lavfi -i testsrc2=s={w}x{h}:r={rate}:d=2 {path}"))
+            else:
+                _test_video(path, dur, w, h, rate)
+            probe = vg._probe_source(path)
+            if not probe["width"]:  # pas de ffprobe : géométrie connue
+                r = f"{rate}/1"
+                probe.update(width=w, height=h, pix_fmt=pix, is_gif=gif, r_frame_rate=r, avg_frame_rate=r)
+            box = min(W, H)
+            loop = "-ignore_loop 0 -stream_loop -1" if gif else "-stream_loop -1"
+
+            def run(vf):
+                cmd = (f"ffmpeg -y -hide_banner -loglevel error {loop} -t {dur} -i {path} "
+                       + (f'-vf "{vf}" ' if vf else "") + "-threads 1 -f null -")
+                subprocess.check_call(shlex.split(cmd))
+
+            def n_filters(vf):  # virgules hors quotes
+                return len(re.findall(r"(?:[^,']|'[^']*')+", vf))
+
+            # coût filtres seul = temps total - décodage seul (-vf null)
+            legacy, smart = vg._legacy_vf(box, W, H, fps), vg._default_vf(box, W, H, fps, probe)
+            t_dec = _best(lambda: run("null"), repeat=3)
+            t_old = _best(lambda: run(legacy), repeat=3) - t_dec
+            t_new = _best(lambda: run(smart), repeat=3) - t_dec
+            _report(f"vf {name}", decode=t_dec, legacy=t_old, probed=t_new,
+                    speedup=f"x{t_old / max(t_new, 1e-3):.1f}",
+                    filters=f"{n_filters(legacy)}->{n_filters(smart)}")
+    finally:
+        shutil.rmtree(wd, ignore_errors=True)
+
+# ---------------- video_generator : GIF normalisé + bouclage en copie ----------------
+
+@bench("gif-loop")
+def bench_gif_loop():
+    if not _have_ffmpeg():
+        return print("gif-loop: ffmpeg absent, bench ignoré")
+    import tempfile, shutil, subprocess, shlex, logging
+    import video_generator as vg
+    import cache
+    log = logging.getLogger("bench")
+    wd = tempfile.mkdtemp(prefix="bench_gif_")
+    try:
+        W, H, fps, need = 540, 960, 30, 12.0
+        gif = os.path.join(wd, "src.gif")
+        subprocess.check_call(shlex.split(
+            f"ffmpeg -y -hide_banner -loglevel error -f lavfi -i testsrc2=s=320x240:r=10:d=2 {gif}"))
+        probe = vg._probe_source(gif)
+        if not probe["width"]:  # pas de ffprobe : géométrie connue
+            probe.update(width=320, height=240, pix_fmt="bgra", is_gif=True,
+                         r_frame_rate="10/1", avg_frame_rate="10/1", duration=2.0)
+        part = os.path.join(wd, "part.mp4")
+        t_old = _best(lambda: vg._encode_segment_default(gif, part, need, W, H, fps, log, "bench", probe=probe), 2)
+
+        def cold():
+            for f in os.listdir(cache.cache_dir("gif_norm")):
+                os.remove(os.path.join(cache.cache_dir("gif_norm"), f))
+            vg._loop_copy(vg._gif_intermediate(gif, probe, W, H, fps, log, "bench"), part, need, log, "bench")
+        t_cold = _best(cold, 2)
+        t_warm = _best(lambda: vg._loop_copy(vg._gif_intermediate(gif, probe, W, H, fps, log, "bench"),
+                                             part, need, log, "bench"), 3)
+        _report(f"gif 2s -> seg {need:.0f}s {W}x{H}", per_segment=t_old, normalized=t_cold,
+                cached=t_warm, speedup=f"x{t_old / t_cold:.1f}/x{t_old / t_warm:.0f}")
+    finally:
+        shutil.rmtree(wd, ignore_errors=True)
+
+# ---------------- démarrage : imports paresseux ----------------
+
+def _cold_import(stmt: str, env: Dict[str, str]) -> float:
+    # interpréteur neuf à chaque fois : c'est ce que paie un démarrage à froid
+    import subprocess
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", stmt], check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+@bench("import")
+def bench_import():
+    import tempfile, shutil
+    wd = tempfile.mkdtemp(prefix="bench_import_")
+    env = {**os.environ, "JOBS_DIR": os.path.join(wd, "jobs"), "OUTBOX_DIR": os.path.join(wd, "outbox"),
+           "RESUME_JOBS": "0", "WARMUP": "0", "LOG_LEVEL": "WARNING"}
+    # "eager" = l'ensemble importé au chargement avant (google-api-client, captions/numpy, requests ; moviepy via utils)
+    eager = {
+        "main": "import googleapiclient.discovery, google.oauth2.service_account, googleapiclient.http, "
+                "captions, requests",
+        "utils": "import numpy, moviepy.editor",
+    }
+    try:
+        for mod, extra in eager.items():
+            try:
+                t_lazy = min(_cold_import(f"import {mod}", env) for _ in range(3))
+                t_eager = min(_cold_import(f"import {mod}; {extra}", env) for _ in range(3))
+            except Exception as e:
+                print(f"import {mod}: ignoré ({e})"); continue
+            _report(f"import {mod} (cold)", eager=t_eager, lazy=t_lazy, speedup=f"x{t_eager / t_lazy:.1f}")
+    finally:
+        shutil.rmtree(wd, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    names = sys.argv[1:] or list(BENCHES)
+    for name in names:
+        if name not in BENCHES:
+            sys.exit(f"bench inconnu: {name} (dispo: {', '.join(BENCHES)})")
+        BENCHES[name]()
@@ -0,0 +1,134 @@
+# cache.py — cache disque partagé entre jobs (sprites de captions, assets de styles, sources…)
+# Un namespace = un sous-dossier de FUSION_CACHE_DIR ; les fichiers sont nommés par clé de contenu
+# et écrits de façon atomique (tmp + rename) pour supporter plusieurs jobs/process en parallèle.
+import os, time, hashlib, logging, tempfile, threading
+from typing import Callable, Optional
+
+CACHE_ROOT = os.getenv("FUSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fusion_cache"))
+# purge périodique (start_pruner) : entrées non utilisées depuis CACHE_MAX_AGE_SEC, puis les plus anciennes
+# au-delà de CACHE_MAX_MB ; 0 => critère désactivé
+CACHE_MAX_AGE_SEC = float(os.getenv("CACHE_MAX_AGE_SEC", str(7 * 86400)))
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", "5120"))
+CACHE_PRUNE_EVERY_SEC = float(os.getenv("CACHE_PRUNE_EVERY_SEC", "600"))
+CACHE_KEEP_RECENT_SEC = 900   # jamais évincé pour la taille : peut être en cours d'usage par un job
+
+log = logging.getLogger(__name__)
+_pruner: Optional[threading.Thread] = None
+
+def cache_dir(ns: str) -> str:
+    d = os.path.join(CACHE_ROOT, ns)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+def key_of(*parts) -> str:
+    """Clé stable (sha1) à partir de valeurs simples (str, nombres, tuples…)."""
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(repr(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def file_sha1(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def path_for(ns: str, key: str, ext: str) -> str:
+    return os.path.join(cache_dir(ns), f"{key}{ext}")
+
+def lookup(ns: str, key: str, ext: str) -> Optional[str]:
+    """Chemin du fichier en cache s'il existe (non vide), sinon None. Rafraîchit le mtime (pour prune)."""
+    p = path_for(ns, key, ext)
+    try:
+        if os.path.getsize(p) > 0:
+            os.utime(p, None)
+            return p
+    except OSError:
+        pass
+    return None
+
+def store(ns: str, key: str, ext: str, writer: Callable[[str], None]) -> str:
+    """
+    Produit le fichier via writer(tmp_path) puis le publie atomiquement.
+    Si un autre job l'a publié entre-temps, le résultat est identique : on écrase sans risque.
+    """
+    dst = path_for(ns, key, ext)
+    tmp = f"{dst}.{os.getpid()}.{time.monotonic_ns()}.tmp{ext}"
+    try:
+        writer(tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dst
+
+def get_or_create(ns: str, key: str, ext: str, writer: Callable[[str], None]) -> str:
+    return lookup(ns, key, ext) or store(ns, key, ext, writer)
+
+def prune(ns: str, max_age_sec: float) -> int:
+    """Supprime les entrées non utilisées depuis max_age_sec. Retourne le nb de fichiers supprimés."""
+    d, n, now = cache_dir(ns), 0, time.time()
+    for name in os.listdir(d):
+        p = os.path.join(d, name)
+        try:
+            if os.path.isfile(p) and now - os.path.getmtime(p) > max_age_sec:
+                os.remove(p); n += 1
+        except OSError:
+            pass
+    return n
+
+def prune_all(max_age_sec: float = CACHE_MAX_AGE_SEC, max_bytes: float = CACHE_MAX_MB * 1024 * 1024) -> int:
+    """
+    Tous les namespaces : supprime les entrées non utilisées depuis max_age_sec, puis, si le cache
+    dépasse max_bytes, les moins récemment utilisées (mtime, rafraîchi par lookup). Retourne le nb supprimé.
+    """
+    if not os.path.isdir(CACHE_ROOT):
+        return 0
+    n = 0
+    if max_age_sec > 0:
+        n += sum(prune(ns, max_age_sec) for ns in os.listdir(CACHE_ROOT)
+                 if os.path.isdir(os.path.join(CACHE_ROOT, ns)))
+    if max_bytes <= 0:
+        return n
+    entries, total = [], 0
+    for ns in os.listdir(CACHE_ROOT):
+        d = os.path.join(CACHE_ROOT, ns)
+        if not os.path.isdir(d):
+            continue
+        for name in os.listdir(d):
+            try:
+                st = os.stat(os.path.join(d, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, os.path.join(d, name)))
+            total += st.st_size
+    now = time.time()
+    for mtime, size, p in sorted(entries):
+        if total <= max_bytes or now - mtime < CACHE_KEEP_RECENT_SEC:
+            break
+        try:
+            os.remove(p); n += 1; total -= size
+        except OSError:
+            pass
+    return n
+
+def start_pruner():
+    """Thread démon : prune_all() toutes les CACHE_PRUNE_EVERY_SEC. Idempotent."""
+    global _pruner
+    if _pruner is not None or CACHE_PRUNE_EVERY_SEC <= 0:
+        return
+
+    def _loop():
+        while True:
+            try:
+                n = prune_all()
+                if n:
+                    log.info(f"cache: {n} entrée(s) purgée(s) dans {CACHE_ROOT}")
+            except Exception as e:
+                log.warning(f"cache: purge échouée ({e})")
+            time.sleep(CACHE_PRUNE_EVERY_SEC)
+
+    _pruner = threading.Thread(target=_loop, name="cache-prune", daemon=True)
+    _pruner.start()
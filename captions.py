@@ -1,11 +1,15 @@
 # /opt/fusion-bot/captions.py
 # srt_text = JSON complet (avec "words":[...]) OU juste un array words[].
-# Génère un .ass avec un mot à la fois, centré, jaune.
+# Génère un .ass centré, fond jaune : un mot à la fois (preset "default")
+# ou des phrases groupées ("phrase", "karaoke", "two-line").
 
 from dataclasses import dataclass
-import html, json, ast, re
+from functools import lru_cache
+import os, html, json, ast, re
 
-__all__ = ["build_ass_from_srt"]
+import numpy as np
+
+__all__ = ["build_ass_from_srt", "build_overlay_from_srt"]
 
 @dataclass
 class CapStyle:
@@ -20,11 +24,34 @@ class CapStyle:
     align: int = 5           # milieu-centre
     margin_v: int = 0        # 0 => vraiment au centre vertical
     primary: str = "&H00000000&"   # noir (texte)
-    active:  str = "&H0000FFFF&"   # jaune (non utilisé ici car un seul mot)
+    active:  str = "&H0000FFFF&"   # jaune (mot en cours, presets karaoke / two-line)
     back:    str = "&H80FFFF00&"   # fond jaune semi-transparent
 
 STYLE = CapStyle()
 
+@dataclass
+class CapPreset:
+    name: str
+    max_words: int = 1        # 1 => un event par mot (rendu historique)
+    max_chars: int = 0        # 0 => pas de limite
+    lines: int = 1            # 2 => phrase coupée en deux lignes (\N)
+    karaoke: bool = False     # surlignage mot par mot via \k (couleur STYLE.active)
+    max_gap: float = 0.6      # une pause plus longue coupe la phrase
+
+# moins d'events libass = moins de shaping par frame dans le filtre subtitles
+PRESETS = {
+    "default":  CapPreset("default"),
+    "phrase":   CapPreset("phrase", max_words=6, max_chars=32),
+    "karaoke":  CapPreset("karaoke", max_words=6, max_chars=32, karaoke=True),
+    "two-line": CapPreset("two-line", max_words=12, max_chars=64, lines=2, karaoke=True),
+}
+
+def _preset(name) -> CapPreset:
+    """caption_style venant de Make -> preset ; inconnu => "default" (un mot à la fois)."""
+    key = str(name or "").strip().lower().replace("_", "-")
+    key = {"word": "default", "twoline": "two-line", "2-lines": "two-line", "two-lines": "two-line"}.get(key, key)
+    return PRESETS.get(key, PRESETS["default"])
+
 ASS_HEADER = f"""[Script Info]
 ScriptType: v4.00+
 PlayResX: 1080
@@ -49,6 +76,33 @@ def _ass_time(t: float) -> str:
     cs = int(round((t - s) * 100))
     return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
 
+def _ass_times(t) -> list:
+    """
+    Version vectorisée de _ass_time (mêmes arrondis, même sortie octet pour octet).
+    Cas courant (h < 10) : "H:MM:SS.CC" assemblé en bloc dans un tableau de code points.
+    """
+    t = np.maximum(np.asarray(t, dtype=np.float64), 0.0)
+    h = t // 3600; t = t - 3600 * h
+    m = t // 60;   t = t - 60 * m
+    s = np.floor(t)
+    cs = np.round((t - s) * 100)
+    h, m, s, cs = (a.astype(np.int64) for a in (h, m, s, cs))
+
+    buf = np.empty((len(t), 10), dtype=np.uint32)
+    buf[:, 0] = 48 + h
+    buf[:, 1] = buf[:, 4] = ord(":")
+    buf[:, 7] = ord(".")
+    for col, v in ((2, m), (5, s), (8, cs)):
+        buf[:, col] = 48 + v // 10
+        buf[:, col + 1] = 48 + v % 10
+    out = buf.view("<U10").ravel().tolist()
+
+    # h >= 10 ou cs arrondi à 100 : format classique
+    for i in np.flatnonzero((h >= 10) | (cs >= 100)).tolist():
+        out[i] = "%d:%02d:%02d.%02d" % (h[i], m[i], s[i], cs[i])
+    return out
+
+@lru_cache(maxsize=4096)
 def _escape(text: str) -> str:
     text = html.unescape(text or "")
     return text.replace("{", r"\{").replace("}", r"\}")
@@ -59,137 +113,374 @@ def _parse_words(payload: str):
     - Peut être le JSON complet: {"task": "...", "words":[...], ...}
     - Ou directement l'array words[] (JSON ou repr Python).
     """
+    return _clean(_parse_raw(payload))
+
+# ------------ tokenizer words[] (Make / Whisper) ------------
+
+# borne dure sur la taille du payload (un mot ≈ 60 caractères => ~130k mots)
+MAX_PAYLOAD_CHARS = int(os.getenv("CAPTIONS_MAX_CHARS", str(8 * 1024 * 1024)))
+
+_STR = r""""(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'"""
+# clé "words" suivie de l'ouverture de l'array
+_WORDS_KEY = re.compile(r"""["']words["']\s*:\s*\[""")
+# jetons utiles pour suivre la profondeur : chaînes entières (leurs accolades ne comptent pas) et crochets
+_TOKEN = re.compile(_STR + r"|[\[\]{}]")
+# un mot = objet plat (les chaînes peuvent contenir des accolades)
+_OBJ = re.compile(r"\s*,?\s*\{((?:[^{}\"']|" + _STR + r")*)\}")
+# champ word/start/end : valeur chaîne ("..." ou '...') ou nombre
+_FIELD = re.compile(
+    r"""(?<!\w)["']?(word|start|end)["']?\s*:\s*(?:(""" + _STR + r""")|([-+]?[0-9.]+(?:[eE][-+]?\d+)?))""",
+    re.I,
+)
+
+def _unquote(tok: str) -> str:
+    body = tok[1:-1]
+    if "\\" not in body:
+        return body
+    try:
+        return json.loads('"' + body + '"') if tok[0] == '"' else ast.literal_eval(tok)
+    except Exception:
+        return body
+
+def _fields(body: str) -> dict:
+    out = {}
+    for m in _FIELD.finditer(body):
+        key = m.group(1).lower()
+        if key not in out:
+            out[key] = _unquote(m.group(2)) if m.group(2) is not None else m.group(3)
+    return out
+
+def _scan_objects(txt: str, pos: int):
+    """Lit les objets mot un par un à partir de `pos` ; s'arrête au `]` ou au premier accroc."""
+    while True:
+        m = _OBJ.match(txt, pos)
+        if not m:
+            return
+        yield _fields(m.group(1))
+        pos = m.end()
+
+def _scan_fields(txt: str):
+    """Dernier recours, linéaire : séquences word -> start -> end n'importe où dans le texte."""
+    out, cur = [], None
+    for m in _FIELD.finditer(txt):
+        key = m.group(1).lower()
+        val = _unquote(m.group(2)) if m.group(2) is not None else m.group(3)
+        if key == "word":
+            cur = {"word": val}
+        elif cur is None:
+            continue
+        elif key == "start" and "start" not in cur:
+            cur["start"] = val
+        elif key == "end" and "start" in cur:
+            cur["end"] = val
+            out.append(cur)
+            cur = None
+    return out
+
+def _top_level_words(txt: str):
+    """
+    Position du `[` de la clé "words" de l'objet racine, ou None.
+    Les "words" imbriqués (segments[i].words…) sont ignorés : seule la profondeur 1 compte.
+    """
+    depth = 0
+    for m in _TOKEN.finditer(txt):
+        tok = m.group(0)
+        if tok in "{[":
+            depth += 1
+        elif tok in "}]":
+            depth -= 1
+            if depth <= 0:
+                return None
+        elif depth == 1 and tok[1:-1] == "words":
+            k = _WORDS_KEY.match(txt, m.start())
+            if k:
+                return k.end() - 1
+    return None
+
+def _parse_raw(payload: str):
+    """
+    Extrait la liste brute des mots (dicts non nettoyés) du payload :
+      1) JSON valide : array direct, ou clé "words" de l'objet racine ; sans elle, scan des champs
+         word/start/end de tout le document (mots portés par segments[i].words…)
+      2) sinon (repr Python, JSON tronqué…) : lecture mot par mot de l'array direct
+         ou de l'array "words" de l'objet racine
+      3) sinon : scan tolérant des champs word/start/end
+    """
     if not payload:
         return []
+    if len(payload) > MAX_PAYLOAD_CHARS:
+        raise ValueError(f"srt_text too large ({len(payload)} > {MAX_PAYLOAD_CHARS} chars)")
 
     txt = payload.strip()
 
-    # 0) JSON complet
     try:
         obj = json.loads(txt)
-        if isinstance(obj, dict) and isinstance(obj.get("words"), list):
-            return _clean(obj["words"])
-        if isinstance(obj, list):
-            return _clean(obj)
-    except Exception:
-        pass
-
-    # 1) repr Python
-    try:
-        obj = ast.literal_eval(txt)
-        if isinstance(obj, dict) and isinstance(obj.get("words"), list):
-            return _clean(obj["words"])
-        if isinstance(obj, list):
-            return _clean(obj)
-    except Exception:
-        pass
-
-    # 2) Regex tolérante
-    pairs = re.findall(
-        r"word['\"]?\s*:\s*['\"]([^'^\"]+)['\"].*?start['\"]?\s*:\s*([0-9.]+).*?end['\"]?\s*:\s*([0-9.]+)",
-        txt, flags=re.I | re.S
-    )
-    return _clean([{"word": w, "start": float(s), "end": float(e)} for (w, s, e) in pairs])
-
-def _clean(arr):
+    except ValueError:
+        obj = None
+    if isinstance(obj, list):
+        return obj
+    if isinstance(obj, dict):
+        return obj["words"] if isinstance(obj.get("words"), list) else _scan_fields(txt)
+
+    pos = 0 if txt[:1] == "[" else _top_level_words(txt) if txt[:1] == "{" else None
+    if pos is not None:
+        words = list(_scan_objects(txt, pos + 1))
+        if words:
+            return words
+
+    return _scan_fields(txt)
+
+# paramètres de smoothing
+MIN_DUR = 0.16   # durée min "confortable" ~ 160 ms
+MIN_GAP = 0.01   # petit gap entre deux mots
+_VEC_ROUNDS = 16 # passes vectorisées max avant de finir en boucle simple
+
+def _columns(arr):
     """
-    Normalise + répare les timings pour avoir:
-      - ordre correct
-      - durée mini par mot
-      - pas de recouvrement hardcore
+    Extrait les mots valides en colonnes : (words, starts, ends) triés par (start, end).
+    Les timings non finis (nan/inf) sont ignorés (ils faisaient planter _ass_time).
     """
-    raw = []
+    words, st, en = [], [], []
     for w in arr:
         try:
             word = str(w.get("word", "")).strip()
-            st = float(w.get("start", 0.0))
-            en = float(w.get("end", st))
-            raw.append({"word": word, "start": st, "end": en})
+            s = float(w.get("start", 0.0))
+            e = float(w.get("end", s))
         except Exception:
             continue
+        if word:
+            words.append(word); st.append(s); en.append(e)
 
-    # filtre les vides
-    raw = [w for w in raw if w["word"]]
-    if not raw:
-        return []
+    starts = np.array(st, dtype=np.float64)
+    ends = np.array(en, dtype=np.float64)
+    ok = np.isfinite(starts) & np.isfinite(ends)
+    if not ok.all():
+        words = [w for w, k in zip(words, ok.tolist()) if k]
+        starts, ends = starts[ok], ends[ok]
 
-    # tri par start
-    raw.sort(key=lambda x: (x["start"], x["end"]))
+    # tri stable par (start, end) — même ordre que list.sort(key=(start, end))
+    order = np.lexsort((ends, starts))
+    return [words[i] for i in order.tolist()], starts[order], ends[order]
 
-    # paramètres de smoothing
-    MIN_DUR = 0.16   # durée min "confortable" ~ 160 ms
-    MIN_GAP = 0.01   # petit gap entre deux mots
+def _fix_end(starts, ends):
+    # end <= start => start + MIN_DUR
+    return np.where(ends > starts, ends, starts + MIN_DUR)
 
-    # 1ère passe : garantir ordre & gap
-    for i, w in enumerate(raw):
-        if i == 0:
-            if w["end"] <= w["start"]:
-                w["end"] = w["start"] + MIN_DUR
-            continue
+def _repair_order(st, en):
+    """
+    1ère passe : start >= end précédent + MIN_GAP, end > start.
+    Récurrence séquentielle résolue par point fixe vectorisé : après k passes,
+    les k premiers mots sont définitifs ; les chaînes de chevauchement étant
+    courtes en pratique, on converge en 2-3 passes. Au-delà de _VEC_ROUNDS,
+    on termine en boucle simple depuis le premier mot encore instable.
+    """
+    s, e = st, _fix_end(st, en)
+    for _ in range(_VEC_ROUNDS):
+        floor = np.empty_like(s)
+        floor[0] = -np.inf
+        floor[1:] = e[:-1] + MIN_GAP
+        ns = np.where(st < floor, floor, st)
+        ne = _fix_end(ns, en)
+        changed = np.flatnonzero((ns != s) | (ne != e))
+        s, e = ns, ne
+        if not changed.size:
+            return s, e
+
+    st, en, s, e = st.tolist(), en.tolist(), s.tolist(), e.tolist()
+    for i in range(max(1, int(changed[0])), len(s)):
+        start = st[i]
+        if start < e[i - 1] + MIN_GAP:
+            start = e[i - 1] + MIN_GAP
+        s[i] = start
+        e[i] = en[i] if en[i] > start else start + MIN_DUR
+    return np.array(s), np.array(e)
+
+def _min_duration(s, e):
+    """
+    2ème passe : durée minimale par mot, sans décaler les starts suivants
+    (on borne avec le start du mot suivant, avec un petit gap).
+    """
+    desired = s + MIN_DUR
+    nxt = np.empty_like(s)
+    nxt[:-1] = s[1:] - MIN_GAP
+    nxt[-1] = np.inf
+    cand = np.minimum(desired, np.maximum(s + 0.05, nxt))
+    # phrase super serrée : on laisse au moins quelque chose de visible
+    cand = np.where(cand <= s, s + MIN_DUR * 0.6, cand)
+    # dernier mot : on peut l'étendre librement
+    cand[-1] = desired[-1]
+    return np.where(e >= desired, e, cand)
+
+def _clean_columns(arr):
+    """
+    Moteur de timing colonnaire : (words, starts, ends) avec
+      - ordre correct
+      - durée mini par mot
+      - pas de recouvrement hardcore
+    """
+    words, st, en = _columns(arr)
+    if not words:
+        return [], st, en
+    s, e = _repair_order(st, en)
+    return words, s, _min_duration(s, e)
 
-        prev = raw[i - 1]
-
-        # start ne doit pas revenir en arrière
-        if w["start"] < prev["start"]:
-            w["start"] = prev["start"]
-
-        # évite chevauchement violent
-        if w["start"] < prev["end"] + MIN_GAP:
-            w["start"] = prev["end"] + MIN_GAP
-
-        if w["end"] <= w["start"]:
-            w["end"] = w["start"] + MIN_DUR
-
-    # 2ème passe : durée minimale par mot,
-    # sans décaler les starts suivants (on borne avec le start du mot suivant)
-    n = len(raw)
-    for i, w in enumerate(raw):
-        desired_end = w["start"] + MIN_DUR
-        if w["end"] >= desired_end:
-            continue  # déjà assez long
-
-        if i < n - 1:
-            next_start = raw[i + 1]["start"]
-            # on garde un petit gap avant le mot suivant
-            max_end = max(w["start"] + 0.05, next_start - MIN_GAP)
-            w["end"] = min(desired_end, max_end)
-            # si malgré tout ça reste trop court (phrase super serrée),
-            # on laisse au moins quelque chose de visible
-            if w["end"] <= w["start"]:
-                w["end"] = w["start"] + MIN_DUR * 0.6
-        else:
-            # dernier mot : on peut l'étendre librement
-            w["end"] = desired_end
-
-    return raw
+def _clean(arr):
+    """
+    Normalise + répare les timings (cf. _clean_columns) ; renvoie des dicts
+    {"word","start","end"} comme avant.
+    """
+    words, s, e = _clean_columns(arr)
+    return [{"word": w, "start": a, "end": b} for w, a, b in zip(words, s.tolist(), e.tolist())]
 
 # ------------ génération ASS ------------
 
+_PUNCT_END = (".", "!", "?", "…", ":", ";")
+
+def _ass_color(c: str) -> str:
+    """&HAABBGGRR& (style) -> &HBBGGRR& (override de couleur inline)."""
+    hx = c.strip("&Hh")
+    return f"&H{hx[-6:]}&"
+
+def _groups(words, starts, ends, p: CapPreset):
+    """Découpe les mots en phrases [i0, i1) : nb de mots, nb de caractères, pauses, ponctuation."""
+    if p.max_words <= 1:
+        return [(i, i + 1) for i in range(len(words))]
+    gaps = np.empty_like(starts)
+    gaps[0] = 0.0
+    gaps[1:] = starts[1:] - ends[:-1]
+    cut_gap = (gaps > p.max_gap).tolist()
+
+    out, i0, chars = [], 0, 0
+    for i, w in enumerate(words):
+        n = i - i0
+        if n and (n >= p.max_words or cut_gap[i]
+                  or (p.max_chars and chars + 1 + len(w) > p.max_chars)
+                  or words[i - 1].endswith(_PUNCT_END)):
+            out.append((i0, i))
+            i0, chars = i, 0
+        chars += len(w) + (1 if i > i0 else 0)
+    out.append((i0, len(words)))
+    return out
+
+def _line_break(toks) -> int:
+    """Index du mot qui commence la 2e ligne (équilibre en nb de caractères)."""
+    total = sum(len(t) for t in toks)
+    acc, best, best_d = 0, len(toks), total
+    for j in range(1, len(toks)):
+        acc += len(toks[j - 1])
+        d = abs(total - 2 * acc)
+        if d < best_d:
+            best, best_d = j, d
+    return best
+
+def _phrase_text(toks, starts, ends, p: CapPreset) -> str:
+    """Texte d'un event phrase : mots échappés, retour ligne ASS éventuel, tags karaoké (centisecondes)."""
+    brk = _line_break(toks) if p.lines >= 2 and len(toks) > 1 else -1
+    if p.karaoke:
+        # cumul arrondi depuis le début de la phrase => pas de dérive des \k
+        cum = [round((t - starts[0]) * 100) for t in starts[1:] + ends[-1:]]
+        prev, parts = 0, []
+        for j, tok in enumerate(toks):
+            k = max(0, cum[j] - prev)
+            prev = max(prev, cum[j])
+            parts.append(("\\N" if j == brk else (" " if j else "")) + f"{{\\k{k}}}{tok}")
+        return "".join(parts)
+    return "".join(("\\N" if j == brk else (" " if j else "")) + tok for j, tok in enumerate(toks))
+
 def build_ass_from_srt(srt_text: str, preset: str = "default") -> str:
     """
     API attendue par main.py
     - srt_text = JSON complet (avec "words": [...]) OU array words[].
-    - Retourne un .ass : un mot à la fois, centré, fond jaune.
+    - preset   = caption_style ("default" : un mot à la fois ; "phrase", "karaoke", "two-line").
+    - Retourne un .ass centré, fond jaune.
     """
-    words = _parse_words(srt_text or "")
+    words, starts, ends = _clean_columns(_parse_raw(srt_text or ""))
     if not words:
         return ASS_HEADER
 
-    lines = []
-    for w in words:
-        st = w["start"]
-        en = w["end"]
-        tok = _escape(w["word"])
+    # style "pancarte" : fond jaune + texte noir, centré (override identique pour chaque event)
+    p = _preset(preset)
+    tag = "{\\an" + str(STYLE.align) + "\\bord" + str(STYLE.outline) + "\\shad" + str(STYLE.shadow)
+    if p.karaoke:
+        # \k : mot pas encore dit = SecondaryColour (\2c), mot dit = PrimaryColour (\1c)
+        tag += "\\1c" + _ass_color(STYLE.active) + "\\2c" + _ass_color(STYLE.primary)
+    tag += "}"
+
+    if p.max_words <= 1:
+        lines = [
+            f"Dialogue: 0,{a},{b},{STYLE.name},,{tag}{_escape(w)}"
+            for w, a, b in zip(words, _ass_times(starts), _ass_times(ends))
+        ]
+        return ASS_HEADER + "\n".join(lines)
+
+    spans = _groups(words, starts, ends, p)
+    firsts = np.array([a for a, _ in spans])
+    lasts = np.array([b - 1 for _, b in spans])
+    st, en = starts.tolist(), ends.tolist()
+    lines = [
+        f"Dialogue: 0,{a},{b},{STYLE.name},,{tag}"
+        + _phrase_text([_escape(w) for w in words[i0:i1]], st[i0:i1], en[i0:i1], p)
+        for (i0, i1), a, b in zip(spans, _ass_times(starts[firsts]), _ass_times(ends[lasts]))
+    ]
+    return ASS_HEADER + "\n".join(lines)
+
 
-        # style "pancarte" : fond jaune + texte noir, centré
-        ass_text = (
-            "{\\an" + str(STYLE.align) +
-            "\\bord" + str(STYLE.outline) +
-            "\\shad" + str(STYLE.shadow) +
-            "}" + tok
-        )
+# ------------ moteur sprites (alternative à libass) ------------
+# Chaque texte unique (mot ou phrase) est rendu UNE fois en PNG (cache disque partagé entre jobs),
+# puis incrusté avec overlay + enable=between(...) : plus de shaping de glyphes à chaque frame.
 
-        line = f"Dialogue: 0,{_ass_time(st)},{_ass_time(en)},{STYLE.name},,{ass_text}"
-        lines.append(line)
+MAX_SPRITES = int(os.getenv("CAPTIONS_MAX_SPRITES", "400"))
 
-    return ASS_HEADER + "\n".join(lines)
+def _ass_rgba(c: str):
+    """&HAABBGGRR& -> (r, g, b, a) avec a=255 opaque (l'alpha ASS est inversé)."""
+    hx = c.strip("&Hh").rjust(8, "0")
+    a, b, g, r = (int(hx[i:i + 2], 16) for i in range(0, 8, 2))
+    return r, g, b, 255 - a
+
+def _sprite_style(height: int) -> dict:
+    k = height / 1920.0  # PlayResY du header ASS
+    return dict(
+        fontsize=max(8, round(STYLE.size * k)),
+        text_rgb=_ass_rgba(STYLE.primary)[:3],
+        stroke_rgb=(0, 0, 0), stroke_width=0,
+        bg_rgba=_ass_rgba(STYLE.back),
+        radius=max(2, round(12 * k)),
+        pad=(max(2, round(STYLE.outline * 3 * k)), max(2, round(STYLE.outline * 2 * k))),
+    )
+
+def build_overlay_from_srt(srt_text: str, width: int, height: int, preset: str = "default"):
+    """
+    Moteur "overlay" : retourne (sprites, filter_script).
+      - sprites       : PNG à passer en entrées 1..N (l'entrée 0 est la vidéo)
+      - filter_script : graphe pour -filter_complex_script, sortie [v] (None si rien à incruster)
+    Les presets groupés donnent une phrase par sprite ; le surlignage karaoké n'existe
+    qu'en ASS (ici la phrase reste statique).
+    ValueError si trop de textes uniques (CAPTIONS_MAX_SPRITES) : utiliser libass.
+    """
+    from utils.text_overlay import text_png
+
+    words, starts, ends = _clean_columns(_parse_raw(srt_text or ""))
+    if not words:
+        return [], None
+    p = _preset(preset)
+
+    occ = {}
+    for i0, i1 in _groups(words, starts, ends, p):
+        toks = [html.unescape(w) for w in words[i0:i1]]
+        brk = _line_break(toks) if p.lines >= 2 and len(toks) > 1 else len(toks)
+        text = " ".join(toks[:brk]) + ("\n" + " ".join(toks[brk:]) if brk < len(toks) else "")
+        occ.setdefault(text, []).append((float(starts[i0]), float(ends[i1 - 1])))
+    if len(occ) > MAX_SPRITES:
+        raise ValueError(f"too many unique captions for overlay engine ({len(occ)} > {MAX_SPRITES})")
+
+    style = _sprite_style(height)
+    max_w = int(width * 0.9)
+    sprites = [text_png(text, max_w, **style) for text in occ]
+
+    chain, prev = [], "0:v"
+    for k, spans in enumerate(occ.values(), 1):
+        enable = "+".join(f"between(t,{a:.3f},{b:.3f})" for a, b in spans)
+        out = "v" if k == len(occ) else f"o{k}"
+        chain.append(f"[{prev}][{k}:v]overlay=x=(W-w)/2:y=(H-h)/2:enable='{enable}'[{out}]")
+        prev = out
+    return sprites, ";\n".join(chain)
@@ -0,0 +1,177 @@
+# delivery.py — livraison des webhooks / callbacks hors du thread de rendu
+# Outbox persistante : une livraison = un fichier JSON dans OUTBOX_DIR (survit à un redémarrage).
+# Un dispatcher en tâche de fond envoie via une session HTTP poolée, réessaie avec backoff
+# exponentiel, et remonte chaque changement d'état via on_status(job_id, kind, état).
+import os, json, time, random, tempfile, threading, logging, heapq
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import urllib.request, urllib.error
+
+OUTBOX_DIR = os.getenv("OUTBOX_DIR", os.path.join(tempfile.gettempdir(), "fusion_outbox"))
+DELIVERY_TIMEOUT = float(os.getenv("DELIVERY_TIMEOUT", "10"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "8"))
+DELIVERY_BACKOFF_BASE = float(os.getenv("DELIVERY_BACKOFF_BASE", "2"))     # 2, 4, 8… s
+DELIVERY_BACKOFF_MAX = float(os.getenv("DELIVERY_BACKOFF_MAX", "600"))
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))  # un endpoint lent ne bloque pas les autres
+# traces des échecs définitifs (OUTBOX_DIR/failed) : âge et nombre bornés ; 0 => critère désactivé
+DELIVERY_FAILED_RETENTION_SEC = float(os.getenv("DELIVERY_FAILED_RETENTION_SEC", str(7 * 86400)))
+DELIVERY_FAILED_MAX = int(os.getenv("DELIVERY_FAILED_MAX", "1000"))
+
+log = logging.getLogger("delivery")
+on_status: Callable[[Optional[str], str, Dict[str, Any]], None] = lambda job_id, kind, state: None
+
+_cv = threading.Condition()
+_heap: list = []          # (next_at, id)
+_started = False
+_session = None
+
+
+def _path(did: str, sub: str = "") -> str:
+    d = os.path.join(OUTBOX_DIR, sub)
+    os.makedirs(d, exist_ok=True)
+    return os.path.join(d, f"{did}.json")
+
+def _save(item: Dict[str, Any], sub: str = ""):
+    p = _path(item["id"], sub)
+    tmp = f"{p}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(item, f, ensure_ascii=False)
+    os.replace(tmp, p)
+
+def _http():
+    # requests importé au premier envoi (pas au démarrage) ; absent => urllib
+    global _session
+    if _session is None:
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+        except Exception:
+            _session = False
+            return None
+        s = requests.Session()
+        s.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=DELIVERY_WORKERS))
+        s.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=DELIVERY_WORKERS))
+        _session = s
+    return _session or None
+
+def _post(url: str, payload: Dict[str, Any]) -> int:
+    s = _http()
+    if s is not None:
+        return s.post(url, json=payload, timeout=DELIVERY_TIMEOUT).status_code
+    req = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=DELIVERY_TIMEOUT) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def prune_failed() -> int:
+    """OUTBOX_DIR/failed : supprime les traces trop vieilles puis les plus anciennes au-delà du max."""
+    d = os.path.join(OUTBOX_DIR, "failed")
+    try:
+        names = os.listdir(d)
+    except OSError:
+        return 0
+    entries = []
+    for name in names:
+        p = os.path.join(d, name)
+        try:
+            entries.append((os.path.getmtime(p), p))
+        except OSError:
+            pass
+    entries.sort()
+    now = time.time()
+    old = [p for m, p in entries if DELIVERY_FAILED_RETENTION_SEC > 0 and now - m > DELIVERY_FAILED_RETENTION_SEC]
+    rest = entries[len(old):]
+    drop = old + ([p for _, p in rest[:len(rest) - DELIVERY_FAILED_MAX]] if DELIVERY_FAILED_MAX > 0 else [])
+    n = 0
+    for p in drop:
+        try:
+            os.remove(p); n += 1
+        except OSError:
+            pass
+    return n
+
+def _report(item: Dict[str, Any]):
+    try:
+        on_status(item.get("job_id"), item["kind"], {k: item.get(k) for k in
+                  ("id", "status", "attempts", "last_error", "delivered_at", "next_at")})
+    except Exception:
+        log.exception("delivery on_status failed")
+
+
+def enqueue(url: str, payload: Dict[str, Any], job_id: Optional[str] = None, kind: str = "webhook") -> str:
+    """Persiste la livraison puis rend la main tout de suite ; l'envoi se fait en tâche de fond."""
+    start()
+    item = {"id": uuid4().hex, "url": url, "payload": payload, "job_id": job_id, "kind": kind,
+            "status": "pending", "attempts": 0, "next_at": time.time(), "created_at": int(time.time())}
+    _save(item)
+    _report(item)
+    with _cv:
+        heapq.heappush(_heap, (item["next_at"], item["id"]))
+        _cv.notify()
+    return item["id"]
+
+def _attempt(did: str):
+    try:
+        with open(_path(did), encoding="utf-8") as f:
+            item = json.load(f)
+    except (OSError, ValueError):
+        return
+    item["attempts"] += 1
+    try:
+        code = _post(item["url"], item["payload"])
+        err = None if 200 <= code < 300 else f"HTTP {code}"
+        # 4xx (hors 408/429) : l'endpoint refuse la requête, réessayer ne changera rien
+        permanent = err is not None and 400 <= code < 500 and code not in (408, 429)
+    except Exception as e:
+        err, permanent = f"{type(e).__name__}: {e}", False
+
+    if err is None:
+        item.update(status="delivered", last_error=None, delivered_at=int(time.time()))
+        os.remove(_path(did))
+    elif permanent or item["attempts"] >= DELIVERY_MAX_ATTEMPTS:
+        item.update(status="failed", last_error=err)
+        _save(item, "failed")          # trace conservée dans OUTBOX_DIR/failed (bornée)
+        os.remove(_path(did))
+        prune_failed()
+        log.warning(f"[{item.get('job_id')}] {item['kind']} delivery failed after {item['attempts']} attempt(s): {err}")
+    else:
+        delay = min(DELIVERY_BACKOFF_MAX, DELIVERY_BACKOFF_BASE * 2 ** (item["attempts"] - 1))
+        item.update(status="retrying", last_error=err, next_at=time.time() + delay * random.uniform(0.8, 1.2))
+        _save(item)
+        with _cv:
+            heapq.heappush(_heap, (item["next_at"], did))
+            _cv.notify()
+    _report(item)
+
+def _dispatch():
+    pool = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="delivery")
+    while True:
+        with _cv:
+            while not _heap or _heap[0][0] > time.time():
+                _cv.wait(timeout=(_heap[0][0] - time.time()) if _heap else None)
+            _, did = heapq.heappop(_heap)
+        pool.submit(_attempt, did)
+
+def start():
+    """Démarre le dispatcher (une fois) et recharge l'outbox laissée par un process précédent."""
+    global _started
+    with _cv:
+        if _started:
+            return
+        _started = True
+        os.makedirs(OUTBOX_DIR, exist_ok=True)
+        for name in os.listdir(OUTBOX_DIR):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(OUTBOX_DIR, name), encoding="utf-8") as f:
+                        item = json.load(f)
+                    heapq.heappush(_heap, (item.get("next_at", 0), item["id"]))
+                except (OSError, ValueError, KeyError):
+                    pass
+    prune_failed()
+    threading.Thread(target=_dispatch, name="delivery-dispatch", daemon=True).start()
@@ -0,0 +1,77 @@
+# encode_profile.py — choix du profil x264 par job (échéance, priorité, file d'attente, vitesse mesurée)
+# Les profils vont du plus rapide au plus soigné ; "superfast" = réglages historiques.
+# La vitesse est mesurée à chaque rendu (EWMA) en "secondes 1080x1920@30 superfast par seconde réelle",
+# ce qui permet d'estimer la durée d'un job pour chaque profil.
+import os, threading
+from typing import Any, Dict, Optional, Tuple
+
+def _x264(preset: str, crf: int) -> str:
+    return f"-c:v libx264 -preset {preset} -crf {crf}"
+
+# segment = parts du plan ; captions = passe d'incrustation ; cost = temps relatif à "superfast"
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "ultrafast": {"segment": _x264("ultrafast", 27), "captions": _x264("ultrafast", 23), "cost": 0.6},
+    "superfast": {"segment": _x264("superfast", 26), "captions": _x264("veryfast", 22), "cost": 1.0},
+    "veryfast":  {"segment": _x264("veryfast", 25),  "captions": _x264("faster", 22),   "cost": 1.4},
+    "faster":    {"segment": _x264("faster", 24),    "captions": _x264("fast", 21),     "cost": 2.2},
+}
+ORDER = ("ultrafast", "superfast", "veryfast", "faster")
+DEFAULT = os.getenv("ENCODE_PROFILE", "superfast")
+IDLE_PROFILE = os.getenv("ENCODE_PROFILE_IDLE", "veryfast")      # machine libre : meilleur ratio taille/qualité
+BACKLOG_JOBS = int(os.getenv("ENCODE_BACKLOG_JOBS", "3"))          # file >= N : on passe en ultrafast
+DEADLINE_MARGIN = 0.75                                              # on vise 75 % de l'échéance restante
+
+_lock = threading.Lock()
+_speed = float(os.getenv("ENCODE_SPEED_INIT", "0.8"))  # estimation de départ, remplacée par la mesure
+_samples = 0
+
+def speed() -> float:
+    return _speed
+
+def record(profile: str, work: float, wall_sec: float):
+    """
+    work : coût du rendu en secondes 1080x1920@30 (styles.estimate_cost), wall_sec : durée réelle.
+    Met à jour l'EWMA de vitesse, ramenée au profil de référence.
+    """
+    global _speed, _samples
+    if work <= 0 or wall_sec <= 0.5 or profile not in PROFILES:
+        return
+    s = work * PROFILES[profile]["cost"] / wall_sec
+    with _lock:
+        _speed = s if _samples == 0 else 0.7 * _speed + 0.3 * s
+        _samples += 1
+
+def estimate_wall(profile: str, work: float) -> float:
+    return work * PROFILES[profile]["cost"] / max(1e-3, _speed)
+
+def _shift(name: str, step: int) -> str:
+    i = min(len(ORDER) - 1, max(0, ORDER.index(name) + step))
+    return ORDER[i]
+
+def choose(work: float, deadline_sec: Optional[float] = None, priority: Optional[str] = None,
+           queue_depth: int = 0, forced: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Retourne (profil, raison).
+      forced       : profil imposé par la requête (encode_profile)
+      deadline_sec : temps restant avant échéance => profil le plus soigné qui tient dans la marge
+      queue_depth  : jobs en attente ; backlog => ultrafast, file vide => IDLE_PROFILE
+      priority     : "high" => un cran plus rapide, "low" => un cran plus soigné (hors backlog)
+    """
+    if forced in PROFILES:
+        return forced, "forced"
+    if queue_depth >= BACKLOG_JOBS:
+        return ORDER[0], f"backlog({queue_depth})"
+    if deadline_sec is not None:
+        budget = max(0.0, deadline_sec) * DEADLINE_MARGIN
+        fits = [p for p in ORDER if estimate_wall(p, work) <= budget]
+        if not fits:
+            return ORDER[0], f"deadline({deadline_sec:.0f}s) serrée"
+        return fits[-1], f"deadline({deadline_sec:.0f}s)"
+    name = IDLE_PROFILE if queue_depth == 0 else DEFAULT
+    reason = "idle" if queue_depth == 0 else f"queue({queue_depth})"
+    p = str(priority or "").strip().lower()
+    if p == "high":
+        name, reason = _shift(name, -1), reason + "+high"
+    elif p == "low":
+        name, reason = _shift(name, +1), reason + "+low"
+    return (name if name in PROFILES else DEFAULT), reason
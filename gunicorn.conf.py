@@ -0,0 +1,25 @@
+# gunicorn.conf.py — lancement prod : gunicorn -c gunicorn.conf.py main:app
+# Un seul process (JOBS / dédup / ordonnanceur vivent en mémoire), beaucoup de threads :
+# un thread web qui attend un rendu sync ne coûte rien, et /jobs, /healthz restent servis.
+# Le nombre de rendus simultanés est borné par MAX_CONCURRENT_JOBS (main.SCHEDULER), pas ici.
+# Rendus sync en attente bornés à SYNC_MAX_INFLIGHT (défaut : threads - 4, au-delà 503) : il reste
+# toujours des threads pour /jobs et /healthz.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+# gthread : timeout = heartbeat du worker, pas la durée max d'une requête (rendus sync de plusieurs minutes OK)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# uploads streamés dans SPOOL_DIR ; fichiers temporaires de gunicorn en RAM si dispo
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+def post_worker_init(worker):
+    # reprise des jobs, outbox, purges, préchauffage : dans le worker qui sert, pas à l'import de main
+    from main import startup
+    startup()
@@ -0,0 +1,140 @@
+# hls.py — sources HLS (.m3u8) préchargées au lieu d'être lues en direct par ffmpeg
+# Seuls les segments qui couvrent la durée utile sont téléchargés, en parallèle, puis remuxés
+# (copie, sans ré-encodage) en un mp4 local publié dans le cache partagé (namespace "hls_src").
+# L'encodage x264 lit alors un fichier local : un CDN lent ne le fait plus attendre.
+# Cas non gérés (chiffrement AES, byte-ranges) : prefetch() renvoie None => lecture directe comme avant.
+import os, re, shlex, shutil, subprocess, tempfile, time, logging, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from cache import key_of, get_or_create
+import joblog
+
+HLS_PREFETCH = os.getenv("HLS_PREFETCH", "1") == "1"
+HLS_WORKERS = int(os.getenv("HLS_WORKERS", "6"))
+HLS_TIMEOUT = float(os.getenv("HLS_TIMEOUT", "20"))
+HLS_RETRIES = int(os.getenv("HLS_RETRIES", "3"))
+HLS_MAX_HEIGHT = int(os.getenv("HLS_MAX_HEIGHT", "1920"))  # variante la plus haute sans dépasser
+UA = "Mozilla/5.0 (compatible; RenderBot/1.0)"
+
+_ATTR = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def is_hls(url: str) -> bool:
+    low = (url or "").lower()
+    return low.startswith("http") and ".m3u8" in low
+
+def _get(url: str) -> bytes:
+    last = None
+    for attempt in range(HLS_RETRIES):
+        try:
+            req = urllib.request.Request(url, headers={"User-Agent": UA})
+            with urllib.request.urlopen(req, timeout=HLS_TIMEOUT) as r:
+                return r.read()
+        except Exception as e:
+            last = e
+            time.sleep(0.5 * 2 ** attempt)
+    raise RuntimeError(f"HLS GET {url}: {last}")
+
+def _attrs(line: str) -> Dict[str, str]:
+    return {k: v.strip('"') for k, v in _ATTR.findall(line.split(":", 1)[1] if ":" in line else "")}
+
+def _pick_variant(url: str, lines: List[str]) -> str:
+    """Playlist maître : variante de plus haut débit dont la hauteur tient dans HLS_MAX_HEIGHT."""
+    best: Tuple[int, int, str] = (-1, -1, "")
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-STREAM-INF") and i + 1 < len(lines):
+            a = _attrs(line)
+            h = int((a.get("RESOLUTION", "0x0").split("x") + ["0"])[1] or 0)
+            fits = 1 if h <= HLS_MAX_HEIGHT else 0
+            cand = (fits, int(a.get("BANDWIDTH", "0") or 0), urljoin(url, lines[i + 1]))
+            best = max(best, cand)
+    return best[2]
+
+def playlist(url: str, need_dur: float) -> Dict[str, object]:
+    """
+    Résout maître -> média et retourne {"url", "init", "segments": [(uri, durée)], "total"}
+    limité aux segments couvrant need_dur. ValueError si la playlist n'est pas préchargeable.
+    """
+    for _ in range(3):   # maître -> média (au plus un niveau en pratique)
+        lines = [l.strip() for l in _get(url).decode("utf-8", "replace").splitlines() if l.strip()]
+        if not lines or lines[0] != "#EXTM3U":
+            raise ValueError("pas une playlist m3u8")
+        if not any(l.startswith("#EXT-X-STREAM-INF") for l in lines):
+            break
+        url = _pick_variant(url, lines)
+        if not url:
+            raise ValueError("playlist maître sans variante")
+    init, segs, dur, total = None, [], None, 0.0
+    for line in lines:
+        if line.startswith("#EXT-X-KEY") and _attrs(line).get("METHOD", "NONE") != "NONE":
+            raise ValueError("HLS chiffré")
+        if line.startswith("#EXT-X-BYTERANGE"):
+            raise ValueError("HLS byte-range")
+        if line.startswith("#EXT-X-MAP"):
+            a = _attrs(line)
+            if "BYTERANGE" in a:
+                raise ValueError("HLS byte-range")
+            init = urljoin(url, a["URI"])
+        elif line.startswith("#EXTINF:"):
+            dur = float(line[8:].split(",")[0] or 0)
+        elif not line.startswith("#") and dur is not None:
+            if total >= need_dur > 0:
+                break
+            segs.append((urljoin(url, line), dur))
+            total, dur = total + dur, None
+    if not segs:
+        raise ValueError("playlist sans segment")
+    return {"url": url, "init": init, "segments": segs, "total": total}
+
+def prefetch(url: str, need_dur: float, logger: logging.Logger, req_id: str) -> Optional[str]:
+    """
+    Mp4 local (cache partagé) avec les need_dur premières secondes du flux, ou None => lecture directe.
+    La clé porte sur les URI des segments : même flux + même couverture => aucun re-téléchargement.
+    """
+    if not HLS_PREFETCH:
+        return None
+    try:
+        pl = playlist(url, need_dur)
+    except Exception as e:
+        logger.warning(f"[{req_id}] HLS non préchargeable ({e}) -> lecture directe {url}")
+        return None
+    uris = ([pl["init"]] if pl["init"] else []) + [u for u, _ in pl["segments"]]
+
+    def _fetch(tmp: str):
+        t0 = time.time()
+        work = tempfile.mkdtemp(prefix="hls_", dir=os.path.dirname(tmp))
+        try:
+            def _one(i_uri):
+                i, uri = i_uri
+                p = os.path.join(work, f"{i:05d}.seg")
+                with open(p, "wb") as f:
+                    f.write(_get(uri))
+                return p
+            with ThreadPoolExecutor(max_workers=max(1, HLS_WORKERS), thread_name_prefix="hls") as pool:
+                files = list(pool.map(_one, enumerate(uris)))
+            # TS (ou init + fragments fMP4) : la simple concaténation des octets est un flux valide
+            joined = os.path.join(work, "joined" + (".mp4" if pl["init"] else ".ts"))
+            with open(joined, "wb") as out:
+                for p in files:
+                    with open(p, "rb") as f:
+                        shutil.copyfileobj(f, out)
+            size = os.path.getsize(joined)
+            cmd = (f"ffmpeg -y -hide_banner -loglevel error -i {shlex.quote(joined)} "
+                   f"-map 0:v:0 -c copy -avoid_negative_ts make_zero -movflags +faststart -f mp4 {shlex.quote(tmp)}")
+            logger.debug(f"[{req_id}] CMD: {cmd}")
+            p = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            joblog.capture(req_id, cmd, p.stdout, p.returncode)
+            if p.returncode != 0:
+                raise RuntimeError(f"Command failed: {cmd}\n{p.stdout}")
+            logger.info(f"[{req_id}] HLS préchargé: {len(files)} fichiers, {size} o, "
+                        f"{pl['total']:.1f}s de flux en {time.time() - t0:.2f}s")
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    try:
+        return get_or_create("hls_src", key_of("hls_src/v1", pl["url"], tuple(uris)), ".mp4", _fetch)
+    except Exception as e:
+        logger.warning(f"[{req_id}] préchargement HLS échoué ({e}) -> lecture directe {url}")
+        return None
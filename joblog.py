@@ -0,0 +1,135 @@
+# joblog.py — logs non bloquants + journal borné par job
+# Les threads de rendu ne font qu'un put() dans une queue (QueueHandler) ; un seul thread écrit sur stdout
+# (JSON par ligne, avec req_id et stage). Chaque job a en plus un ring buffer en mémoire (ses logs + la
+# sortie des commandes ffmpeg) : consultable via /jobs/<id>/logs, écrit sur disque seulement en cas d'échec.
+import os, re, sys, json, time, copy, queue, atexit, logging, threading
+from collections import OrderedDict, deque
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()             # "json" | "text"
+JOB_LOG_LINES = int(os.getenv("JOB_LOG_LINES", "500"))          # entrées gardées par job
+JOB_LOG_JOBS = int(os.getenv("JOB_LOG_JOBS", "256"))            # jobs gardés en mémoire (LRU)
+JOB_LOG_CMD_LINES = int(os.getenv("JOB_LOG_CMD_LINES", "40"))   # lignes de sortie gardées par commande
+
+_REQ = re.compile(r"^\[([^\]\s]+)\]")
+_local = threading.local()
+_lock = threading.Lock()
+_rings: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()   # req_id -> {"stage", "lines": deque}
+_listener: Optional[QueueListener] = None
+
+
+def _ring(req_id: str) -> Dict[str, Any]:
+    # appelé sous _lock
+    r = _rings.get(req_id)
+    if r is None:
+        r = _rings[req_id] = {"stage": None, "lines": deque(maxlen=JOB_LOG_LINES)}
+        while len(_rings) > JOB_LOG_JOBS:
+            _rings.popitem(last=False)
+    else:
+        _rings.move_to_end(req_id)
+    return r
+
+def bind(req_id: Optional[str]):
+    """req_id du thread courant (requête HTTP ou job) : ajouté aux logs qui ne l'ont pas en préfixe."""
+    _local.req_id = req_id
+
+def set_stage(req_id: str, stage: Optional[str]):
+    with _lock:
+        _ring(req_id)["stage"] = stage
+
+def _entry(ts: float, level: str, msg: str, req_id: Optional[str], stage: Optional[str], **extra) -> Dict[str, Any]:
+    return {"ts": round(ts, 3), "level": level, "req_id": req_id, "stage": stage, "msg": msg, **extra}
+
+def capture(req_id: str, cmd: str, output: str, returncode: int):
+    """Commande + fin de sa sortie dans le ring du job (jamais sur stdout au niveau INFO)."""
+    lines = (output or "").rstrip().splitlines()
+    if len(lines) > JOB_LOG_CMD_LINES:
+        lines = [f"... {len(lines) - JOB_LOG_CMD_LINES} lignes omises"] + lines[-JOB_LOG_CMD_LINES:]
+    with _lock:
+        r = _ring(req_id)
+        r["lines"].append(_entry(time.time(), "CMD", cmd, req_id, r["stage"], rc=returncode, output=lines))
+
+def tail(req_id: str, n: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    with _lock:
+        r = _rings.get(req_id)
+        lines = list(r["lines"]) if r else None
+    return lines[-n:] if lines is not None and n else lines
+
+def dump(req_id: str, path: str) -> Optional[str]:
+    """Ring du job -> fichier JSON lines (appelé quand le job échoue)."""
+    lines = tail(req_id)
+    if not lines:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for e in lines:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    return path
+
+def load(path: str, n: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = [json.loads(l) for l in f if l.strip()]
+    except (OSError, ValueError):
+        return None
+    return lines[-n:] if n else lines
+
+
+class _Context(logging.Filter):
+    # côté producteur (thread du job) : req_id depuis extra=, le thread, ou le préfixe "[req_id]" du message
+    def filter(self, record: logging.LogRecord) -> bool:
+        rid = getattr(record, "req_id", None) or getattr(_local, "req_id", None)
+        if not rid:
+            m = _REQ.match(str(record.msg))
+            rid = m.group(1) if m else None
+        record.req_id = rid
+        with _lock:
+            r = _rings.get(rid) if rid else None
+            record.stage = getattr(record, "stage", None) or (r["stage"] if r else None)
+        return True
+
+class _Json(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        e = _entry(record.created, record.levelname, record.getMessage(), record.req_id, record.stage,
+                   logger=record.name)
+        if record.exc_info:
+            e["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            e["exc"] = record.exc_text
+        return json.dumps(e, ensure_ascii=False)
+
+class _Queue(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # message et traceback figés ici (les objets ne traversent pas la queue), exception à part du msg
+        exc = logging.Formatter().formatException(record.exc_info) if record.exc_info else record.exc_text
+        record = copy.copy(record)
+        record.msg, record.args, record.exc_info, record.exc_text = record.getMessage(), None, None, exc
+        if record.req_id:
+            # ring du job rempli ici (deque, coût négligeable) : dans l'ordre exact des capture()
+            e = _entry(record.created, record.levelname, record.msg, record.req_id, record.stage)
+            if exc:
+                e["exc"] = exc
+            with _lock:
+                _ring(record.req_id)["lines"].append(e)
+        return record
+
+def setup(level: str = "INFO"):
+    """Remplace les handlers du root logger par QueueHandler (+ rings) -> thread d'écriture stdout. Idempotent."""
+    global _listener
+    if _listener is not None:
+        return
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(_Json() if LOG_FORMAT == "json"
+                     else logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    _listener = QueueListener(q, out)
+    qh = _Queue(q)
+    qh.addFilter(_Context())
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(level)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,25 +1,28 @@
 # main.py — API sync + async (jobs) pour création vidéo, sans sous-titres (full encode dans le job)
-import os, json, time, tempfile, logging, shutil, subprocess, traceback, random, re
+import os, json, time, tempfile, logging, shutil, subprocess, traceback, random, re, hashlib
 from uuid import uuid4
 from typing import Any, Dict, List, Optional, Tuple
-from flask import Flask, request, jsonify, g
+from flask import Flask, Request, request, jsonify, g
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from threading import Thread, Lock
-try:
-    import requests as _requests
-except Exception:
-    _requests = None
-import urllib.request, urllib.error
+from threading import BoundedSemaphore, Lock, Thread, local
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request, urllib.error, urllib.parse
 
-from video_generator import generate_video
-from captions import build_ass_from_srt
-
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from video_generator import generate_video, run_cmd, cancel_job, start_job, end_job, check_cancelled, JobCancelled, concat_stats
+from video_generator import parse_renditions, rendition_graph, render_renditions
+import music_store, delivery, encode_profile, joblog, cache
+from styles import estimate_cost
+# google-api-client, captions (numpy) : importés au premier usage (démarrage à froid plus court)
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 KEEP_TMP  = os.getenv("KEEP_TMP", "1") == "1"
+CAPTIONS_ENGINE = os.getenv("CAPTIONS_ENGINE", "ass")  # "ass" (libass) | "overlay" (sprites PNG)
+# uploads : écrits directement dans SPOOL_DIR pendant le parsing multipart (ni RAM ni copie)
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "fusion_spool"))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "200"))  # corps de requête complet / audio par URL
+MAX_FORM_MB = int(os.getenv("MAX_FORM_MB", "16"))       # champs texte (plan, srt_text…)
+os.makedirs(SPOOL_DIR, exist_ok=True)
 
 # Fallback global vers ton webhook Make si rien n'est fourni dans la requête
 # (tu peux aussi le surcharger via la variable d'env FINISH_WEBHOOK)
@@ -28,12 +31,58 @@ DEFAULT_FINISH_WEBHOOK = os.getenv(
     "https://hook.eu2.make.com/5mjade7l6ys678hrwenbtvxc645y2hlx"
 )
 
+class _SpoolFile:
+    """Fichier d'upload dans le spool ; sha256 calculé au fil de l'écriture (pas de relecture)."""
+    def __init__(self, path: str):
+        self.name = path
+        self.sha256 = hashlib.sha256()
+        self._f = open(path, "w+b")
+    def write(self, b) -> int:
+        self.sha256.update(b)
+        return self._f.write(b)
+    def __getattr__(self, attr):
+        return getattr(self._f, attr)
+    def __iter__(self):
+        return iter(self._f)
+
+class SpoolRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        fd, path = tempfile.mkstemp(prefix="up_", dir=SPOOL_DIR)
+        os.close(fd)
+        self.__dict__.setdefault("_spooled", []).append(path)
+        return _SpoolFile(path)
+
 app = Flask(__name__)
-logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(message)s")
+app.request_class = SpoolRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB << 20
+app.config["MAX_FORM_MEMORY_SIZE"] = MAX_FORM_MB << 20
+# logs : queue non bloquante -> stdout en JSON (LOG_FORMAT), + ring buffer par job (GET /jobs/<id>/logs)
+joblog.setup(LOG_LEVEL)
 app.logger.setLevel(LOG_LEVEL)
 
 JOBS: Dict[str, Dict[str, Any]] = {}
 JLOCK = Lock()
+# ordonnanceur : au plus MAX_CONCURRENT_JOBS rendus ffmpeg à la fois (sync + async), le reste attend en file.
+# Les threads web ne font qu'attendre => /jobs et /healthz restent toujours servis.
+MAX_CONCURRENT_JOBS = max(1, int(os.getenv("MAX_CONCURRENT_JOBS", "2")))
+SCHEDULER = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="render")
+# rendus sync simultanés (chacun bloque un thread web) : on garde des threads libres pour /jobs, /healthz…
+SYNC_MAX_INFLIGHT = int(os.getenv("SYNC_MAX_INFLIGHT", str(max(1, int(os.getenv("GUNICORN_THREADS", "32")) - 4))))
+SYNC_SLOTS = BoundedSemaphore(SYNC_MAX_INFLIGHT)
+FUTURES: Dict[str, Any] = {}  # job_id -> Future (annulation d'un job encore en file)
+# dédup : empreinte de requête -> job_id (sous JLOCK) ; un résultat réussi reste réutilisable DEDUP_TTL_SEC
+DEDUP_TTL_SEC = int(os.getenv("DEDUP_TTL_SEC", "3600"))  # 0 => dédup désactivée
+FINGERPRINTS: Dict[str, str] = {}
+# champs d'entrée des jobs async (non exposés) : base des re-rendus incrémentaux (PATCH / base_job_id)
+JOB_FIELDS: Dict[str, Dict[str, Any]] = {}
+# jobs async persistés (JOBS_DIR/<job_id>/ : fields.json, state.json, manifest.json, work/) :
+# au démarrage, les jobs inachevés reprennent à la dernière étape / au dernier segment terminé.
+# JOBS_DIR et SPOOL_DIR doivent être sur un disque qui survit au redémarrage.
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(tempfile.gettempdir(), "fusion_jobs"))
+JOBS_RETENTION_SEC = int(os.getenv("JOBS_RETENTION_SEC", str(7 * 86400)))
+JOBS_PRUNE_EVERY_SEC = float(os.getenv("JOBS_PRUNE_EVERY_SEC", "3600"))   # purge des jobs terminés expirés
+RESUME_JOBS = os.getenv("RESUME_JOBS", "1") == "1"
+_JOB_ID = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}")
 
 def _parse_int(s: Any, default: int) -> int:
     try: return int(s)
@@ -43,30 +92,100 @@ def _parse_float(s: Any, default: float) -> float:
     try: return float(s)
     except Exception: return default
 
+def _parse_flag(s: Any) -> Optional[bool]:
+    # None => défaut serveur (env) ; "1"/"true"/"on"/"yes" => True ; le reste => False
+    if s is None or str(s).strip() == "": return None
+    return str(s).strip().lower() in ("1", "true", "on", "yes")
+
+def _pick_profile(plan: List[Dict[str, Any]], style: Optional[str], width: int, height: int, fps: int,
+                  captions: bool, deadline_sec: Any = None, priority: Optional[str] = None,
+                  forced: Optional[str] = None, enqueued_at: Optional[float] = None,
+                  jid: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Profil x264 du job (encode_profile.choose) : travail estimé (secondes 1080x1920@30, styles.estimate_cost),
+    échéance restante (deadline_sec depuis la soumission), priorité, profondeur de la file.
+    """
+    durs = [max(0.5, _parse_float(seg.get("duration"), 0.0)) for seg in plan]
+    work = sum(estimate_cost(style or "default", d, width, height, fps) for d in durs)
+    if captions:
+        work += estimate_cost("default", sum(durs), width, height, fps)
+    with JLOCK:
+        depth = sum(1 for k, j in JOBS.items() if j.get("status") == "queued" and k != jid)
+    remaining = None
+    if deadline_sec not in (None, ""):
+        remaining = _parse_float(deadline_sec, 0.0) - (time.time() - enqueued_at if enqueued_at else 0.0)
+    name, reason = encode_profile.choose(work, remaining, priority, depth, forced)
+    return {"profile": name, "reason": reason, "queue_depth": depth, "work": round(work, 2),
+            "est_wall": round(encode_profile.estimate_wall(name, work), 1)}
+
+def _record_speed(enc: Dict[str, Any], gen_debug: Dict[str, Any]):
+    # vitesse réelle => EWMA de la politique + trace dans le job. Travail et durée sur le même périmètre :
+    # les parts encodés par generate_video (ni captions, ni téléchargements, ni parts réutilisés)
+    work, wall = gen_debug.get("style_cost") or 0.0, gen_debug.get("encode_sec") or 0.0
+    encode_profile.record(enc["profile"], work, wall)
+    enc.update(encoded_work=round(work, 2), wall=round(wall, 2), speed_x=round(work / wall, 2) if wall > 0 else None)
+
 # -------------------- CORRECTION (impersonation) --------------------
+_DRIVE = local()  # un client par thread : httplib2 n'est pas thread-safe
+
 def _gdrive_service():
     """
     Utilise le Service Account avec Domain-Wide Delegation pour créer les fichiers
     AU NOM de l'utilisateur Workspace (owner_email).
+    Client construit au premier usage dans chaque thread, puis réutilisé.
     """
-    path = os.getenv("GOOGLE_CREDS", "/etc/secrets/credentials.json")
-    scopes = ["https://www.googleapis.com/auth/drive"]
-    owner_email = os.getenv("OWNER_EMAIL", "ktrium@wwwjeneveuxpastravailler.com")
-    creds = Credentials.from_service_account_file(path, scopes=scopes, subject=owner_email)
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    svc = getattr(_DRIVE, "svc", None)
+    if svc is None:
+        from google.oauth2.service_account import Credentials
+        from googleapiclient.discovery import build
+        path = os.getenv("GOOGLE_CREDS", "/etc/secrets/credentials.json")
+        scopes = ["https://www.googleapis.com/auth/drive"]
+        owner_email = os.getenv("OWNER_EMAIL", "ktrium@wwwjeneveuxpastravailler.com")
+        creds = Credentials.from_service_account_file(path, scopes=scopes, subject=owner_email)
+        svc = _DRIVE.svc = build("drive", "v3", credentials=creds, cache_discovery=False)
+    return svc
 # --------------------------------------------------------------------
 
-def _gdrive_upload(file_path: str, file_name: str, folder_id: Optional[str], logger, req_id: str):
+def _gdrive_upload(file_path: str, file_name: str, folder_id: Optional[str], logger, req_id: str,
+                   mimetype: str = "video/mp4"):
+    from googleapiclient.http import MediaFileUpload
     svc = _gdrive_service()
     meta = {"name": file_name}
     if folder_id: meta["parents"] = [folder_id]
-    media = MediaFileUpload(file_path, mimetype="video/mp4", resumable=False)
+    media = MediaFileUpload(file_path, mimetype=mimetype, resumable=False)
     resp = svc.files().create(body=meta, media_body=media,
                               fields="id,webViewLink,webContentLink",
                               supportsAllDrives=True).execute()
     logger.info(f"[{req_id}] gdrive upload ok id={resp.get('id')} webViewLink={resp.get('webViewLink')}")
     return resp
 
+_MIME = {".mp4": "video/mp4", ".jpg": "image/jpeg", ".webp": "image/webp"}
+
+def _rendition_item(r: Dict[str, Any], output_name: str) -> Dict[str, Any]:
+    # nom Drive à côté du fichier principal : '<nom>_720x1280.mp4', '<nom>_poster.jpg'…
+    item = {k: v for k, v in r.items() if k != "path"}
+    item.update(output_path=r["path"],
+                file_name=f"{os.path.splitext(output_name)[0]}_{r['name']}{os.path.splitext(r['path'])[1]}")
+    return item
+
+def _upload_renditions(files: List[Dict[str, Any]], output_name: str, folder_id: Optional[str],
+                       req_id: str) -> List[Dict[str, Any]]:
+    """Upload de chaque rendition ; un échec est noté sur la rendition, sans faire échouer le job."""
+    out = []
+    for r in files:
+        item = _rendition_item(r, output_name)
+        try:
+            gd = _gdrive_upload(r["path"], item["file_name"], folder_id, app.logger, req_id,
+                                mimetype=_MIME.get(os.path.splitext(r["path"])[1], "application/octet-stream"))
+            item.update(drive_file_id=gd.get("id"), drive_webViewLink=gd.get("webViewLink"))
+        except JobCancelled:
+            raise
+        except Exception as e:
+            app.logger.exception(f"[{req_id}] drive upload rendition {item['file_name']} failed: {e}")
+            item["drive_error"] = str(e)
+        out.append(item)
+    return out
+
 def _gdrive_pick_and_download_music(folder_id: str, workdir: str, logger, req_id: str) -> Tuple[Optional[str], int]:
     try:
         svc = _gdrive_service()
@@ -79,7 +198,7 @@ def _gdrive_pick_and_download_music(folder_id: str, workdir: str, logger, req_id
         while True:
             resp = svc.files().list(
                 q=q, spaces="drive",
-                fields="nextPageToken, files(id,name,mimeType,size)",
+                fields="nextPageToken, files(id,name,mimeType,size,md5Checksum)",
                 pageToken=page_token,
                 includeItemsFromAllDrives=True, supportsAllDrives=True
             ).execute()
@@ -91,25 +210,33 @@ def _gdrive_pick_and_download_music(folder_id: str, workdir: str, logger, req_id
             logger.warning(f"[{req_id}] ⚠️ aucun fichier audio trouvé dans le dossier {folder_id}")
             return None, 0
 
-        import random, re
         pick = random.choice(files)
         fid, fname = pick["id"], pick["name"]
-        local = os.path.join(workdir, f"music_{fname}")
         logger.info(f"[{req_id}] musique choisie: {fname} (id={fid})")
-
-        req = svc.files().get_media(fileId=fid, supportsAllDrives=True)
-        with open(local, "wb") as fh:
-            downloader = MediaIoBaseDownload(fh, req)
-            done = False
-            while not done:
-                _status, done = downloader.next_chunk()
-
-        delay_sec = 0
-        m = re.search(r"@(\d+)(?=\.[^.]+$)", fname)
-        if m:
-            try: delay_sec = int(m.group(1))
-            except Exception: delay_sec = 0
-        return local, delay_sec
+        delay_sec = music_store.delay_from_name(fname)
+
+        def _download(dst: str):
+            from googleapiclient.http import MediaIoBaseDownload
+            req = svc.files().get_media(fileId=fid, supportsAllDrives=True)
+            with open(dst, "wb") as fh:
+                downloader = MediaIoBaseDownload(fh, req)
+                done = False
+                while not done:
+                    _status, done = downloader.next_chunk()
+
+        if not music_store.MUSIC_STORE:
+            local = os.path.join(workdir, f"music_{fname}")
+            _download(local)
+            return local, delay_sec
+
+        # source en cache (id + md5 Drive) puis piste préparée, déjà découpée à l'offset @<s>
+        md5 = pick.get("md5Checksum")
+        src = music_store.source(fid, md5, fname, _download)
+        prepared = music_store.prepare(src, delay_sec, logger, req_id,
+                                       src_key=f"{fid}:{md5}" if md5 else None)
+        # copie propre au job (hardlink si même disque) : la purge du cache ne peut pas la lui retirer,
+        # une reprise ou un PATCH retrouve donc toujours la même piste
+        return _spool_link(workdir, prepared), 0
     except Exception as e:
         logger.exception(f"[{req_id}] erreur download musique: {e}")
         return None, 0
@@ -128,12 +255,103 @@ def _ffprobe_duration(path: str) -> float:
 def _start():
     g.req_id = request.headers.get("X-Request-ID", str(uuid4()))
     g.t0 = time.time()
+    joblog.bind(g.req_id)
+
+@app.teardown_request
+def _drop_spool(_exc):
+    # uploads non repris par une route (erreur, champ inattendu…) : on ne laisse rien dans le spool
+    for p in request.__dict__.get("_spooled", ()):
+        try: os.remove(p)
+        except OSError: pass
+
+@app.errorhandler(RequestEntityTooLarge)
+def _too_large(e):
+    return jsonify(error="too_large", max_upload_mb=MAX_UPLOAD_MB, max_form_mb=MAX_FORM_MB), 413
+
+def _take_upload(fs, dst: str) -> str:
+    """
+    Déplace l'upload vers dst : simple rename depuis le spool (même FS), sinon copie.
+    Retourne le sha256 (calculé pendant la réception dans le cas du spool).
+    """
+    st = getattr(fs, "stream", None)
+    if isinstance(st, _SpoolFile):
+        st.flush()
+        shutil.move(st.name, dst)
+        return st.sha256.hexdigest()
+    fs.save(dst)
+    h = hashlib.sha256()
+    with open(dst, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _http_url(url: Optional[str]) -> bool:
+    return urllib.parse.urlparse(url or "").scheme.lower() in ("http", "https")
+
+def _bad_audio_url():
+    # audio_url fourni mais ni http ni https (file://, ftp://… : jamais lus côté serveur)
+    url = request.form.get("audio_url")
+    if url and not _http_url(url):
+        return jsonify(error="invalid_audio_url", detail="audio_url: http(s) uniquement"), 400
+    return None
+
+def _fetch_audio(url: str, dst_noext: str) -> str:
+    """audio par référence (audio_url, http/https seulement) : téléchargé en flux, borné à MAX_UPLOAD_MB."""
+    if not _http_url(url):
+        raise ValueError("audio_url: http(s) uniquement")
+    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (compatible; RenderBot/1.0)"})
+    with urllib.request.urlopen(req, timeout=45) as r:
+        if not _http_url(r.geturl()):   # redirection vers ftp://…
+            raise ValueError("audio_url: redirection hors http(s)")
+        ext = os.path.splitext(urllib.parse.urlparse(url).path)[1].lower()
+        dst = dst_noext + (ext if ext in (".mp3", ".m4a", ".aac", ".wav", ".ogg", ".opus") else ".mp3")
+        left = MAX_UPLOAD_MB << 20
+        with open(dst, "wb") as f:
+            for block in iter(lambda: r.read(1 << 20), b""):
+                left -= len(block)
+                if left < 0:
+                    raise ValueError(f"audio_url > {MAX_UPLOAD_MB} MiB")
+                f.write(block)
+    if os.path.getsize(dst) <= 0:
+        raise RuntimeError("audio_url: fichier vide")
+    return dst
+
+def _spool_text(dirpath: str, name: str, text: Optional[str]) -> Optional[str]:
+    # champs volumineux (plan, srt) : sur disque, le dict du job ne garde que le chemin
+    if text is None:
+        return None
+    p = os.path.join(dirpath, name)
+    with open(p, "w", encoding="utf-8") as f:
+        f.write(text)
+    return p
+
+def _spool_link(dirpath: str, src: Optional[str]) -> Optional[str]:
+    # fichier partagé (autre job, cache) : hardlink (sinon copie) dans le dossier de ce job, qui le possède seul
+    if not src or not os.path.exists(src):
+        return None
+    dst = os.path.join(dirpath, os.path.basename(src))
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+def _field_text(fields: Dict[str, Any], key: str) -> Optional[str]:
+    if fields.get(key) is not None:
+        return fields[key]
+    p = fields.get(f"{key}_path")
+    if not p:
+        return None
+    with open(p, encoding="utf-8") as f:
+        return f.read()
 
 @app.after_request
 def _end(resp):
     try:
         dt = (time.time() - g.t0)
-        app.logger.info(f"[{g.req_id}] {request.method} {request.path} -> {resp.status_code} in {dt:.3f}s")
+        # polling (/jobs/<id>, /healthz) : DEBUG, sinon il noie les lignes utiles
+        level = logging.DEBUG if request.method == "GET" and resp.status_code < 400 else logging.INFO
+        app.logger.log(level, f"[{g.req_id}] {request.method} {request.path} -> {resp.status_code} in {dt:.3f}s")
     except Exception:
         pass
     return resp
@@ -204,19 +422,18 @@ def _normalize_plan(plan_str: str) -> List[Dict[str, Any]]:
     except Exception as e:
         raise ValueError(f"invalid plan: {e}")
 
-def _post_finish_webhook(url: Optional[str], success: bool, output_name: str, compte: Optional[str], contenue: Optional[str]):
-    if not url or not _requests:
+def _post_finish_webhook(url: Optional[str], success: bool, output_name: str, compte: Optional[str],
+                         contenue: Optional[str], job_id: Optional[str] = None):
+    # mis en outbox : envoi + retries en tâche de fond, le worker repart tout de suite
+    if not url:
         return
-    try:
-        payload = {
-            "success": success,
-            "file_name": output_name,
-            "compte": compte,
-            "Contenue": contenue,
-        }
-        _requests.post(url, json=payload, timeout=10)
-    except Exception:
-        pass
+    payload = {
+        "success": success,
+        "file_name": output_name,
+        "compte": compte,
+        "Contenue": contenue,
+    }
+    delivery.enqueue(url, payload, job_id=job_id, kind="finish_webhook")
 
 def _resolve_finish_webhook_from_request(req) -> Optional[str]:
     w = (
@@ -229,9 +446,80 @@ def _resolve_finish_webhook_from_request(req) -> Optional[str]:
         return None
     return w
 
+def _burn_captions(out_path: str, workdir: Optional[str], srt_text: str, caption_style: str,
+                   fps: int, width: int, height: int, engine: Optional[str], req_id: str,
+                   x264: Optional[str] = None, renditions: Optional[List[Dict[str, Any]]] = None,
+                   duration: float = 0.0) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Incruste les captions dans out_path ; retourne (vidéo sous-titrée, renditions produites).
+    engine (champ caption_engine ou env CAPTIONS_ENGINE) :
+      - "ass"     : filtre subtitles (libass), défaut
+      - "overlay" : sprites PNG pré-rendus + overlay (repli sur libass si trop de textes uniques)
+    renditions : greffées par split sur la même passe (aucun décodage de plus).
+    """
+    from captions import build_ass_from_srt, build_overlay_from_srt
+    wd = workdir or os.path.dirname(out_path)
+    sub_path = out_path[:-4] + "_sub.mp4"
+    engine = str(engine or CAPTIONS_ENGINE).strip().lower()
+    x264 = x264 or encode_profile.PROFILES[encode_profile.DEFAULT]["captions"]
+    enc = (f'{x264} -r {fps} -pix_fmt yuv420p '
+           f'-c:a copy -movflags +faststart "{sub_path}"')
+    files: List[Dict[str, Any]] = []
+
+    def _tail(label: str) -> Tuple[str, str, str]:
+        # (suite du graphe, label de la sortie principale, sorties renditions)
+        nonlocal files
+        if not renditions:
+            return "", label, ""
+        graph, outs, files = rendition_graph(label, renditions, sub_path, x264, duration, main_label="[vmain]")
+        return ";" + graph, "[vmain]", outs
+
+    if engine == "overlay":
+        try:
+            sprites, graph = build_overlay_from_srt(srt_text, width, height, preset=caption_style)
+            if not graph:
+                return out_path, files
+            graph_path = os.path.join(wd, "captions_overlay.txt")
+            tail, vmap, outs = _tail("[v]")
+            with open(graph_path, "w", encoding="utf-8") as f:
+                f.write(graph + tail)
+            inputs = " ".join(f'-i "{p}"' for p in sprites)
+            cmd = (f'ffmpeg -y -hide_banner -loglevel error -i "{out_path}" {inputs} -filter_complex_script "{graph_path}" '
+                   f'-map "{vmap}" -map 0:a? {enc} {outs}')
+            run_cmd(cmd, app.logger, req_id)
+            return sub_path, files
+        except ValueError as e:
+            app.logger.warning(f"[{req_id}] overlay captions indisponible ({e}) -> libass")
+
+    ass_path = os.path.join(wd, "captions.ass")
+    ass_text = build_ass_from_srt(srt_text, preset=caption_style)
+    with open(ass_path, "w", encoding="utf-8") as f:
+        f.write(ass_text)
+    if renditions:
+        tail, vmap, outs = _tail("[vsub]")
+        cmd = (f'ffmpeg -y -hide_banner -loglevel error -i "{out_path}" '
+               f'-filter_complex "[0:v]subtitles={ass_path}[vsub]{tail}" -map "{vmap}" -map 0:a? {enc} {outs}')
+    else:
+        cmd = f'ffmpeg -y -hide_banner -loglevel error -i "{out_path}" -vf "subtitles={ass_path}" {enc}'
+    run_cmd(cmd, app.logger, req_id)
+    return sub_path, files
+
 # ---------------- SYNC ----------------
 @app.post("/create-video")
 def create_video():
+    bad = _bad_audio_url()
+    if bad:
+        return bad
+    # un rendu sync garde son thread web jusqu'au bout : au-delà de SYNC_MAX_INFLIGHT => 503 (passer en async)
+    if not SYNC_SLOTS.acquire(blocking=False):
+        return (jsonify(error="busy", detail="trop de rendus sync en cours, utiliser /create-video-async",
+                        sync_max_inflight=SYNC_MAX_INFLIGHT), 503, {"Retry-After": "30"})
+    try:
+        return _create_video_sync()
+    finally:
+        SYNC_SLOTS.release()
+
+def _create_video_sync():
     workdir = None
     try:
         output_name = request.form["output_name"]
@@ -239,13 +527,21 @@ def create_video():
         height = _parse_int(request.form.get("height", 1920), 1920)
         fps    = _parse_int(request.form.get("fps", 30), 30)
         plan_str = request.form["plan"]
-        audio_file = request.files["audio_file"]
+        audio_file = request.files.get("audio_file")
+        audio_url  = request.form.get("audio_url")
+        if not audio_file and not audio_url:
+            raise ValueError("audio_file ou audio_url requis")
 
         style           = request.form.get("style", "default")
         caption_style   = request.form.get("caption_style")
         srt_text        = request.form.get("srt_text")
         music_folder_id = request.form.get("music_folder_id")
         music_volume    = _parse_float(request.form.get("music_volume", 0.25), 0.25)
+        loudnorm        = _parse_flag(request.form.get("loudnorm"))
+        deadline_sec    = request.form.get("deadline_sec")
+        priority        = request.form.get("priority")
+        forced_profile  = request.form.get("encode_profile")
+        renditions      = parse_renditions(request.form.get("renditions"))
         drive_folder_id = request.form.get("drive_folder_id") or request.args.get("drive_folder_id")
         finish_webhook  = _resolve_finish_webhook_from_request(request)
         # 🆕 compte (nom du compte) passé par Make dans les inputs
@@ -275,8 +571,11 @@ def create_video():
         debug_dir = os.path.join(workdir, "debug")
         os.makedirs(debug_dir, exist_ok=True)
 
-        audio_path = os.path.join(workdir, "voice.mp3")
-        audio_file.save(audio_path)
+        if audio_file:
+            audio_path = os.path.join(workdir, "voice.mp3")
+            _take_upload(audio_file, audio_path)
+        else:
+            audio_path = _fetch_audio(audio_url, os.path.join(workdir, "voice"))
 
         music_path, music_delay = (None, 0)
         if music_folder_id:
@@ -287,68 +586,99 @@ def create_video():
         with open(os.path.join(debug_dir, "plan_input.json"), "w", encoding="utf-8") as f:
             json.dump({"plan": plan}, f, ensure_ascii=False, indent=2)
 
-        out_path, gen_debug = generate_video(
-            plan=plan,
-            audio_path=audio_path,
-            output_name=output_name,
-            temp_dir=workdir,
-            width=width, height=height, fps=fps,
-            logger=app.logger, req_id=g.req_id,
-            style=style,
-            music_path=music_path,
-            music_delay=music_delay,
-            music_volume=music_volume,
-        )
-
-        # --- CAPTIONS: burn subtitles (optional) ---
-        try:
-            if caption_style and srt_text:
-                ass_path = os.path.join(workdir if "workdir" in locals() and workdir else os.path.dirname(out_path), "captions.ass")
-                ass_text = build_ass_from_srt(srt_text, preset=caption_style)
-                with open(ass_path, "w", encoding="utf-8") as f:
-                    f.write(ass_text)
-                fps_val = int(request.form.get("fps") or 30)
-                cmd = (
-                    f'ffmpeg -y -i "{out_path}" -vf "subtitles={ass_path}" '
-                    f'-c:v libx264 -preset veryfast -crf 22 -r {fps_val} -pix_fmt yuv420p '
-                    f'-c:a copy -movflags +faststart "{out_path[:-4]}_sub.mp4"'
-                )
-                subprocess.check_call(cmd, shell=True)
-                out_path = out_path[:-4] + "_sub.mp4"
-        except Exception as e:
-            app.logger.exception(f"[{g.req_id}] captions burn failed: {e}")
-        # --- END CAPTIONS ---
-
-        out_size = os.path.getsize(out_path)
-        out_dur  = _ffprobe_duration(out_path)
-        app.logger.info(f"[{g.req_id}] OUTPUT path={out_path} size={out_size}B dur={out_dur:.3f}s")
-
-        with open(os.path.join(debug_dir, "generator_debug.json"), "w", encoding="utf-8") as f:
-            json.dump(gen_debug, f, ensure_ascii=False, indent=2)
-
-        resp = {
-            "status":"success","output_path":out_path,
-            "width":width,"height":height,"fps":fps,"items":len(plan),
-            "out_size": out_size, "out_duration": out_dur,
-            "debug": gen_debug
-        }
-
-        if drive_folder_id:
+        req_id = g.req_id
+        caption_engine = request.form.get("caption_engine")
+
+        t_submit = time.time()
+        with_captions = bool(caption_style and srt_text)
+
+        def _render() -> Dict[str, Any]:
+            joblog.bind(req_id)
+            # profil choisi au démarrage effectif du rendu (file et échéance à jour)
+            enc = _pick_profile(plan, style, width, height, fps, with_captions,
+                                deadline_sec, priority, forced_profile, enqueued_at=t_submit)
+            joblog.set_stage(req_id, "encoding")
+            out_path, gen_debug = generate_video(
+                plan=plan,
+                audio_path=audio_path,
+                output_name=output_name,
+                temp_dir=workdir,
+                width=width, height=height, fps=fps,
+                logger=app.logger, req_id=req_id,
+                style=style,
+                music_path=music_path,
+                music_delay=music_delay,
+                music_volume=music_volume,
+                loudnorm=loudnorm,
+                encode_profile=enc["profile"],
+                # avec captions, les renditions sortent de la passe captions (vidéo sous-titrée)
+                renditions=None if with_captions else renditions,
+            )
+            _record_speed(enc, gen_debug)
+            rendition_files = gen_debug.get("renditions") or []
+
+            # --- CAPTIONS: burn subtitles (optional) ---
             try:
-                gd = _gdrive_upload(out_path, output_name, drive_folder_id, app.logger, g.req_id)
-                resp.update({"drive_file_id": gd.get("id"), "drive_webViewLink": gd.get("webViewLink")})
-                if finish_webhook:
-                    _post_finish_webhook(finish_webhook, True, output_name, compte, contenue)
+                if with_captions:
+                    joblog.set_stage(req_id, "captions")
+                    out_path, rendition_files = _burn_captions(
+                        out_path, workdir, srt_text, caption_style,
+                        fps=fps,
+                        width=width, height=height,
+                        engine=caption_engine, req_id=req_id,
+                        x264=encode_profile.PROFILES[enc["profile"]]["captions"],
+                        renditions=renditions, duration=total_dur,
+                    )
             except Exception as e:
-                app.logger.exception(f"[{g.req_id}] drive upload failed: {e}")
-                resp["drive_error"] = str(e)
-                if finish_webhook:
-                    _post_finish_webhook(finish_webhook, False, output_name, compte, contenue)
-
+                app.logger.exception(f"[{req_id}] captions burn failed: {e}")
+            if renditions and not rendition_files:
+                rendition_files = render_renditions(out_path, renditions, encode_profile.PROFILES[enc["profile"]]["segment"],
+                                                    app.logger, req_id, duration=total_dur)
+            # --- END CAPTIONS ---
+
+            out_size = os.path.getsize(out_path)
+            out_dur  = _ffprobe_duration(out_path)
+            app.logger.info(f"[{req_id}] OUTPUT path={out_path} size={out_size}B dur={out_dur:.3f}s")
+
+            with open(os.path.join(debug_dir, "generator_debug.json"), "w", encoding="utf-8") as f:
+                json.dump(gen_debug, f, ensure_ascii=False, indent=2)
+
+            resp = {
+                "status":"success","output_path":out_path,
+                "width":width,"height":height,"fps":fps,"items":len(plan),
+                "out_size": out_size, "out_duration": out_dur,
+                "encoding": enc,
+                "renditions": [_rendition_item(r, output_name) for r in rendition_files],
+                "debug": gen_debug
+            }
+
+            if drive_folder_id:
+                joblog.set_stage(req_id, "upload")
+                try:
+                    gd = _gdrive_upload(out_path, output_name, drive_folder_id, app.logger, req_id)
+                    resp.update({"drive_file_id": gd.get("id"), "drive_webViewLink": gd.get("webViewLink")})
+                    if rendition_files:
+                        resp["renditions"] = _upload_renditions(rendition_files, output_name, drive_folder_id, req_id)
+                    if finish_webhook:
+                        _post_finish_webhook(finish_webhook, True, output_name, compte, contenue)
+                except Exception as e:
+                    app.logger.exception(f"[{req_id}] drive upload failed: {e}")
+                    resp["drive_error"] = str(e)
+                    if finish_webhook:
+                        _post_finish_webhook(finish_webhook, False, output_name, compte, contenue)
+
+            return resp
+
+        # rendu sur l'ordonnanceur : ce thread web ne fait qu'attendre le résultat
+        resp = SCHEDULER.submit(_render).result()
         return jsonify(resp)
 
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
-        app.logger.error(f"[{getattr(g,'req_id','?')}] create-video failed: {e}\n{traceback.format_exc()}")
+        app.logger.exception(f"[{getattr(g,'req_id','?')}] create-video failed: {e}")
+        if workdir:
+            joblog.dump(g.req_id, os.path.join(workdir, "debug", "logs.jsonl"))
         return jsonify(error="internal error", detail=str(e)), 500
     finally:
         try:
@@ -357,13 +687,121 @@ def create_video():
         except Exception:
             pass
 
+def _job_dir(jid: str) -> str:
+    d = os.path.join(JOBS_DIR, jid)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+def _write_json(path: str, data: Any):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _read_json(path: str, default: Any = None) -> Any:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _persist_job(jid: str):
+    # appelé sous JLOCK : l'ordre des écritures suit l'ordre des mises à jour
+    if jid in JOBS:
+        _write_json(os.path.join(_job_dir(jid), "state.json"), JOBS[jid])
+
 def _set_job(jid: str, **kw):
     with JLOCK:
         JOBS[jid] = {**JOBS.get(jid, {}), **kw}
+        _persist_job(jid)
+        if "stage" in kw:
+            joblog.set_stage(JOBS[jid].get("req_id") or jid, kw["stage"])
+
+def _checkpoint(jid: str, stage: str, **data):
+    """Étape terminée (+ ses sorties) dans manifest.json ; relue à la reprise du job."""
+    p = os.path.join(_job_dir(jid), "manifest.json")
+    m = _read_json(p, {}) or {}
+    m[stage] = {**data, "at": int(time.time())}
+    _write_json(p, m)
+
+def _save_fields(jid: str, fields: Dict[str, Any]):
+    _write_json(os.path.join(_job_dir(jid), "fields.json"), fields)
+
+def _delivery_status(job_id: Optional[str], kind: str, state: Dict[str, Any]):
+    # état de chaque livraison (webhook / callback) visible sur /jobs/<id> -> "deliveries"
+    if not job_id:
+        return
+    with JLOCK:
+        if job_id in JOBS:
+            JOBS[job_id].setdefault("deliveries", {})[kind] = state
+            _persist_job(job_id)
+
+delivery.on_status = _delivery_status
+
+# ---------------- DÉDUP ----------------
+# ce qui définit le rendu (et où il est livré) ; callbacks / compte / Contenue n'en font pas partie
+_FP_FIELDS = ("output_name", "width", "height", "fps", "style", "music_folder_id", "music_volume",
+              "loudnorm", "caption_style", "caption_engine", "srt_text", "drive_folder_id", "renditions")
+
+def _fingerprint(fields: Dict[str, Any], audio_digest: str) -> str:
+    """audio_digest : sha256 des octets uploadés (calculé à la réception), ou l'URL audio."""
+    h = hashlib.sha256()
+    plan_str = _field_text(fields, "plan")
+    try:
+        plan = json.dumps(_normalize_plan(plan_str), sort_keys=True, ensure_ascii=False)
+    except Exception:
+        plan = str(plan_str)
+    h.update(plan.encode("utf-8"))
+    for k in _FP_FIELDS:
+        v = _field_text(fields, k) if k == "srt_text" else fields.get(k)
+        h.update(f"\0{k}={v or ''}".encode("utf-8"))
+    h.update(f"\0audio={audio_digest}".encode("utf-8"))
+    return h.hexdigest()
+
+def _canonical(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # alias de dédup ({"duplicate_of": ...}, sans statut propre) => job qui fait réellement le rendu (sous JLOCK)
+    return JOBS.get(job["duplicate_of"]) if job and job.get("duplicate_of") else job
+
+def _reusable(job: Optional[Dict[str, Any]], now: float) -> bool:
+    # en cours, ou réussi il y a moins de DEDUP_TTL_SEC avec une sortie encore sur disque (alias => job canonique)
+    job = _canonical(job)
+    if not job or job.get("status") in ("failed", "cancelled", "cancelling"):
+        return False
+    if job.get("status") != "success":
+        return True
+    return now - job.get("finished_at", 0) <= DEDUP_TTL_SEC and os.path.exists(job.get("output_path") or "")
+
+_ACTIVE = ("queued", "running", "cancelling")
+
+def _claim_job(jid: str, fp: Optional[str], **kw) -> Optional[Dict[str, Any]]:
+    """
+    Atomique (JLOCK) : renvoie le job existant (même job_id encore actif => conflit ; résultat réutilisable
+    du même job_id ou de la même empreinte), sinon enregistre jid comme "queued" (+ empreinte) et renvoie None.
+    """
+    now = time.time()
+    with JLOCK:
+        for k, other in list(FINGERPRINTS.items()):
+            if not _reusable(JOBS.get(other), now):
+                del FINGERPRINTS[k]
+        cur = JOBS.get(jid)
+        if cur and not cur.get("duplicate_of") and cur.get("status") in _ACTIVE:
+            return dict(cur)   # même job_id encore actif : jamais deux workers pour un id (=> 409)
+        if _reusable(cur, now):
+            # retry d'un alias : statut et sortie du job canonique
+            dup = JOBS[jid].get("duplicate_of")
+            return {**_canonical(JOBS[jid]), "duplicate_of": dup} if dup else dict(JOBS[jid])
+        other = FINGERPRINTS.get(fp) if fp else None
+        if other and other != jid:
+            JOBS[jid] = {"job_id": jid, "duplicate_of": other, "enqueued_at": int(now)}
+            return {**JOBS[other], "duplicate_of": other}
+        JOBS[jid] = {"status": "queued", "job_id": jid, "enqueued_at": int(now), **kw}
+        if fp:
+            FINGERPRINTS[fp] = jid
+        return None
 
 # ---------------- ASYNC ----------------
 def _worker_create_video(jid: str, fields: Dict[str, Any]):
-    workdir = None
+    workdir = run = None
     req_id = fields.get("req_id", jid)
     callback_url = fields.get("callback_url")
     finish_webhook = (
@@ -375,21 +813,38 @@ def _worker_create_video(jid: str, fields: Dict[str, Any]):
         finish_webhook = None
 
     try:
+        # annulable (DELETE /jobs/<jid>) tant que ce worker tourne, jamais au-delà
+        run = start_job(jid)
+        with JLOCK:
+            if (JOBS.get(jid) or {}).get("status") == "cancelling":   # DELETE juste avant l'enregistrement
+                raise JobCancelled(jid)
         with app.app_context():
             g.req_id = req_id
+        joblog.bind(req_id)
 
         output_name    = fields["output_name"]
         width          = _parse_int(fields.get("width") or 1080, 1080)
         height         = _parse_int(fields.get("height") or 1920, 1920)
         fps            = _parse_int(fields.get("fps") or 30, 30)
-        plan_str       = fields["plan"]
-        audio_path     = fields["audio_path"]
+        plan_str       = _field_text(fields, "plan")
+        audio_path     = fields.get("audio_path")
         drive_folder_id= fields.get("drive_folder_id")
         style          = fields.get("style", "default")
         music_folder_id= fields.get("music_folder_id")
         music_volume   = _parse_float(fields.get("music_volume") or 0.25, 0.25)
+        loudnorm       = _parse_flag(fields.get("loudnorm"))
         compte         = fields.get("compte")
         contenue       = fields.get("Contenue")
+        renditions     = parse_renditions(fields.get("renditions"))
+        caption_style  = fields.get("caption_style")
+        srt_text       = _field_text(fields, "srt_text")
+
+        # 🔀 NOUVEAU : même logique de désactivation pour l'async
+        if isinstance(caption_style, str):
+            cs_norm = caption_style.strip().lower()
+            if cs_norm in ("0", "false", "off", "none", "no"):
+                caption_style = ""
+        with_captions = bool(caption_style and srt_text)
 
         plan = _normalize_plan(plan_str)
 
@@ -398,63 +853,98 @@ def _worker_create_video(jid: str, fields: Dict[str, Any]):
         except Exception:
             total_dur = 0.0
 
-        workdir = tempfile.mkdtemp(prefix=f"job_{jid}_")
+        # workdir stable (JOBS_DIR/<id>/work) : une reprise retrouve parts et sorties d'étapes
+        workdir = os.path.join(_job_dir(jid), "work")
         debug_dir = os.path.join(workdir, "debug")
         os.makedirs(debug_dir, exist_ok=True)
+        done = _read_json(os.path.join(_job_dir(jid), "manifest.json"), {}) or {}
+        if done:
+            app.logger.info(f"[{req_id}] reprise du job {jid} après étapes: {sorted(done)}")
+
+        if not audio_path or not os.path.exists(audio_path):
+            _set_job(jid, status="running", stage="audio_download", updated_at=int(time.time()))
+            audio_path = _fetch_audio(fields["audio_url"], os.path.join(workdir, "voice"))
+            fields["audio_path"] = audio_path
+            _save_fields(jid, fields)
 
         with open(os.path.join(debug_dir, "plan_input.json"), "w", encoding="utf-8") as f:
             json.dump({"plan": plan}, f, ensure_ascii=False, indent=2)
 
         music_path, music_delay = (None, 0)
-        if music_folder_id:
+        if fields.get("music_path") and os.path.exists(fields["music_path"]):
+            # re-rendu incrémental : même musique que le rendu de base
+            music_path, music_delay = fields["music_path"], _parse_int(fields.get("music_delay"), 0)
+        elif music_folder_id:
+            if fields.get("music_path"):
+                app.logger.warning(f"[{req_id}] piste musicale du job introuvable ({fields['music_path']}) "
+                                   f"-> nouveau tirage dans {music_folder_id}")
             music_path, music_delay = _gdrive_pick_and_download_music(music_folder_id, workdir, app.logger, req_id)
             if music_path:
                 app.logger.info(f"[{req_id}] musique DL ok -> {music_path} delay={music_delay}s vol={music_volume}")
+                fields.update(music_path=music_path, music_delay=music_delay)
+                _save_fields(jid, fields)   # une reprise garde la même piste
 
         with open(os.path.join(debug_dir, "job_fields.json"), "w", encoding="utf-8") as f:
             json.dump({k: v for k, v in fields.items() if k not in ("audio_path",)}, f, ensure_ascii=False, indent=2)
 
-        _set_job(jid, status="running", stage="encoding", updated_at=int(time.time()))
-
-        out_path, gen_debug = generate_video(
-            plan=plan,
-            audio_path=audio_path,
-            output_name=output_name,
-            temp_dir=workdir,
-            width=width, height=height, fps=fps,
-            logger=app.logger, req_id=req_id,
-            style=style,
-            music_path=music_path,
-            music_delay=music_delay,
-            music_volume=music_volume,
-        )
+        # profil figé pour le job : une reprise (ou un PATCH) garde des clés de parts identiques
+        enc = fields.get("encoding") or _pick_profile(
+            plan, style, width, height, fps, with_captions,
+            fields.get("deadline_sec"), fields.get("priority"), fields.get("encode_profile"),
+            enqueued_at=(JOBS.get(jid) or {}).get("enqueued_at"), jid=jid)
+        if not fields.get("encoding"):
+            fields["encoding"] = enc
+            _save_fields(jid, fields)
+        app.logger.info(f"[{req_id}] profil x264={enc['profile']} ({enc['reason']}) travail≈{enc['work']}s")
+
+        if "rendered" in done and os.path.exists(done["rendered"]["out_path"]):
+            out_path, gen_debug = done["rendered"]["out_path"], done["rendered"]["gen_debug"]
+        else:
+            _set_job(jid, status="running", stage="encoding", encoding=enc, updated_at=int(time.time()))
+            out_path, gen_debug = generate_video(
+                plan=plan,
+                audio_path=audio_path,
+                output_name=output_name,
+                temp_dir=workdir,
+                width=width, height=height, fps=fps,
+                logger=app.logger, req_id=req_id,
+                style=style,
+                music_path=music_path,
+                music_delay=music_delay,
+                music_volume=music_volume,
+                loudnorm=loudnorm,
+                # ses propres parts d'abord (reprise), puis ceux du job de base (re-rendu incrémental)
+                reuse_dir=[workdir, fields.get("reuse_dir")],
+                encode_profile=enc["profile"],
+                renditions=None if with_captions else renditions,
+            )
+            _record_speed(enc, gen_debug)
+            _checkpoint(jid, "rendered", out_path=out_path, gen_debug=gen_debug)
 
         # --- CAPTIONS: burn subtitles (optional) ---
-        try:
-            caption_style = fields.get("caption_style")
-            srt_text = fields.get("srt_text")
-
-            # 🔀 NOUVEAU : même logique de désactivation pour l'async
-            if isinstance(caption_style, str):
-                cs_norm = caption_style.strip().lower()
-                if cs_norm in ("0", "false", "off", "none", "no"):
-                    caption_style = ""
-
-            if caption_style and srt_text:
-                ass_path = os.path.join(workdir if workdir else os.path.dirname(out_path), "captions.ass")
-                ass_text = build_ass_from_srt(srt_text, preset=caption_style)
-                with open(ass_path, "w", encoding="utf-8") as f:
-                    f.write(ass_text)
-                fps_val = int(fields.get("fps") or 30)
-                cmd = (
-                    f'ffmpeg -y -i "{out_path}" -vf "subtitles={ass_path}" '
-                    f'-c:v libx264 -preset veryfast -crf 22 -r {fps_val} -pix_fmt yuv420p '
-                    f'-c:a copy -movflags +faststart "{out_path[:-4]}_sub.mp4"'
-                )
-                subprocess.check_call(cmd, shell=True)
-                out_path = out_path[:-4] + "_sub.mp4"
-        except Exception as e:
-            app.logger.exception(f"[{req_id}] captions burn failed: {e}")
+        if "captioned" in done and os.path.exists(done["captioned"]["out_path"]):
+            out_path, rendition_files = done["captioned"]["out_path"], done["captioned"].get("renditions") or []
+        else:
+            rendition_files = gen_debug.get("renditions") or []
+            try:
+                if with_captions:
+                    _set_job(jid, stage="captions", updated_at=int(time.time()))
+                    out_path, rendition_files = _burn_captions(
+                        out_path, workdir, srt_text, caption_style,
+                        fps=int(fields.get("fps") or 30),
+                        width=width, height=height,
+                        engine=fields.get("caption_engine"), req_id=req_id,
+                        x264=encode_profile.PROFILES[enc["profile"]]["captions"],
+                        renditions=renditions, duration=total_dur,
+                    )
+            except JobCancelled:
+                raise
+            except Exception as e:
+                app.logger.exception(f"[{req_id}] captions burn failed: {e}")
+            if renditions and not rendition_files:
+                rendition_files = render_renditions(out_path, renditions, encode_profile.PROFILES[enc["profile"]]["segment"],
+                                                    app.logger, req_id, duration=total_dur)
+            _checkpoint(jid, "captioned", out_path=out_path, renditions=rendition_files)
         # --- END CAPTIONS ---
 
         out_size = os.path.getsize(out_path)
@@ -473,51 +963,87 @@ def _worker_create_video(jid: str, fields: Dict[str, Any]):
             "out_size": out_size, "out_duration": out_dur,
             "workdir": workdir,
             "req_id": req_id,
+            "encoding": enc,
+            "renditions": [_rendition_item(r, output_name) for r in rendition_files],
+            "finished_at": int(time.time()),
         }
-
-        if drive_folder_id:
+        if fields.get("base_job_id"):
+            result["base_job_id"] = fields["base_job_id"]
+
+        check_cancelled(run)   # annulé pendant le rendu : ni upload ni webhook
+        if "uploaded" in done:
+            result.update(done["uploaded"]["drive"])
+        elif drive_folder_id:
+            _set_job(jid, stage="upload", updated_at=int(time.time()))
             try:
                 gd = _gdrive_upload(out_path, output_name, drive_folder_id, app.logger, req_id)
                 result.update({
                     "drive_file_id": gd.get("id"),
                     "drive_webViewLink": gd.get("webViewLink"),
                 })
+                if rendition_files:
+                    result["renditions"] = _upload_renditions(rendition_files, output_name, drive_folder_id, req_id)
                 if finish_webhook:
-                    _post_finish_webhook(finish_webhook, True, output_name, compte, contenue)
+                    _post_finish_webhook(finish_webhook, True, output_name, compte, contenue, job_id=jid)
             except Exception as e:
                 app.logger.exception(f"[{req_id}] drive upload failed: {e}")
                 result["drive_error"] = str(e)
                 if finish_webhook:
-                    _post_finish_webhook(finish_webhook, False, output_name, compte, contenue)
+                    _post_finish_webhook(finish_webhook, False, output_name, compte, contenue, job_id=jid)
+            _checkpoint(jid, "uploaded", drive={k: result[k] for k in
+                        ("drive_file_id", "drive_webViewLink", "drive_error", "renditions") if k in result})
 
         _set_job(jid, **result)
         if callback_url:
-            try:
-                _requests.post(callback_url, json=result, timeout=10)
-            except Exception:
-                pass
+            delivery.enqueue(callback_url, result, job_id=jid, kind="callback")
 
+    except JobCancelled:
+        app.logger.info(f"[{req_id}] job {jid} annulé")
+        _drop_job_files(jid, fields)   # fichiers partis avant que "cancelled" soit visible
+        _set_job(jid, status="cancelled", finished_at=int(time.time()))
     except Exception as e:
-        app.logger.error(f"[{req_id}] worker failed: {e}\n{traceback.format_exc()}")
-        _set_job(jid, status="failed", error=str(e), req_id=req_id)
+        app.logger.exception(f"[{req_id}] worker failed: {e}")
+        # journal du job (logs + sortie ffmpeg) sur disque seulement en cas d'échec
+        logs = joblog.dump(req_id, os.path.join(_job_dir(jid), "logs.jsonl"))
+        _set_job(jid, status="failed", error=str(e), req_id=req_id, finished_at=int(time.time()), logs_path=logs)
     finally:
+        joblog.bind(None)
+        end_job(run)
         try:
             if not KEEP_TMP and os.getenv("CLEAN_TMP") == "1" and workdir and os.path.isdir(workdir):
                 shutil.rmtree(workdir, ignore_errors=True)
         except Exception:
             pass
 
+def _drop_job_files(jid: str, fields: Dict[str, Any]):
+    # job annulé : workdir + son propre spool (plan/srt/audio uploadé) ; state.json reste pour /jobs
+    shutil.rmtree(os.path.join(JOBS_DIR, jid, "work"), ignore_errors=True)
+    spool = _spool_dir_of(jid, fields)
+    if spool:
+        shutil.rmtree(spool, ignore_errors=True)
+
 # ---------------- QUEUE API ----------------
 @app.post("/create-video-async")
 def create_video_async():
     jid = request.form.get("job_id") or str(uuid4())
-    req_id = request.headers.get("X-Request-ID", str(uuid4()))
-    tmp = tempfile.mkdtemp(prefix=f"enqueue_{jid}_")
+    req_id = g.req_id  # X-Request-ID ou uuid (before_request) : même id pour la requête et le job
+    if not _JOB_ID.fullmatch(jid):
+        return jsonify(error="invalid_job_id", job_id=jid), 400
+    bad = _bad_audio_url()
+    if bad:
+        return bad
+    tmp = tempfile.mkdtemp(prefix=f"enqueue_{jid}_", dir=SPOOL_DIR)
 
     try:
-        audio = request.files["audio_file"]
-        audio_local = os.path.join(tmp, "voice.mp3")
-        audio.save(audio_local)
+        # multipart déjà streamé dans le spool : l'audio y est renommé, jamais recopié
+        audio = request.files.get("audio_file")
+        audio_url = request.form.get("audio_url")
+        audio_local, audio_digest = None, audio_url
+        if audio:
+            audio_local = os.path.join(tmp, "voice.mp3")
+            audio_digest = _take_upload(audio, audio_local)
+        elif not audio_url:
+            raise ValueError("audio_file ou audio_url requis")
 
         fields = {
             "req_id": req_id,
@@ -525,48 +1051,403 @@ def create_video_async():
             "width": request.form.get("width"),
             "height": request.form.get("height"),
             "fps": request.form.get("fps"),
-            "plan": request.form["plan"],
+            "plan_path": _spool_text(tmp, "plan.json", request.form["plan"]),
             "audio_path": audio_local,
+            "audio_url": audio_url,
             "drive_folder_id": request.form.get("drive_folder_id") or request.args.get("drive_folder_id"),
             "callback_url": request.form.get("callback_url"),
             "finish_webhook": request.form.get("finish_webhook") or request.args.get("finish_webhook"),
             "style": request.form.get("style"),
             "music_folder_id": request.form.get("music_folder_id"),
             "music_volume": request.form.get("music_volume"),
+            "loudnorm": request.form.get("loudnorm"),
+            "deadline_sec": request.form.get("deadline_sec"),
+            "priority": request.form.get("priority"),
+            "encode_profile": request.form.get("encode_profile"),
+            "renditions": request.form.get("renditions"),
             "compte": request.form.get("compte") or request.args.get("compte"),
             # 🆕 on transporte tel-quel la narration "Contenue" pour l’async
             "Contenue": request.form.get("Contenue") or request.args.get("Contenue"),
             # 🆕 CAPTIONS
             "caption_style": request.form.get("caption_style"),
-            "srt_text": request.form.get("srt_text"),
+            "caption_engine": request.form.get("caption_engine"),
+            "srt_text_path": _spool_text(tmp, "captions.srt", request.form.get("srt_text")),
         }
 
-        _set_job(jid, status="queued", job_id=jid, req_id=req_id, enqueued_at=int(time.time()))
-        Thread(target=_worker_create_video, args=(jid, fields), daemon=True).start()
-        return jsonify({"status": "queued", "job_id": jid}), 202
+        parse_renditions(fields["renditions"])   # liste invalide => 400 tout de suite
+        fields["audio_digest"] = audio_digest
+        base_job_id = request.form.get("base_job_id")
+        if base_job_id:
+            fields.update(_reuse_from(base_job_id))
+        return _submit_job(jid, fields, tmp)
 
+    except RequestEntityTooLarge:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
     except Exception as e:
         shutil.rmtree(tmp, ignore_errors=True)
         app.logger.error(f"[{req_id}] enqueue failed: {e}\n{traceback.format_exc()}")
         return jsonify(error="enqueue_failed", detail=str(e)), 400
 
+def _submit_job(jid: str, fields: Dict[str, Any], tmp: str):
+    req_id = fields["req_id"]
+    fp = _fingerprint(fields, fields["audio_digest"]) if DEDUP_TTL_SEC > 0 else None
+    existing = _claim_job(jid, fp, req_id=req_id, fingerprint=fp)
+    if existing is not None and not existing.get("duplicate_of") and existing.get("status") in _ACTIVE:
+        # même job_id en file / en cours / en annulation : ni second worker, ni rattachement
+        shutil.rmtree(tmp, ignore_errors=True)
+        return jsonify(error="job_in_progress", job_id=jid, status=existing.get("status")), 409
+    if existing is not None:
+        # retry / doublon : on se rattache au résultat existant sans re-rendre
+        shutil.rmtree(tmp, ignore_errors=True)
+        app.logger.info(f"[{req_id}] dedup job_id={jid} -> {existing.get('duplicate_of', jid)} "
+                        f"status={existing.get('status')}")
+        with JLOCK:
+            _persist_job(jid)
+        done = existing.get("status") == "success"
+        return jsonify({**existing, "job_id": jid, "deduplicated": True}), (200 if done else 202)
+
+    # relance d'un job échoué sous le même id : on repart de zéro
+    shutil.rmtree(os.path.join(JOBS_DIR, jid), ignore_errors=True)
+    fields["spool_dir"] = tmp   # le seul spool que ce job supprime (annulation, purge)
+    _save_fields(jid, fields)
+    with JLOCK:
+        JOB_FIELDS[jid] = fields
+        _persist_job(jid)
+    _schedule(jid, fields)
+    resp = {"status": "queued", "job_id": jid}
+    if fields.get("base_job_id"):
+        resp["base_job_id"] = fields["base_job_id"]
+    return jsonify(resp), 202
+
+def _schedule(jid: str, fields: Dict[str, Any]):
+    fut = SCHEDULER.submit(_worker_create_video, jid, fields)
+    with JLOCK:
+        FUTURES[jid] = fut
+    fut.add_done_callback(lambda _f: FUTURES.pop(jid, None))
+
+def _reuse_from(base_job_id: str) -> Dict[str, Any]:
+    """Champs à ajouter à un job pour qu'il reprenne les parts (et la musique) d'un job terminé."""
+    with JLOCK:
+        base = JOBS.get(base_job_id) or {}
+        base_id = base.get("duplicate_of") or base_job_id
+        base = JOBS.get(base_id) or {}
+        base_fields = JOB_FIELDS.get(base_id) or {}
+    if base.get("status") != "success" or not os.path.isdir(base.get("workdir") or ""):
+        raise ValueError(f"base_job_id {base_job_id}: job terminé (success) avec workdir requis")
+    out = {"base_job_id": base_id, "reuse_dir": base["workdir"]}
+    if (base_fields.get("encoding") or {}).get("profile"):
+        # même profil que la base, sinon aucune clé de part ne correspondrait
+        out["encode_profile"] = base_fields["encoding"]["profile"]
+    if base_fields.get("music_path"):
+        out.update(music_path=base_fields["music_path"], music_delay=base_fields.get("music_delay"))
+    return out
+
+# champs qu'un PATCH peut changer en plus du plan ; le reste (audio, style, géométrie…) vient du job de base
+_PATCH_FIELDS = ("output_name", "caption_style", "caption_engine", "callback_url", "finish_webhook",
+                 "drive_folder_id", "compte", "Contenue", "renditions")
+
+@app.patch("/jobs/<job_id>/plan")
+def patch_job_plan(job_id: str):
+    """
+    Re-rendu incrémental : nouveau plan (et quelques champs) appliqué à un job terminé.
+    Seuls les segments dont (url, durée) change sont ré-encodés ; concat, mux audio et captions sont refaits.
+    """
+    req_id = g.req_id
+    body = request.get_json(silent=True) or request.form
+    jid = body.get("job_id") or str(uuid4())
+    if not _JOB_ID.fullmatch(jid):
+        return jsonify(error="invalid_job_id", job_id=jid), 400
+    tmp = tempfile.mkdtemp(prefix=f"enqueue_{jid}_", dir=SPOOL_DIR)
+    try:
+        plan = body.get("plan")
+        if plan is None:
+            raise ValueError("plan requis")
+        reuse = _reuse_from(job_id)
+        with JLOCK:
+            base_fields = dict(JOB_FIELDS.get(reuse["base_job_id"]) or {})
+        plan_str = plan if isinstance(plan, str) else json.dumps(plan, ensure_ascii=False)
+        _normalize_plan(plan_str)  # validation avant mise en file
+        fields = {**base_fields, **reuse, "req_id": req_id,
+                  "plan_path": _spool_text(tmp, "plan.json", plan_str),
+                  # entrées de la base reprises dans le spool de ce job : annuler l'un ne casse pas l'autre
+                  "srt_text_path": _spool_link(tmp, base_fields.get("srt_text_path")),
+                  "audio_path": _spool_link(tmp, base_fields.get("audio_path"))}
+        fields.pop("encoding", None)   # re-choisi (profil de la base imposé via reuse)
+        if fields.get("music_path"):
+            fields["music_path"] = _spool_link(tmp, fields["music_path"])   # même piste, survit à la base
+        fields.update({k: body[k] for k in _PATCH_FIELDS if body.get(k) is not None})
+        parse_renditions(fields.get("renditions"))
+        if body.get("srt_text") is not None:
+            fields["srt_text_path"] = _spool_text(tmp, "captions.srt", body["srt_text"])
+        return _submit_job(jid, fields, tmp)
+    except Exception as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        app.logger.error(f"[{req_id}] patch plan failed: {e}\n{traceback.format_exc()}")
+        return jsonify(error="patch_failed", detail=str(e)), 400
+
 @app.get("/jobs/<job_id>")
 def get_job(job_id: str):
     with JLOCK:
         data = JOBS.get(job_id)
+        if data and data.get("duplicate_of"):
+            data = {**JOBS.get(data["duplicate_of"], {}), "job_id": job_id, "duplicate_of": data["duplicate_of"]}
     if not data:
         return jsonify(error="not_found", job_id=job_id), 404
     return jsonify(data)
 
+@app.get("/jobs/<job_id>/logs")
+def get_job_logs(job_id: str):
+    """Journal du job : ring en mémoire (job récent) sinon fichier écrit à l'échec ; ?tail=N."""
+    with JLOCK:
+        data = JOBS.get(job_id) or {}
+        if data.get("duplicate_of"):
+            data = JOBS.get(data["duplicate_of"]) or {}
+    if not data:
+        return jsonify(error="not_found", job_id=job_id), 404
+    n = max(0, _parse_int(request.args.get("tail"), 0))
+    req_id = data.get("req_id") or job_id
+    lines, source = joblog.tail(req_id, n), "memory"
+    if lines is None:
+        lines, source = joblog.load(os.path.join(JOBS_DIR, data.get("job_id") or job_id, "logs.jsonl"), n), "disk"
+    return jsonify(job_id=job_id, req_id=req_id, stage=data.get("stage"), status=data.get("status"),
+                   source=source if lines is not None else None, lines=lines or [])
+
+@app.delete("/jobs/<job_id>")
+def cancel_job_route(job_id: str):
+    """
+    Annule un job : encore en file => retiré de l'ordonnanceur ; en cours => ses ffmpeg sont tués
+    (le worker s'arrête sur JobCancelled, sans upload ni webhook) et sa place est libérée aussitôt.
+    """
+    with JLOCK:
+        job = JOBS.get(job_id)
+        fut = FUTURES.get(job_id)
+        fields = JOB_FIELDS.get(job_id) or {}
+        status = (job or {}).get("status")
+        if job and not job.get("duplicate_of") and status in ("queued", "running"):
+            JOBS[job_id] = {**job, "status": "cancelling"}
+            _persist_job(job_id)
+    if not job:
+        return jsonify(error="not_found", job_id=job_id), 404
+    if job.get("duplicate_of"):
+        # alias d'un job partagé : on détache seulement cet alias
+        _set_job(job_id, status="cancelled", finished_at=int(time.time()))
+        return jsonify(status="cancelled", job_id=job_id, detached_from=job["duplicate_of"])
+    if status not in ("queued", "running"):
+        return jsonify(error="not_cancellable", job_id=job_id, status=status), 409
+
+    if fut is not None and fut.cancel():
+        _drop_job_files(job_id, fields)   # fichiers partis avant que "cancelled" soit visible
+        _set_job(job_id, status="cancelled", finished_at=int(time.time()))
+        return jsonify(status="cancelled", job_id=job_id)
+    # pas encore enregistré par son worker (None) : il verra "cancelling" au démarrage
+    killed = cancel_job(job_id) or 0
+    app.logger.info(f"[{job.get('req_id')}] DELETE job {job_id}: {killed} process ffmpeg tué(s)")
+    return jsonify(status="cancelling", job_id=job_id, killed_processes=killed), 202
+
+@app.get("/healthz")
+def healthz():
+    with JLOCK:
+        states = [j.get("status") for j in JOBS.values()]
+    # sans WARMUP : "lazy", toujours prêt ; avec : 503 jusqu'à la fin du préchauffage
+    ready = READINESS["state"] in ("lazy", "ready")
+    return jsonify(status="ok" if ready else READINESS["state"], ready=ready, warmup=READINESS,
+                   max_concurrent_jobs=MAX_CONCURRENT_JOBS,
+                   queued=states.count("queued"), running=states.count("running"),
+                   concat=concat_stats()), (200 if ready else 503)
+
 @app.get("/jobs")
 def list_jobs():
     with JLOCK:
         items = [
-            {k: v for k, v in j.items() if k in ("job_id","status","req_id","enqueued_at")}
+            {k: v for k, v in j.items() if k in ("job_id","status","req_id","enqueued_at","duplicate_of")}
             for j in JOBS.values()
         ]
     return jsonify(items)
 
+def _finished(state: Dict[str, Any]) -> bool:
+    return state.get("status") in ("success", "failed", "cancelled") or bool(state.get("duplicate_of"))
+
+def _expired(state: Dict[str, Any], now: float) -> bool:
+    # job terminé depuis plus de JOBS_RETENTION_SEC (alias : depuis son enregistrement)
+    return _finished(state) and now - (state.get("finished_at") or state.get("enqueued_at") or 0) > JOBS_RETENTION_SEC
+
+def _spool_dir_of(jid: str, fields: Optional[Dict[str, Any]]) -> Optional[str]:
+    # spool d'entrée du job (audio uploadé, plan, srt) ; jobs d'avant "spool_dir" : dossier enqueue_<jid>_*
+    fields = fields or {}
+    if fields.get("spool_dir"):
+        return fields["spool_dir"]
+    d = os.path.dirname(fields.get("plan_path") or "")
+    return d if os.path.basename(d).startswith(f"enqueue_{jid}_") else None
+
+def _drop_job(jid: str, fields: Optional[Dict[str, Any]]):
+    # job expiré : tout ce qu'il possède sur disque (JOBS_DIR/<jid> + son spool)
+    shutil.rmtree(os.path.join(JOBS_DIR, jid), ignore_errors=True)
+    spool = _spool_dir_of(jid, fields)
+    if spool:
+        shutil.rmtree(spool, ignore_errors=True)
+
+def _prune_jobs() -> List[str]:
+    """Supprime (disque + spool + mémoire) les jobs terminés expirés ; les jobs en cours ne sont jamais touchés."""
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    now, dropped = time.time(), []
+    for jid in os.listdir(JOBS_DIR):
+        with JLOCK:
+            state = JOBS.get(jid)
+        state = state or _read_json(os.path.join(JOBS_DIR, jid, "state.json"))
+        if not state or not _expired(state, now):
+            continue
+        with JLOCK:
+            JOBS.pop(jid, None)
+            fields = JOB_FIELDS.pop(jid, None)
+            for k in [k for k, v in FINGERPRINTS.items() if v == jid]:
+                del FINGERPRINTS[k]
+        _drop_job(jid, fields or _read_json(os.path.join(JOBS_DIR, jid, "fields.json")))
+        dropped.append(jid)
+    if dropped:
+        app.logger.info(f"purge de {len(dropped)} job(s) expiré(s) (> {JOBS_RETENTION_SEC}s)")
+    return dropped
+
+def _prune_jobs_loop():
+    while True:
+        time.sleep(JOBS_PRUNE_EVERY_SEC)
+        try:
+            _prune_jobs()
+        except Exception as e:
+            app.logger.warning(f"purge des jobs échouée: {e}")
+
+def _resume_jobs():
+    """
+    Démarrage : recharge les jobs persistés. Terminés => consultables (/jobs, base_job_id, dédup) ;
+    inachevés (queued/running au moment du crash) => resoumis, ils reprennent via manifest.json / parts.json.
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return
+    now, resumed = time.time(), []
+    for jid in sorted(os.listdir(JOBS_DIR)):
+        d = os.path.join(JOBS_DIR, jid)
+        state = _read_json(os.path.join(d, "state.json"))
+        fields = _read_json(os.path.join(d, "fields.json"))
+        if not state:
+            continue
+        if state.get("status") == "cancelling":   # crash pendant l'annulation
+            state = {**state, "status": "cancelled"}
+        finished = _finished(state)
+        if _expired(state, now):
+            _drop_job(jid, fields)
+            continue
+        with JLOCK:
+            if finished:
+                JOBS[jid] = state
+            else:
+                JOBS[jid] = {**state, "status": "queued", "resumed_at": int(now)}
+            if fields:
+                JOB_FIELDS[jid] = fields
+            if state.get("fingerprint") and state.get("status") != "failed":
+                FINGERPRINTS[state["fingerprint"]] = jid
+        if not finished and fields:
+            resumed.append(jid)
+    # resoumis une fois JOBS entièrement rechargé (un worker rapide ne voit pas une table à moitié remplie)
+    for jid in resumed:
+        _schedule(jid, JOB_FIELDS[jid])
+    if resumed:
+        app.logger.info(f"reprise de {len(resumed)} job(s) inachevé(s): {resumed}")
+
+# ---------------- WARM-UP ----------------
+# Optionnel (WARMUP=1) : au démarrage, en tâche de fond, on paie ce qu'un premier job paierait sinon.
+# /healthz renvoie 503 tant que ce n'est pas fini (sonde de readiness de l'autoscaler).
+WARMUP = os.getenv("WARMUP", "0") == "1"
+READINESS: Dict[str, Any] = {"state": "warming" if WARMUP else "lazy", "checks": {}}
+
+def _warm_ffmpeg() -> Dict[str, Any]:
+    out = subprocess.run(["ffmpeg", "-hide_banner", "-version"], capture_output=True, text=True, timeout=10)
+    return {"version": (out.stdout.splitlines() or [""])[0]}
+
+def _warm_ffprobe() -> Dict[str, Any]:
+    path = shutil.which("ffprobe")
+    if not path:
+        raise RuntimeError("ffprobe introuvable (sondes vides => chaînes de filtres génériques)")
+    return {"path": path}
+
+def _warm_fonts() -> Dict[str, Any]:
+    from utils.text_overlay import font_path, _load_font
+    _load_font(56)
+    return {"path": font_path()}
+
+# même forme que ce qu'envoie Make (JSON words[]) : un SRT donnerait 0 mot et ne chaufferait rien
+_WARM_WORDS = json.dumps({"words": [{"word": "warm", "start": 0.0, "end": 0.4},
+                                    {"word": "up", "start": 0.4, "end": 0.8}]})
+
+def _warm_captions() -> Dict[str, Any]:
+    from captions import build_ass_from_srt, PRESETS
+    events = {}
+    for preset in PRESETS:
+        events[preset] = build_ass_from_srt(_WARM_WORDS, preset).count("\nDialogue:")
+        if not events[preset]:
+            raise RuntimeError(f"captions {preset}: aucun event produit")
+    return {"events": events}
+
+def _warm_styles() -> Dict[str, Any]:
+    import styles
+    for name in styles.STYLES:
+        styles.compile_style(name, 1080, 1920, 30)   # assets construits dans le cache partagé
+    return {"styles": sorted(styles.STYLES)}
+
+def _warm_drive() -> Dict[str, Any]:
+    if not os.path.isfile(os.getenv("GOOGLE_CREDS", "/etc/secrets/credentials.json")):
+        return {"skipped": "GOOGLE_CREDS absent"}
+    _gdrive_service()
+    return {}
+
+# (nom, étape, requise pour "ready")
+_WARM_STEPS = (("ffmpeg", _warm_ffmpeg, True), ("ffprobe", _warm_ffprobe, False), ("fonts", _warm_fonts, False),
+               ("captions", _warm_captions, False), ("styles", _warm_styles, False), ("drive", _warm_drive, False))
+
+def warmup() -> Dict[str, Any]:
+    """Exécute les étapes de préchauffage ; une étape non requise en échec est notée sans bloquer."""
+    t0 = time.time()
+    READINESS["state"] = "warming"
+    ok = True
+    for name, step, required in _WARM_STEPS:
+        t = time.time()
+        try:
+            READINESS["checks"][name] = {"ok": True, **step(), "sec": round(time.time() - t, 3)}
+        except Exception as e:
+            ok = ok and not required
+            READINESS["checks"][name] = {"ok": False, "error": str(e), "required": required}
+            app.logger.warning(f"warm-up {name}: {e}")
+    READINESS.update(state="ready" if ok else "degraded", took_sec=round(time.time() - t0, 3))
+    app.logger.info(f"warm-up {READINESS['state']} en {READINESS['took_sec']}s")
+    return READINESS
+
+# ---------------- DÉMARRAGE ----------------
+_STARTED = False
+
+def startup():
+    """
+    Démarrage du serveur (gunicorn post_worker_init, lifespan ASGI, __main__) ; rien ne tourne à l'import
+    (bench, tests, outils). Idempotent : reprise des jobs, outbox, purges périodiques, préchauffage.
+    """
+    global _STARTED
+    with JLOCK:
+        if _STARTED:
+            return
+        _STARTED = True
+    if RESUME_JOBS:
+        _resume_jobs()
+    # après la reprise : les états des livraisons rechargées trouvent leur job dans JOBS
+    delivery.start()        # reprend les livraisons restées dans l'outbox (redémarrage)
+    cache.start_pruner()    # cache partagé borné (âge + taille)
+    if JOBS_PRUNE_EVERY_SEC > 0:
+        Thread(target=_prune_jobs_loop, name="jobs-prune", daemon=True).start()
+    if WARMUP:
+        Thread(target=warmup, name="warmup", daemon=True).start()
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8080"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    debug = os.getenv("FLASK_DEBUG", "0") == "1"
+    if not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true":   # reloader : seulement dans le process servi
+        startup()
+    # dev uniquement ; en prod : gunicorn -c gunicorn.conf.py main:app
+    app.run(host="0.0.0.0", port=port, debug=debug, threaded=True)
@@ -0,0 +1,59 @@
+# music_store.py — pistes musicales préparées une fois, réutilisées par tous les jobs
+# Le dossier musique tourne sur peu de pistes : on garde
+#   - la source téléchargée (namespace "music_src", clé = id Drive + md5) => plus de re-DL
+#   - la piste prête à mixer (namespace "music", clé = source + offset @<s>) :
+#     découpée à l'offset, loudness-normalisée, PCM 48 kHz stéréo
+# Le mix par job se réduit alors à volume + amix sur du PCM, sans seek ni resample.
+import os, re, shlex, subprocess, logging
+from typing import Callable, Optional
+
+from cache import key_of, file_sha1, get_or_create, lookup, store
+import joblog
+
+MUSIC_STORE = os.getenv("MUSIC_STORE", "1") == "1"
+MUSIC_RATE = int(os.getenv("MUSIC_RATE", "48000"))
+# cible "fond musical" : homogène d'une piste à l'autre, le volume du job s'applique ensuite
+MUSIC_LOUDNORM_TARGET = os.getenv("MUSIC_LOUDNORM_TARGET", "I=-20:TP=-2:LRA=11")
+
+_DELAY = re.compile(r"@(\d+)(?=\.[^.]+$)")
+
+def delay_from_name(fname: str) -> int:
+    """Convention du dossier musique : 'titre@42.mp3' => démarrer à 42 s."""
+    m = _DELAY.search(fname or "")
+    return int(m.group(1)) if m else 0
+
+def source(file_id: str, checksum: Optional[str], fname: str, download: Callable[[str], None]) -> str:
+    """
+    Fichier source en cache ; download(tmp_path) n'est appelé que si absent.
+    Sans md5 (fichiers Google natifs), la clé retombe sur l'id seul.
+    """
+    ext = os.path.splitext(fname)[1].lower() or ".bin"
+    return get_or_create("music_src", key_of("music_src/v1", file_id, checksum or ""), ext, download)
+
+def prepare(src_path: str, start_at: int, logger: logging.Logger, req_id: str,
+            src_key: Optional[str] = None) -> str:
+    """
+    Piste prête à mixer pour (source, offset) : WAV PCM s16 MUSIC_RATE stéréo, normalisé.
+    src_key évite de re-hasher la source quand l'appelant a déjà une clé stable.
+    """
+    start_at = max(0, int(start_at))
+    key = key_of("music/v1", src_key or file_sha1(src_path), start_at, MUSIC_RATE, MUSIC_LOUDNORM_TARGET)
+    hit = lookup("music", key, ".wav")
+    if hit:
+        logger.info(f"[{req_id}] musique préparée (cache) -> {hit}")
+        return hit
+
+    def _encode(tmp: str):
+        cmd = ("ffmpeg -y -hide_banner -loglevel error "
+               f"-ss {start_at} -i {shlex.quote(src_path)} -vn "
+               f'-af "loudnorm={MUSIC_LOUDNORM_TARGET}" '
+               f"-ar {MUSIC_RATE} -ac 2 -c:a pcm_s16le -f wav {shlex.quote(tmp)}")
+        logger.debug(f"[{req_id}] CMD: {cmd}")
+        p = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        joblog.capture(req_id, cmd, p.stdout, p.returncode)
+        if p.returncode != 0:
+            raise RuntimeError(f"Command failed: {cmd}\n{p.stdout}")
+
+    out = store("music", key, ".wav", _encode)
+    logger.info(f"[{req_id}] musique préparée -> {out} (offset {start_at}s)")
+    return out
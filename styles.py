@@ -1,91 +1,150 @@
-# styles.py — styles externes ultra light
-import os
-from typing import Tuple
+# styles.py — styles externes ultra light, déclarés dans un registre
+# Un style = gabarit de filter_complex + entrées en plus + assets (cache partagé) + coût estimé.
+# Il est compilé UNE fois par (style, W, H, fps) ; par segment il ne reste qu'à injecter la durée.
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
 
 from PIL import Image, ImageDraw  # Pillow est déjà dans requirements
 
 
-def _rounded_mask_path(temp_dir: str, width: int, height: int, radius_px: int) -> str:
+def _corner_png(radius_px: int) -> str:
     """
-    Crée (si absent) un PNG de masque en niveaux de gris (255 à l'intérieur,
-    0 à l'extérieur) avec un grand rectangle à coins arrondis couvrant tout le cadre.
+    Coin arrondi (haut-gauche) en RGBA : noir opaque hors du quart de cercle, transparent dedans.
+    Construit UNE fois par rayon dans le cache disque partagé (namespace "styles"),
+    quel que soit le job ou la résolution ; les 3 autres coins sont obtenus par flip.
     """
-    os.makedirs(temp_dir, exist_ok=True)
-    mask_name = f"rounded_mask_{width}x{height}_r{radius_px}.png"
-    mask_path = os.path.join(temp_dir, mask_name)
-    if os.path.exists(mask_path) and os.path.getsize(mask_path) > 0:
-        return mask_path
+    from cache import key_of, get_or_create
 
-    # Image grayscale "L": 0 = transparent, 255 = opaque
-    img = Image.new("L", (width, height), 0)
-    draw = ImageDraw.Draw(img)
+    def _draw(tmp: str):
+        ss = 4  # suréchantillonnage pour un bord antialiasé
+        big = Image.new("L", (radius_px * ss, radius_px * ss), 255)
+        ImageDraw.Draw(big).ellipse((0, 0, 2 * radius_px * ss, 2 * radius_px * ss), fill=0)
+        alpha = big.resize((radius_px, radius_px), Image.LANCZOS)
+        img = Image.new("RGBA", (radius_px, radius_px), (0, 0, 0, 255))
+        img.putalpha(alpha)
+        img.save(tmp, format="PNG")
 
-    # Rectangle avec coins arrondis plein cadre
-    # (petite marge de 0.5 pour éviter les escaliers sur l'alpha)
-    rect = (0, 0, width, height)
-    draw.rounded_rectangle(rect, radius=radius_px, fill=255)
+    return get_or_create("styles", key_of("corner/v1", radius_px), ".png", _draw)
 
-    img.save(mask_path, format="PNG")
-    return mask_path
 
+# ---------------- registre ----------------
 
-def _build_philo(need_dur: float, width: int, height: int, fps: int, temp_dir: str,
-                 radius_px: int = 48) -> Tuple[str, str, str]:
+@dataclass(frozen=True)
+class StyleSpec:
     """
-    Style "philo" :
-    - crop carré centré
-    - scale à min(W,H)
-    - pad en WxH (centré)
-    - coins arrondis via masque PNG (alphamerge)
-    - format final yuv420p (compatible réseaux sociaux)
-    Retourne: (extra_inputs, filter_complex, map_label)
+    graph  : filter_complex avec {W} {H} {inner} {fps} et les noms d'assets ; [0:v] = source, sortie [v]
+    inputs : entrées ffmpeg en plus (1, 2, …), peuvent utiliser {dur} et les noms d'assets
+    assets : nom -> fonction qui construit le fichier (une fois) et renvoie son chemin
+    cost   : coût CPU relatif par seconde de segment, à résolution égale (chaîne de base = 1.0)
     """
-    inner = min(width, height)
-    mask_path = _rounded_mask_path(temp_dir, width, height, radius_px)
-
-    # Input 0 : source (gif/mp4) — déjà fourni par video_generator
-    # Input 1 : masque PNG (on le fige pendant toute la durée du segment)
-    extra_inputs = f'-loop 1 -t {need_dur:.3f} -i "{mask_path}"'
-
-    # Chaîne vidéo :
-    #  [0:v] -> carré -> scale inner -> pad WxH -> fps -> setsar -> RGBA (pour alphamerge)
-    #  [1:v] -> format gray -> scale WxH => [mask]
-    #  alphamerge -> yuv420p => [v]
-    filter_complex = (
-        f"[0:v]"
-        f"crop='min(iw,ih)':'min(iw,ih)':'(iw-min(iw,ih))/2':'(ih-min(ih,iw))/2',"
-        f"scale={inner}:{inner}:flags=bicubic,"
-        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,"
-        f"fps={fps},setsar=1,format=rgba[base];"
-        f"[1:v]format=gray,scale={width}:{height}[mask];"
-        f"[base][mask]alphamerge,format=yuv420p[v]"
-    )
-
-    map_label = "[v]"
-    return extra_inputs, filter_complex, map_label
+    name: str
+    graph: str
+    inputs: Tuple[str, ...] = ()
+    assets: Dict[str, Callable[[], str]] = field(default_factory=dict)
+    cost: float = 1.0
+    aliases: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class CompiledStyle:
+    name: str
+    extra_inputs: str     # gabarit, reste {dur}
+    filter_complex: str
+    map_label: str
+    cost: float
+
+STYLES: Dict[str, StyleSpec] = {}
+_ALIASES: Dict[str, str] = {}
+
+_GEOM = {"W": 1080, "H": 1920, "inner": 1080, "fps": 30}
+
+def register(spec: StyleSpec) -> StyleSpec:
+    """Valide puis enregistre un style (ValueError si le gabarit est incohérent)."""
+    dummy = {**_GEOM, **{k: "asset.png" for k in spec.assets}}
+    try:
+        graph = spec.graph.format(**dummy)
+        inputs = [s.format(dur=1.0, **dummy) for s in spec.inputs]
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"style {spec.name}: placeholder invalide ({e})")
+    if "[v]" not in graph:
+        raise ValueError(f"style {spec.name}: le graphe doit sortir sur [v]")
+    used = {int(n) for n in re.findall(r"\[(\d+):v\]", graph)}
+    if not used or max(used) > len(inputs) or any(" -i " not in f" {s}" for s in inputs):
+        raise ValueError(f"style {spec.name}: entrées [N:v] incohérentes avec inputs")
+    if spec.cost <= 0:
+        raise ValueError(f"style {spec.name}: cost doit être > 0")
+    STYLES[spec.name] = spec
+    for a in (spec.name,) + spec.aliases:
+        _ALIASES[a] = spec.name
+    return spec
+
+def resolve(style_key) -> Optional[str]:
+    """Nom canonique du style, ou None s'il n'est pas déclaré (=> encodage par défaut)."""
+    s = str(style_key).strip().lower() if style_key is not None else ""
+    return _ALIASES.get(s)
+
+def has_style(style_key) -> bool:
+    return resolve(style_key) is not None
+
+@lru_cache(maxsize=128)
+def compile_style(name: str, width: int, height: int, fps: int) -> CompiledStyle:
+    """Construit les assets et fige le graphe pour (W, H, fps) ; réutilisé par tous les segments."""
+    spec = STYLES[name]
+    geom = {"W": width, "H": height, "inner": min(width, height), "fps": fps}
+    assets = {k: build_asset() for k, build_asset in spec.assets.items()}
+    # {dur} est le seul paramètre par segment : on le garde échappé dans le gabarit
+    extra = " ".join(s.format(dur="{dur}", **geom, **assets) for s in spec.inputs)
+    return CompiledStyle(name, extra, spec.graph.format(**geom, **assets), "[v]", spec.cost)
+
+def style_cost(style_key) -> float:
+    name = resolve(style_key)
+    return STYLES[name].cost if name else 1.0
+
+def estimate_cost(style_key, need_dur: float, width: int, height: int, fps: int) -> float:
+    """Coût estimé d'un segment, en "secondes de segment 1080x1920@30 en style de base"."""
+    px = (width * height * fps) / float(_GEOM["W"] * _GEOM["H"] * _GEOM["fps"])
+    return style_cost(style_key) * max(0.0, need_dur) * px
+
+
+# chaîne de base : carré centré -> scale à min(W,H) -> pad WxH -> fps -> yuv420p
+_BASE = (
+    "[0:v]"
+    "crop='min(iw,ih)':'min(iw,ih)':'(iw-min(iw,ih))/2':'(ih-min(ih,iw))/2',"
+    "scale={inner}:{inner}:flags=bicubic,"
+    "pad={W}:{H}:(ow-iw)/2:(oh-ih)/2:black,"
+    "fps={fps},setsar=1,format=yuv420p"
+)
+
+# "sans style" (équivalent d'un -vf simple) : repli de build() pour les clés inconnues
+register(StyleSpec("plain", graph=_BASE + "[v]", cost=1.0))
+
+# Style "philo" / "rounded" :
+#  - chaîne de base => [base]
+#  - coins arrondis du cadre : 4 petits overlays d'un sprite de coin (une seule image,
+#    overlay la répète ; flips calculés une fois) — tout reste en yuv420p
+register(StyleSpec(
+    "philo",
+    aliases=("rounded",),
+    graph=(
+        _BASE + "[base];"
+        "[1:v]split=4[c0][c1][c2][c3];[c1]hflip[c1f];[c2]vflip[c2f];[c3]hflip,vflip[c3f];"
+        "[base][c0]overlay=0:0[t0];[t0][c1f]overlay=W-w:0[t1];"
+        "[t1][c2f]overlay=0:H-h[t2];[t2][c3f]overlay=W-w:H-h,format=yuv420p[v]"
+    ),
+    inputs=('-i "{corner}"',),
+    assets={"corner": lambda: _corner_png(48)},
+    cost=1.1,
+))
 
 
 def build(style_key, need_dur: float, width: int, height: int, fps: int, temp_dir: str):
     """
     Point d’entrée appelé par video_generator._encode_segment_with_style.
-    - Si style == "philo" ou "rounded" => coins arrondis (aucun filtre).
-    - Sinon => fallback minimal sans arrondi (crop/scale/pad), pour éviter un crash.
+    - Style déclaré (ex. "philo" / "rounded") => son graphe compilé.
+    - Sinon => "plain" (crop/scale/pad), pour éviter un crash.
+    temp_dir est gardé pour compat : les assets vivent dans le cache partagé.
+    Retourne: (extra_inputs, filter_complex, map_label)
     """
-    # Sécurise le style_key même si ce n'est pas une string
-    s = str(style_key).strip().lower() if style_key is not None else "default"
-
-    if s in ("philo", "rounded"):
-        return _build_philo(need_dur, width, height, fps, temp_dir)
-
-    # Fallback "sans style" (équivalent d'un -vf simple)
-    inner = min(width, height)
-    extra_inputs = ""  # aucun input en plus
-    filter_complex = (
-        f"[0:v]"
-        f"crop='min(iw,ih)':'min(iw,ih)':'(iw-min(iw,ih))/2':'(ih-min(ih,iw))/2',"
-        f"scale={inner}:{inner}:flags=bicubic,"
-        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,"
-        f"fps={fps},setsar=1,format=yuv420p[v]"
-    )
-    map_label = "[v]"
-    return extra_inputs, filter_complex, map_label
+    c = compile_style(resolve(style_key) or "plain", int(width), int(height), int(fps))
+    return c.extra_inputs.format(dur=f"{need_dur:.3f}"), c.filter_complex, c.map_label
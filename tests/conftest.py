@@ -0,0 +1,49 @@
+# env isolé pour tous les tests : dossiers jetables, pas de reprise de jobs ni de préchauffage
+import os, sys, tempfile
+
+import pytest
+
+_ROOT = tempfile.mkdtemp(prefix="fusion_tests_")
+for k, sub in (("JOBS_DIR", "jobs"), ("OUTBOX_DIR", "outbox"), ("FUSION_CACHE_DIR", "cache")):
+    os.environ.setdefault(k, os.path.join(_ROOT, sub))
+os.environ.setdefault("RESUME_JOBS", "0")
+os.environ.setdefault("WARMUP", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """
+    generate_video sans réseau ni ffmpeg : download/probe/encode/concat/mux factices.
+    Retourne {"downloads": [url], "encodes": [url], "fail": set(url)} ; une url de "fail" fait échouer son encodage.
+    """
+    import video_generator as vg
+    rec = {"downloads": [], "encodes": [], "fail": set()}
+
+    def _download(url, dst_noext, logger, req_id):
+        rec["downloads"].append(url)
+        with open(dst_noext + ".mp4", "w") as f:
+            f.write(url)
+        return dst_noext + ".mp4"
+
+    def _encode(src, dst, *a, **kw):
+        url = open(src).read()
+        if url in rec["fail"]:
+            with open(dst, "w") as f:
+                f.write("partiel")
+            raise RuntimeError(f"encodage {url}")
+        rec["encodes"].append(url)
+        with open(dst, "w") as f:
+            f.write(url)
+
+    def _mux(video, audio, out, *a, **kw):
+        open(out, "w").close()
+        return "copy"
+
+    monkeypatch.setattr(vg, "_download", _download)
+    monkeypatch.setattr(vg, "_probe_source", lambda p: {"has_video": True, "is_gif": False, "duration": 10.0})
+    monkeypatch.setattr(vg, "_encode_segment_default", _encode)
+    monkeypatch.setattr(vg, "_conform_parts", lambda parts, *a: (parts, 0))
+    monkeypatch.setattr(vg, "_concat_copy_strict", lambda parts, out, *a, **kw: rec.update(parts=parts) or "copy")
+    monkeypatch.setattr(vg, "_mux_audio", _mux)
+    return rec
@@ -0,0 +1,106 @@
+import io, asyncio, json, threading
+
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+import asgi
+import main
+
+
+async def _call(app, method, path, body=b"", headers=(), chunk=None):
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+             "headers": [(k.encode(), v.encode()) for k, v in headers]}
+    parts = [body[i:i + chunk] for i in range(0, len(body), chunk)] if chunk else [body]
+    sent = [{"type": "http.request", "body": b, "more_body": i < len(parts) - 1} for i, b in enumerate(parts)][::-1]
+    out = {"body": b""}
+
+    async def receive():
+        return sent.pop() if sent else {"type": "http.disconnect"}
+
+    async def send(msg):
+        if msg["type"] == "http.response.start":
+            out["status"] = msg["status"]
+        else:
+            out["body"] += msg.get("body", b"")
+    await app(scope, receive, send)
+    return out
+
+
+def test_rendu_sync_et_healthz_en_parallele(monkeypatch, tmp_path):
+    rendering, release = threading.Event(), threading.Event()
+
+    def fake_generate_video(**kw):
+        rendering.set()
+        assert release.wait(10), "healthz jamais servi pendant le rendu"
+        out = tmp_path / "out.mp4"
+        out.write_bytes(b"x")
+        return str(out), {}
+    monkeypatch.setattr(main, "generate_video", fake_generate_video)
+    monkeypatch.setattr(main, "_ffprobe_duration", lambda p: 1.0)
+
+    boundary, body = encode_multipart({
+        "output_name": "t", "plan": json.dumps([{"type": "image", "url": "http://x/a.png", "duration": 1}]),
+        "audio_file": FileStorage(io.BytesIO(b"ID3"), "voice.mp3"),
+    })
+    app = asgi.WsgiPool(main.app, 4)
+
+    async def scenario():
+        render = asyncio.create_task(_call(app, "POST", "/create-video", body,
+                                           [("content-type", f"multipart/form-data; boundary={boundary}"),
+                                            ("content-length", str(len(body)))]))
+        assert await asyncio.get_running_loop().run_in_executor(None, rendering.wait, 10)
+        health = await asyncio.wait_for(_call(app, "GET", "/healthz"), 5)
+        release.set()
+        return health, await asyncio.wait_for(render, 10)
+
+    health, render = asyncio.run(scenario())
+    assert health["status"] == 200
+    assert render["status"] == 200, render["body"]
+    assert json.loads(render["body"])["status"] == "success"
+
+
+def _form(**values):
+    boundary, body = encode_multipart(values)
+    return body, [("content-type", f"multipart/form-data; boundary={boundary}")]
+
+def test_upload_chunked_sans_content_length():
+    body, headers = _form(job_id="../pas-valide", output_name="o.mp4")
+    out = asyncio.run(_call(asgi.WsgiPool(main.app, 2), "POST", "/create-video-async", body, headers, chunk=7))
+    # formulaire lu (job_id vu et refusé) : pas un formulaire vide
+    assert out["status"] == 400 and json.loads(out["body"])["error"] == "invalid_job_id"
+
+def test_corps_borne_pendant_la_reception(monkeypatch):
+    monkeypatch.setitem(main.app.config, "MAX_CONTENT_LENGTH", 1000)
+    body, headers = _form(job_id="x", plan="p" * 5000)
+    out = asyncio.run(_call(asgi.WsgiPool(main.app, 2), "POST", "/create-video-async", body, headers, chunk=512))
+    assert out["status"] == 413
+
+def test_rendus_sync_bornes_healthz_servi(monkeypatch, tmp_path):
+    rendering, release = threading.Event(), threading.Event()
+
+    def fake_generate_video(**kw):
+        rendering.set()
+        assert release.wait(10)
+        out = tmp_path / "out.mp4"
+        out.write_bytes(b"x")
+        return str(out), {}
+    monkeypatch.setattr(main, "generate_video", fake_generate_video)
+    monkeypatch.setattr(main, "_ffprobe_duration", lambda p: 1.0)
+    monkeypatch.setattr(main, "SYNC_SLOTS", threading.BoundedSemaphore(1))
+    c = main.app.test_client()
+
+    def post(name):
+        return c.post("/create-video", data={
+            "output_name": name, "plan": json.dumps([{"url": "http://x/a.png", "duration": 1}]),
+            "audio_file": FileStorage(io.BytesIO(b"ID3"), "voice.mp3")}, content_type="multipart/form-data")
+    first = {}
+    t = threading.Thread(target=lambda: first.update(r=post("a.mp4")))
+    t.start()
+    assert rendering.wait(10)
+    busy = post("b.mp4")
+    assert busy.status_code == 503 and busy.headers["Retry-After"]
+    assert c.get("/healthz").status_code == 200
+    release.set()
+    t.join(10)
+    assert first["r"].status_code == 200
+    assert post("c.mp4").status_code == 200   # slot rendu
@@ -0,0 +1,19 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+@pytest.mark.parametrize("route", ["/create-video", "/create-video-async"])
+@pytest.mark.parametrize("url", ["file:///etc/passwd", "ftp://example.com/a.mp3", "/tmp/voice.mp3"])
+def test_audio_url_hors_http_refusee(client, route, url):
+    r = client.post(route, data={"output_name": "o.mp4", "plan": "[]", "audio_url": url})
+    assert r.status_code == 400
+    assert r.get_json()["error"] == "invalid_audio_url"
+
+def test_fetch_audio_refuse_file(tmp_path):
+    with pytest.raises(ValueError):
+        main._fetch_audio("file:///etc/passwd", str(tmp_path / "voice"))
@@ -0,0 +1,40 @@
+import os, time
+
+import pytest
+
+import cache
+
+
+@pytest.fixture(autouse=True)
+def _root(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_ROOT", str(tmp_path))
+
+def _entry(ns, key, size, age):
+    p = cache.store(ns, key, ".bin", lambda tmp: open(tmp, "wb").write(b"x" * size))
+    t = time.time() - age
+    os.utime(p, (t, t))
+    return p
+
+
+def test_prune_all_evince_par_age():
+    old, fresh = _entry("sprites", "old", 10, 3600), _entry("hls_src", "new", 10, 10)
+    assert cache.prune_all(max_age_sec=600, max_bytes=0) == 1
+    assert not os.path.exists(old) and os.path.exists(fresh)
+
+def test_prune_all_evince_les_moins_recentes_au_dela_de_la_taille():
+    a = _entry("gif_norm", "a", 400, 7200)
+    b = _entry("music", "b", 400, 5400)
+    c = _entry("sprites", "c", 400, 3600)
+    assert cache.prune_all(max_age_sec=0, max_bytes=900) == 1
+    assert [os.path.exists(p) for p in (a, b, c)] == [False, True, True]
+
+def test_prune_all_garde_les_entrees_recentes_meme_au_dessus_de_la_taille():
+    a, b = _entry("sprites", "a", 400, 30), _entry("sprites", "b", 400, 20)
+    assert cache.prune_all(max_age_sec=0, max_bytes=100) == 0
+    assert os.path.exists(a) and os.path.exists(b)
+
+def test_lookup_rafraichit_l_entree():
+    a, b = _entry("sprites", "a", 400, 7200), _entry("sprites", "b", 400, 5400)
+    assert cache.lookup("sprites", "a", ".bin") == a
+    cache.prune_all(max_age_sec=0, max_bytes=500)
+    assert os.path.exists(a) and not os.path.exists(b)
@@ -0,0 +1,57 @@
+import logging, threading, time
+
+import pytest
+
+import video_generator as vg
+
+log = logging.getLogger("test")
+
+
+def _in_job(job_id, cmd, out, started):
+    run = vg.start_job(job_id)
+    try:
+        started.set()
+        vg._run(cmd, log, "meme-req-id")
+        out[job_id] = "done"
+    except vg.JobCancelled:
+        out[job_id] = "cancelled"
+    finally:
+        vg.end_job(run)
+
+
+def test_annulation_par_job_id_meme_req_id():
+    out, threads = {}, []
+    for jid in ("a", "b"):
+        started = threading.Event()
+        t = threading.Thread(target=_in_job, args=(jid, "sleep 1", out, started))
+        t.start()
+        started.wait(5)
+        threads.append(t)
+    time.sleep(0.2)
+    assert vg.cancel_job("a") == 1
+    for t in threads:
+        t.join(10)
+    assert out == {"a": "cancelled", "b": "done"}
+    assert not vg._RUNS and not vg._PROCS and not vg._CANCELLED
+
+def test_annulation_hors_execution_ne_laisse_rien():
+    assert vg.cancel_job("fini") is None
+    run = vg.start_job("fini")
+    try:
+        vg.check_cancelled()
+    finally:
+        vg.end_job(run)
+
+def test_runs_successifs_d_un_meme_job_id_independants():
+    old = vg.start_job("j")
+    vg.cancel_job("j")
+    new = vg.start_job("j")      # relance pendant que l'ancien run se termine
+    vg.check_cancelled(new)      # l'annulation visait l'ancien run
+    with pytest.raises(vg.JobCancelled):
+        vg.check_cancelled(old)
+    vg.end_job(old)              # ne désenregistre pas le nouveau run
+    assert vg.cancel_job("j") == 0
+    with pytest.raises(vg.JobCancelled):
+        vg.check_cancelled(new)
+    vg.end_job(new)
+    assert not vg._RUNS and not vg._PROCS and not vg._CANCELLED
@@ -0,0 +1,30 @@
+import json
+
+from captions import _parse_words
+
+
+def _w(word, start):
+    return {"word": word, "start": start, "end": start + 0.4}
+
+def _texts(payload):
+    return [w["word"] for w in _parse_words(payload)]
+
+
+def test_segments_sans_words_racine():
+    payload = json.dumps({"segments": [{"words": [_w("a", 0), _w("b", 1)]},
+                                       {"words": [_w("c", 2), _w("d", 3)]}]})
+    assert _texts(payload) == ["a", "b", "c", "d"]
+
+def test_words_racine_apres_segments():
+    payload = json.dumps({"segments": [{"words": [_w("x", 0)]}],
+                          "words": [_w("a", 0), _w("b", 1), _w("c", 2)]})
+    assert _texts(payload) == ["a", "b", "c"]
+
+def test_repr_python_words_racine_apres_segments():
+    payload = repr({"segments": [{"words": [_w("x", 0)]}],
+                    "words": [_w("a", 0), _w("b", 1)]})
+    assert _texts(payload) == ["a", "b"]
+
+def test_json_tronque():
+    payload = json.dumps({"words": [_w("a", 0), _w("b", 1), _w("c", 2)]})[:-20]
+    assert _texts(payload)[:2] == ["a", "b"]
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def _jobs(monkeypatch):
+    monkeypatch.setattr(main, "JOBS", {})
+    monkeypatch.setattr(main, "FINGERPRINTS", {})
+
+
+def test_retry_alias_renvoie_statut_et_sortie_du_canonique(tmp_path):
+    assert main._claim_job("a", "fp") is None
+    assert main._claim_job("b", "fp")["duplicate_of"] == "a"
+    out = tmp_path / "a.mp4"
+    out.write_bytes(b"x")
+    main.JOBS["a"].update(status="success", output_path=str(out), finished_at=int(time.time()))
+
+    again = main._claim_job("b", "fp")
+    assert again["status"] == "success"
+    assert again["output_path"] == str(out)
+    assert again["duplicate_of"] == "a"
+
+@pytest.mark.parametrize("state", [{"status": "failed"}, {"status": "success", "output_path": "/nope.mp4"}])
+def test_alias_d_un_canonique_echoue_ou_expire_non_reutilisable(state):
+    assert main._claim_job("a", "fp") is None
+    main._claim_job("b", "fp")
+    main.JOBS["a"].update(finished_at=int(time.time()), **state)
+
+    assert main._claim_job("b", "fp") is None   # relancé pour de vrai
+    assert main.JOBS["b"]["status"] == "queued"
+    assert "duplicate_of" not in main.JOBS["b"]
+
+@pytest.mark.parametrize("status", ["queued", "running", "cancelling"])
+def test_reclaim_d_un_job_actif_en_conflit(status, tmp_path):
+    main.JOBS["a"] = {"job_id": "a", "status": status}
+    tmp = tmp_path / "spool"
+    tmp.mkdir()
+    with main.app.test_request_context():
+        resp, code = main._submit_job("a", {"req_id": "r", "audio_digest": "x", "output_name": "o"}, str(tmp))
+    assert code == 409 and resp.get_json()["status"] == status
+    assert main.JOBS["a"]["status"] == status and not tmp.exists()
@@ -0,0 +1,83 @@
+import json, os, time
+
+import pytest
+
+import delivery
+import main
+
+
+@pytest.fixture
+def outbox(monkeypatch, tmp_path):
+    monkeypatch.setattr(delivery, "OUTBOX_DIR", str(tmp_path))
+    monkeypatch.setattr(delivery, "_heap", [])
+    monkeypatch.setattr(delivery, "_started", True)   # pas de dispatcher : _attempt appelé à la main
+    reports = []
+    monkeypatch.setattr(delivery, "on_status", lambda job_id, kind, state: reports.append(dict(state)))
+    return tmp_path, reports
+
+def _codes(monkeypatch, *codes):
+    seq = list(codes)
+    def post(url, payload):
+        c = seq.pop(0)
+        if isinstance(c, Exception):
+            raise c
+        return c
+    monkeypatch.setattr(delivery, "_post", post)
+
+
+def test_reessai_avec_backoff_puis_livre(outbox, monkeypatch):
+    root, reports = outbox
+    _codes(monkeypatch, 503, OSError("reset"), 200)
+    did = delivery.enqueue("http://hook", {"a": 1}, job_id="j", kind="callback")
+    for attempt in (1, 2):
+        delivery._attempt(did)
+        item = json.load(open(root / f"{did}.json"))
+        assert item["status"] == "retrying" and item["attempts"] == attempt
+        assert item["next_at"] > time.time()
+    assert [t for t, _ in delivery._heap].count(item["next_at"]) == 1
+    delivery._attempt(did)
+    assert not (root / f"{did}.json").exists()
+    assert reports[-1]["status"] == "delivered" and reports[-1]["attempts"] == 3
+
+def test_4xx_echec_definitif_sans_reessai(outbox, monkeypatch):
+    root, reports = outbox
+    _codes(monkeypatch, 404)
+    did = delivery.enqueue("http://hook", {}, job_id="j")
+    delivery._attempt(did)
+    assert not (root / f"{did}.json").exists()
+    assert json.load(open(root / "failed" / f"{did}.json"))["last_error"] == "HTTP 404"
+    assert reports[-1]["status"] == "failed" and reports[-1]["attempts"] == 1
+
+def test_echec_apres_max_tentatives(outbox, monkeypatch):
+    root, reports = outbox
+    monkeypatch.setattr(delivery, "DELIVERY_MAX_ATTEMPTS", 2)
+    _codes(monkeypatch, 500, 429)
+    did = delivery.enqueue("http://hook", {})
+    delivery._attempt(did)
+    delivery._attempt(did)
+    assert reports[-1]["status"] == "failed" and reports[-1]["last_error"] == "HTTP 429"
+
+def test_traces_d_echec_bornees(outbox, monkeypatch):
+    root, _ = outbox
+    monkeypatch.setattr(delivery, "DELIVERY_FAILED_MAX", 2)
+    monkeypatch.setattr(delivery, "DELIVERY_FAILED_RETENTION_SEC", 3600)
+    (root / "failed").mkdir()
+    for i, age in enumerate((7200, 30, 20, 10)):
+        p = root / "failed" / f"{i}.json"
+        p.write_text("{}")
+        os.utime(p, (time.time() - age,) * 2)
+    assert delivery.prune_failed() == 2
+    assert sorted(os.listdir(root / "failed")) == ["2.json", "3.json"]
+
+
+def test_startup_reprend_les_jobs_avant_l_outbox(monkeypatch, tmp_path):
+    order = []
+    monkeypatch.setattr(main, "_STARTED", False)
+    monkeypatch.setattr(main, "RESUME_JOBS", True)
+    monkeypatch.setattr(main, "JOBS_PRUNE_EVERY_SEC", 0)
+    monkeypatch.setattr(main, "WARMUP", False)
+    monkeypatch.setattr(main, "_resume_jobs", lambda: order.append("resume"))
+    monkeypatch.setattr(delivery, "start", lambda: order.append("delivery"))
+    monkeypatch.setattr(main.cache, "start_pruner", lambda: None)
+    main.startup()
+    assert order == ["resume", "delivery"]
@@ -0,0 +1,29 @@
+import pytest
+
+import encode_profile
+import main
+
+
+@pytest.fixture(autouse=True)
+def _fresh(monkeypatch):
+    monkeypatch.setattr(encode_profile, "_speed", 0.8)
+    monkeypatch.setattr(encode_profile, "_samples", 0)
+
+
+@pytest.mark.parametrize("profile", encode_profile.ORDER)
+def test_estimate_wall_redonne_la_duree_mesuree(profile):
+    encode_profile.record(profile, 12.0, 30.0)
+    assert encode_profile.estimate_wall(profile, 12.0) == pytest.approx(30.0)
+    # autre profil : même vitesse de référence, coût relatif appliqué
+    ref = encode_profile.estimate_wall("superfast", 12.0)
+    assert ref == pytest.approx(30.0 / encode_profile.PROFILES[profile]["cost"])
+
+def test_record_speed_travail_et_duree_des_parts_encodes():
+    enc = {"profile": "superfast", "work": 50.0}   # work du choix : parts + passe captions
+    main._record_speed(enc, {"style_cost": 10.0, "encode_sec": 20.0})
+    assert enc["encoded_work"] == 10.0 and enc["wall"] == 20.0
+    assert encode_profile.estimate_wall("superfast", 10.0) == pytest.approx(20.0)
+
+def test_record_speed_sans_part_encode_ne_touche_pas_la_vitesse():
+    main._record_speed({"profile": "superfast", "work": 50.0}, {"style_cost": 0.0, "encode_sec": 0.0})
+    assert encode_profile.speed() == 0.8
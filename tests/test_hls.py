@@ -0,0 +1,87 @@
+import logging, subprocess
+
+import pytest
+
+import cache
+import hls
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=9000000,RESOLUTION=3840x2160
+uhd/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1920x1080
+hd/index.m3u8
+"""
+
+def _media(n, extra=""):
+    return "#EXTM3U\n#EXT-X-TARGETDURATION:4\n" + extra + "".join(f"#EXTINF:4.0,\nseg{i}.ts\n" for i in range(n)) + "#EXT-X-ENDLIST\n"
+
+@pytest.fixture
+def served(monkeypatch):
+    # url -> contenu, à la place du réseau
+    pages = {}
+    def _get(url):
+        if url not in pages:
+            raise RuntimeError(f"HLS GET {url}: 404")
+        return pages[url]
+    monkeypatch.setattr(hls, "_get", _get)
+    return pages
+
+
+def test_is_hls():
+    assert hls.is_hls("https://cdn/x/master.m3u8?token=1")
+    assert not hls.is_hls("https://cdn/x/video.mp4") and not hls.is_hls("/local/a.m3u8")
+
+def test_maitre_vers_variante_qui_tient_en_hauteur(served):
+    served["https://cdn/v/master.m3u8"] = MASTER.encode()
+    served["https://cdn/v/hd/index.m3u8"] = _media(3).encode()
+    pl = hls.playlist("https://cdn/v/master.m3u8", 0)
+    assert pl["url"] == "https://cdn/v/hd/index.m3u8"
+    assert pl["segments"][0] == ("https://cdn/v/hd/seg0.ts", 4.0) and pl["total"] == 12.0
+
+def test_segments_limites_a_la_duree_utile(served):
+    served["https://cdn/m.m3u8"] = _media(10).encode()
+    pl = hls.playlist("https://cdn/m.m3u8", 9.0)
+    # 3 segments de 4 s couvrent 9 s, les suivants ne sont pas téléchargés
+    assert [u for u, _ in pl["segments"]] == [f"https://cdn/seg{i}.ts" for i in range(3)] and pl["total"] == 12.0
+
+@pytest.mark.parametrize("body, err", [
+    (_media(2, '#EXT-X-KEY:METHOD=AES-128,URI="k.key"\n'), "chiffré"),
+    (_media(2, "#EXT-X-BYTERANGE:1000@0\n"), "byte-range"),
+    (_media(2, '#EXT-X-MAP:URI="init.mp4",BYTERANGE="800@0"\n'), "byte-range"),
+    ("<html>404</html>", "m3u8"),
+    ("#EXTM3U\n#EXT-X-ENDLIST\n", "sans segment"),
+])
+def test_playlists_non_prechargeables(served, body, err):
+    served["https://cdn/m.m3u8"] = body.encode()
+    with pytest.raises(ValueError, match=err):
+        hls.playlist("https://cdn/m.m3u8", 0)
+
+def test_key_method_none_accepte(served):
+    served["https://cdn/m.m3u8"] = _media(2, "#EXT-X-KEY:METHOD=NONE\n").encode()
+    assert len(hls.playlist("https://cdn/m.m3u8", 0)["segments"]) == 2
+
+def test_prefetch_lecture_directe_si_non_prechargeable(served):
+    served["https://cdn/m.m3u8"] = _media(2, '#EXT-X-KEY:METHOD=AES-128,URI="k"\n').encode()
+    assert hls.prefetch("https://cdn/m.m3u8", 5, logging.getLogger("t"), "r") is None
+
+def test_prefetch_fmp4_remuxe_et_mis_en_cache(served, monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_ROOT", str(tmp_path / "cache"))
+    src = tmp_path / "src"
+    src.mkdir()
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "color=c=black:s=64x64:r=10",
+                    "-t", "6", "-c:v", "libx264", "-g", "10", "-f", "hls", "-hls_time", "1",
+                    "-hls_segment_type", "fmp4", "-hls_playlist_type", "vod", str(src / "media.m3u8")], check=True)
+    for f in src.iterdir():
+        served[f"https://cdn/f/{f.name}"] = f.read_bytes()
+
+    out = hls.prefetch("https://cdn/f/media.m3u8", 2.5, logging.getLogger("t"), "r")
+    assert out and out.startswith(str(tmp_path / "cache"))
+    # init + 3 segments d'1 s (couvrent 2,5 s) : seuls ceux-là sont récupérés
+    fetched = []
+    monkeypatch.setattr(hls, "_get", lambda u: fetched.append(u) or served[u])
+    assert hls.prefetch("https://cdn/f/media.m3u8", 2.5, logging.getLogger("t"), "r") == out
+    assert fetched == ["https://cdn/f/media.m3u8"]
+    dur = subprocess.run(["ffmpeg", "-hide_banner", "-i", out], stderr=subprocess.PIPE, text=True).stderr
+    assert "Duration: 00:00:03" in dur
@@ -0,0 +1,61 @@
+import json, logging, os, time
+
+import main
+import video_generator as vg
+
+A, B, C = ({"url": f"http://x/{n}.mp4", "duration": 1} for n in "abc")
+
+
+def _render(workdir, plan, width=320, **kw):
+    os.makedirs(workdir, exist_ok=True)
+    return vg.generate_video(plan=plan, audio_path="voice.mp3", output_name="out.mp4", temp_dir=str(workdir),
+                             width=width, height=240, fps=10, logger=logging.getLogger("t"), req_id="r", **kw)
+
+def _wait(client, jid, timeout=10):
+    for _ in range(int(timeout / 0.05)):
+        d = client.get(f"/jobs/{jid}").get_json()
+        if d.get("status") in ("success", "failed", "cancelled"):
+            return d
+        time.sleep(0.05)
+    raise AssertionError(f"{jid}: {d}")
+
+
+def test_parts_de_la_base_repris_sans_reencodage(tmp_path, fake_ffmpeg):
+    _render(tmp_path / "base", [A, B])
+    fake_ffmpeg["encodes"].clear()
+    _, debug = _render(tmp_path / "patch", [A, C, B], reuse_dir=str(tmp_path / "base"))
+    assert fake_ffmpeg["encodes"] == ["http://x/c.mp4"]
+    assert debug["dedup"]["reused_from_base"] == 2
+    # hardlink : aucun octet copié, et le part repris est indexé dans le parts.json du nouveau rendu
+    assert os.path.samefile(tmp_path / "patch" / "part_000.mp4", tmp_path / "base" / "part_000.mp4")
+    assert len(vg._load_parts_index(str(tmp_path / "patch"))) == 3
+
+def test_autres_reglages_pas_de_reprise(tmp_path, fake_ffmpeg):
+    _render(tmp_path / "base", [A, B])
+    fake_ffmpeg["encodes"].clear()
+    _render(tmp_path / "patch", [A, B], width=480, reuse_dir=str(tmp_path / "base"))
+    assert fake_ffmpeg["encodes"] == ["http://x/a.mp4", "http://x/b.mp4"]
+
+def test_patch_ne_reencode_que_les_segments_changes(tmp_path, fake_ffmpeg, monkeypatch):
+    monkeypatch.setattr(main, "_ffprobe_duration", lambda p: 2.0)
+    c = main.app.test_client()
+    voice = tmp_path / "voice.mp3"
+    voice.write_bytes(b"ID3")
+    jid = c.post("/create-video-async", data={
+        "output_name": f"{tmp_path.name}.mp4", "plan": json.dumps([A, B]), "audio_file": (open(voice, "rb"), "voice.mp3"),
+    }, content_type="multipart/form-data").get_json()["job_id"]
+    assert _wait(c, jid)["status"] == "success"
+    fake_ffmpeg["encodes"].clear()
+
+    r = c.patch(f"/jobs/{jid}/plan", json={"plan": [A, C], "output_name": f"{tmp_path.name}_v2.mp4"})
+    assert r.status_code == 202, r.get_json()
+    d = _wait(c, r.get_json()["job_id"])
+    assert d["status"] == "success" and d["base_job_id"] == jid
+    assert fake_ffmpeg["encodes"] == ["http://x/c.mp4"]
+    assert d["output_path"].endswith(f"{tmp_path.name}_v2.mp4")
+
+def test_patch_refuse(tmp_path):
+    c = main.app.test_client()
+    r = c.patch("/jobs/inconnu/plan", json={"plan": [A]})
+    assert r.status_code == 400 and r.get_json()["error"] == "patch_failed"
+    assert c.patch("/jobs/inconnu/plan", json={}).get_json()["detail"] == "plan requis"
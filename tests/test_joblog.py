@@ -0,0 +1,65 @@
+import json, os, time
+
+import joblog
+import main
+
+
+def test_sortie_commande_tronquee(monkeypatch):
+    monkeypatch.setattr(joblog, "JOB_LOG_CMD_LINES", 3)
+    joblog.set_stage("jl-cmd", "encoding")
+    joblog.capture("jl-cmd", "ffmpeg -i x", "\n".join(f"l{i}" for i in range(10)), 1)
+    e = joblog.tail("jl-cmd")[-1]
+    assert e["level"] == "CMD" and e["rc"] == 1 and e["stage"] == "encoding"
+    assert e["output"] == ["... 7 lignes omises", "l7", "l8", "l9"]
+
+def test_ring_et_jobs_bornes(monkeypatch):
+    monkeypatch.setattr(joblog, "JOB_LOG_LINES", 2)
+    monkeypatch.setattr(joblog, "JOB_LOG_JOBS", 2)
+    for i in range(3):
+        joblog.capture("jl-a", f"cmd{i}", "", 0)
+    assert [e["msg"] for e in joblog.tail("jl-a")] == ["cmd1", "cmd2"] and len(joblog.tail("jl-a", 1)) == 1
+    joblog.capture("jl-b", "x", "", 0)
+    joblog.tail("jl-a")
+    joblog.capture("jl-a", "récent", "", 0)   # jl-a redevient le plus récent : jl-b sort en premier
+    joblog.capture("jl-c", "x", "", 0)
+    assert joblog.tail("jl-b") is None and joblog.tail("jl-a") and joblog.tail("jl-c")
+
+def test_dump_puis_load(tmp_path):
+    assert joblog.dump("jl-inconnu", str(tmp_path / "x.jsonl")) is None
+    for i in range(4):
+        joblog.capture("jl-d", f"cmd{i}", "ok", 0)
+    path = joblog.dump("jl-d", str(tmp_path / "debug" / "logs.jsonl"))
+    assert [e["msg"] for e in joblog.load(path, 2)] == ["cmd2", "cmd3"]
+    assert joblog.load(str(tmp_path / "absent.jsonl")) is None
+
+def test_route_logs_memoire_puis_disque(monkeypatch, tmp_path):
+    def fake(**kw):
+        main.app.logger.info(f"[{kw['req_id']}] segment 0")
+        joblog.capture(kw["req_id"], "ffmpeg -i a.mp4", "Invalid data found", 1)
+        raise RuntimeError("ffmpeg a échoué")
+    monkeypatch.setattr(main, "generate_video", fake)
+    c = main.app.test_client()
+    voice = tmp_path / "voice.mp3"
+    voice.write_bytes(b"ID3")
+    jid = c.post("/create-video-async", data={
+        "output_name": f"{tmp_path.name}.mp4", "plan": json.dumps([{"url": "http://x/a.mp4", "duration": 1}]),
+        "audio_file": (open(voice, "rb"), "voice.mp3"),
+    }, content_type="multipart/form-data").get_json()["job_id"]
+    for _ in range(200):
+        if main.JOBS[jid].get("status") == "failed":
+            break
+        time.sleep(0.05)
+
+    d = c.get(f"/jobs/{jid}/logs").get_json()
+    assert d["status"] == "failed" and d["source"] == "memory"
+    cmd = [e for e in d["lines"] if e["level"] == "CMD"]
+    assert cmd and cmd[0]["output"] == ["Invalid data found"] and cmd[0]["stage"] == "encoding"
+    assert any("segment 0" in e["msg"] for e in d["lines"])
+    assert len(c.get(f"/jobs/{jid}/logs?tail=1").get_json()["lines"]) == 1
+
+    # ring évincé (redémarrage, LRU) : le fichier écrit à l'échec prend le relais
+    assert os.path.isfile(main.JOBS[jid]["logs_path"])
+    joblog._rings.pop(d["req_id"])
+    d = c.get(f"/jobs/{jid}/logs").get_json()
+    assert d["source"] == "disk" and any(e["level"] == "CMD" for e in d["lines"])
+    assert c.get("/jobs/absent/logs").status_code == 404
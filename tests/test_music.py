@@ -0,0 +1,34 @@
+import os, time
+
+import cache
+import main
+import music_store
+
+
+class _Drive:
+    # service Drive minimal : un dossier avec une seule piste
+    def files(self):
+        return self
+    def list(self, **kw):
+        return self
+    def execute(self):
+        return {"files": [{"id": "f1", "name": "titre@3.mp3", "md5Checksum": "m"}]}
+
+
+def test_piste_preparee_copiee_dans_le_workdir(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_ROOT", str(tmp_path / "cache"))
+    monkeypatch.setattr(main, "_gdrive_service", lambda: _Drive())
+    monkeypatch.setattr(music_store, "source", lambda fid, md5, fname, dl: "/dev/null")
+    prepared = cache.store("music", "k", ".wav", lambda tmp: open(tmp, "wb").write(b"RIFF"))
+    monkeypatch.setattr(music_store, "prepare", lambda *a, **kw: prepared)
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+
+    path, delay = main._gdrive_pick_and_download_music("dossier", str(workdir), main.app.logger, "r")
+    assert os.path.dirname(path) == str(workdir) and delay == 0
+
+    # entrée du cache purgée (âge) : la piste du job reste là pour une reprise / un PATCH
+    old = time.time() - 10 * 86400
+    os.utime(prepared, (old, old))
+    assert cache.prune_all(max_age_sec=86400, max_bytes=0) == 1
+    assert open(path, "rb").read() == b"RIFF"
@@ -0,0 +1,28 @@
+import subprocess
+
+import video_generator as vg
+
+
+def _encode(path, *extra):
+    subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                    "-i", "color=c=black:s=64x64:r=10", "-frames:v", "5", "-c:v", "libx264", *extra, str(path)],
+                   check=True)
+
+
+def test_signature_lue_dans_le_moov(tmp_path):
+    part = tmp_path / "p.mp4"
+    _encode(part, "-movflags", "+faststart")
+    avcc, timescale, traks = vg._part_signature(str(part))
+    assert avcc and timescale and traks == 1
+
+def test_octets_du_mdat_ignores(tmp_path):
+    # moov en fin de fichier : des octets "trak"/"avcC" dans mdat ne changent pas la signature
+    part = tmp_path / "p.mp4"
+    _encode(part)
+    ref = vg._part_signature(str(part))
+    data = bytearray(part.read_bytes())
+    i = data.find(b"mdat") + 64
+    data[i:i + 12] = b"\0\0\0\x10traktrak"
+    data[i + 32:i + 40] = b"\0\0\0\x09avcC"
+    part.write_bytes(bytes(data))
+    assert vg._part_signature(str(part)) == ref
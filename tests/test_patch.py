@@ -0,0 +1,81 @@
+import json, os, threading, time
+
+import pytest
+
+import main
+
+
+def _wait(client, jid, states=("success", "failed", "cancelled"), timeout=10):
+    for _ in range(int(timeout / 0.05)):
+        d = client.get(f"/jobs/{jid}").get_json()
+        if d.get("status") in states:
+            return d
+        time.sleep(0.05)
+    raise AssertionError(f"{jid}: {d}")
+
+
+@pytest.fixture
+def render(monkeypatch):
+    """generate_video factice : enregistre ses appels, bloque tant que gate n'est pas ouvert."""
+    calls, gate = [], threading.Event()
+    gate.set()
+
+    def fake(**kw):
+        calls.append(kw)
+        assert gate.wait(10)
+        out = os.path.join(kw["temp_dir"], kw["output_name"])
+        with open(out, "wb") as f:
+            f.write(b"x")
+        return out, {"style_cost": 0.0, "encode_sec": 0.0}
+    monkeypatch.setattr(main, "generate_video", fake)
+    monkeypatch.setattr(main, "_ffprobe_duration", lambda p: 1.0)
+    return calls, gate
+
+@pytest.fixture
+def base(render, tmp_path):
+    """Job de base terminé, créé par la vraie route async (spool : voice.mp3, plan.json, captions.srt)."""
+    c = main.app.test_client()
+    voice = tmp_path / "voice.mp3"
+    voice.write_bytes(b"ID3")
+    r = c.post("/create-video-async", data={
+        "output_name": f"{tmp_path.name}.mp4", "plan": json.dumps([{"url": "http://x/a.mp4", "duration": 1}]),
+        "srt_text": '{"words": []}', "audio_file": (open(voice, "rb"), "voice.mp3"),
+    }, content_type="multipart/form-data")
+    jid = r.get_json()["job_id"]
+    assert _wait(c, jid)["status"] == "success"
+    return c, jid, main.JOB_FIELDS[jid]
+
+
+def test_patch_reprend_les_entrees_dans_son_propre_spool(base, render):
+    c, jid, bf = base
+    r = c.patch(f"/jobs/{jid}/plan", json={"plan": [{"url": "http://x/b.mp4", "duration": 1}]})
+    assert r.status_code == 202, r.get_json()
+    pid = r.get_json()["job_id"]
+    assert _wait(c, pid)["status"] == "success"
+    pf = main.JOB_FIELDS[pid]
+    assert pf["spool_dir"] != bf["spool_dir"]
+    for k in ("plan_path", "srt_text_path", "audio_path"):
+        assert os.path.dirname(pf[k]) == pf["spool_dir"]
+    call = render[0][-1]
+    assert call["plan"][0]["url"] == "http://x/b.mp4" and call["reuse_dir"][1] == main.JOBS[jid]["workdir"]
+
+def test_annuler_un_patch_ne_touche_pas_la_base(base, render):
+    c, jid, bf = base
+    calls, gate = render
+    gate.clear()
+    r = c.patch(f"/jobs/{jid}/plan", json={"plan": [{"url": "http://x/b.mp4", "duration": 1}]})
+    pid = r.get_json()["job_id"]
+    for _ in range(200):
+        if len(calls) == 2:
+            break
+        time.sleep(0.05)
+    assert c.delete(f"/jobs/{pid}").status_code == 202
+    gate.set()
+    assert _wait(c, pid)["status"] == "cancelled"
+    assert not os.path.exists(main.JOB_FIELDS[pid]["spool_dir"])
+    for k in ("plan_path", "srt_text_path", "audio_path"):
+        assert os.path.exists(bf[k])
+    # la base reste re-rendable
+    r = c.patch(f"/jobs/{jid}/plan", json={"plan": [{"url": "http://x/c.mp4", "duration": 1}]})
+    assert r.status_code == 202, r.get_json()
+    assert _wait(c, r.get_json()["job_id"])["status"] == "success"
@@ -0,0 +1,28 @@
+import logging
+
+import pytest
+
+import video_generator as vg
+
+
+def _render(tmp_path, plan, **kw):
+    return vg.generate_video(plan=plan, audio_path="voice.mp3", output_name="out.mp4", temp_dir=str(tmp_path),
+                             width=320, height=240, fps=10, logger=logging.getLogger("t"), req_id="r", **kw)
+
+
+def test_un_encodage_par_url_duree(tmp_path, fake_ffmpeg):
+    plan = [{"url": "http://x/a.mp4", "duration": 2}, {"url": "http://x/b.mp4", "duration": 2},
+            {"url": "http://x/a.mp4", "duration": 2.0001}, {"url": "http://x/a.mp4", "duration": 3}]
+    _, debug = _render(tmp_path, plan)
+    # (a, 2) à 1 ms près => un seul part, référencé deux fois dans la concat ; (a, 3) est un autre part
+    assert fake_ffmpeg["encodes"] == ["http://x/a.mp4", "http://x/b.mp4", "http://x/a.mp4"]
+    assert fake_ffmpeg["downloads"] == ["http://x/a.mp4", "http://x/b.mp4"]
+    parts = fake_ffmpeg["parts"]
+    assert len(parts) == 4 and parts[0] == parts[2] and parts[3] != parts[0]
+    assert debug["dedup"] == {"segments": 4, "encoded_parts": 3, "reused_parts": 1, "sources": 2,
+                              "shared_downloads": 1, "reused_from_base": 0}
+
+def test_url_requise(tmp_path, fake_ffmpeg):
+    with pytest.raises(ValueError, match="plan\\[1\\]"):
+        _render(tmp_path, [{"url": "http://x/a.mp4"}, {"duration": 1}])
+    assert fake_ffmpeg["encodes"] == []   # plan validé avant tout encodage
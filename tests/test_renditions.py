@@ -0,0 +1,49 @@
+import logging, os, re, subprocess
+
+import pytest
+
+import main
+import video_generator as vg
+
+
+def test_spec_texte_et_json():
+    assert vg.parse_renditions("") == [] and vg.parse_renditions(None) == []
+    r = vg.parse_renditions("721x1281, poster@2.5,webp@30")
+    assert r[0] == {"kind": "video", "width": 720, "height": 1280, "name": "720x1280"}
+    assert r[1] == {"kind": "poster", "at": 2.5, "name": "poster"}
+    assert r[2]["kind"] == "webp" and r[2]["duration"] == 10.0 and r[2]["name"] == "preview"
+    assert vg.parse_renditions('[{"kind": "poster", "at": -3, "width": 301}, "poster@9"]') == \
+        [{"kind": "poster", "at": 0.0, "name": "poster", "width": 300}]   # doublon ignoré
+    assert vg.parse_renditions({"width": 480, "height": 854})[0]["name"] == "480x854"
+
+@pytest.mark.parametrize("spec", ["bogus", "8x8", "axb", '[{"kind": "gif"}]', '[{"kind": "video", "width": 480}]',
+                                  ",".join(f"{w}x{w}" for w in range(100, 120, 2))])
+def test_spec_invalide(spec):
+    with pytest.raises(ValueError):
+        vg.parse_renditions(spec)
+
+def test_graphe_avec_sortie_principale():
+    graph, outs, files = vg.rendition_graph("[v]", vg.parse_renditions("360x640,poster"), "/w/out.mp4", "-c:v libx264",
+                                            duration=1.0, main_label="[vmain]")
+    assert graph.startswith("[v]split=3[vmain][r0][r1]")
+    assert "trim=start=0.500" in graph   # poster jamais après le milieu d'une vidéo courte
+    assert [f["path"] for f in files] == ["/w/out_360x640.mp4", "/w/out_poster.jpg"]
+    assert "-map 0:a?" in outs
+
+def test_nom_drive_a_cote_du_principal():
+    item = main._rendition_item({"kind": "video", "name": "360x640", "path": "/w/x_360x640.mp4"}, "clip.mp4")
+    assert item["file_name"] == "clip_360x640.mp4" and item["output_path"] == "/w/x_360x640.mp4"
+    assert "path" not in item
+
+def test_render_une_passe(tmp_path):
+    src = str(tmp_path / "out.mp4")
+    subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                    "-f", "lavfi", "-i", "testsrc=s=320x240:r=10:d=2", "-f", "lavfi", "-i", "sine=d=2",
+                    "-c:v", "libx264", "-c:a", "aac", "-shortest", src], check=True)
+    files = vg.render_renditions(src, vg.parse_renditions("160x284,poster,webp@1"), "-c:v libx264 -preset ultrafast",
+                                 logging.getLogger("t"), "r", duration=2.0)
+    assert [os.path.basename(f["path"]) for f in files] == ["out_160x284.mp4", "out_poster.jpg", "out_preview.webp"]
+    for f in files:
+        assert os.path.getsize(f["path"]) > 0
+    info = subprocess.run(["ffmpeg", "-hide_banner", "-i", files[0]["path"]], stderr=subprocess.PIPE, text=True).stderr
+    assert re.search(r"Video: h264.* 160x284", info) and "Audio: aac" in info   # letterbox + audio copié
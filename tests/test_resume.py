@@ -0,0 +1,89 @@
+import json, logging, os, time
+
+import pytest
+
+import main
+import video_generator as vg
+
+A, B = ({"url": f"http://x/{n}.mp4", "duration": 1} for n in "ab")
+
+
+def _render(workdir, plan, **kw):
+    return vg.generate_video(plan=plan, audio_path="voice.mp3", output_name="out.mp4", temp_dir=str(workdir),
+                             width=320, height=240, fps=10, logger=logging.getLogger("t"), req_id="r", **kw)
+
+
+def test_reprise_depuis_parts_json(tmp_path, fake_ffmpeg):
+    fake_ffmpeg["fail"].add("http://x/b.mp4")
+    with pytest.raises(RuntimeError):
+        _render(tmp_path, [A, B])
+    # checkpoint après chaque part complet : a est indexé, le part partiel de b ne l'est pas
+    assert list(vg._load_parts_index(str(tmp_path)).values()) == ["part_000.mp4"]
+
+    fake_ffmpeg["fail"].clear()
+    fake_ffmpeg["encodes"].clear()
+    _, debug = _render(tmp_path, [A, B], reuse_dir=str(tmp_path))
+    assert fake_ffmpeg["encodes"] == ["http://x/b.mp4"] and debug["dedup"]["reused_from_base"] == 1
+    assert (tmp_path / "part_001.mp4").read_text() == "http://x/b.mp4"   # partiel remplacé
+
+
+@pytest.fixture
+def jobs_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(main, "_ffprobe_duration", lambda p: 2.0)
+    return tmp_path / "jobs"
+
+def _persist(jid, tmp_path, status, manifest=None):
+    voice = tmp_path / f"{jid}.mp3"
+    voice.write_bytes(b"ID3")
+    d = main._job_dir(jid)
+    fields = {"output_name": f"{jid}.mp4", "plan": json.dumps([A, B]), "audio_path": str(voice), "req_id": jid,
+              "encoding": {"profile": "faster", "reason": "test", "work": 1.0}}
+    main._write_json(os.path.join(d, "fields.json"), fields)
+    main._write_json(os.path.join(d, "state.json"), {"status": status, "job_id": jid, "enqueued_at": int(time.time())})
+    if manifest:
+        main._write_json(os.path.join(d, "manifest.json"), manifest)
+    return d
+
+def _wait(jid, timeout=10):
+    for _ in range(int(timeout / 0.05)):
+        if main.JOBS[jid].get("status") in ("success", "failed"):
+            return main.JOBS[jid]
+        time.sleep(0.05)
+    raise AssertionError(main.JOBS[jid])
+
+def test_reprise_saute_les_etapes_du_manifest(jobs_dir, tmp_path, monkeypatch):
+    jid = f"{tmp_path.name}-rendu"
+    d = jobs_dir / jid / "work"
+    d.mkdir(parents=True)
+    (d / "out.mp4").write_bytes(b"mp4")
+    _persist(jid, tmp_path, "running", {"rendered": {"out_path": str(d / "out.mp4"), "gen_debug": {"mode": "copy"}}})
+
+    def _no_render(**kw):
+        raise AssertionError("étape rendered déjà faite")
+    monkeypatch.setattr(main, "generate_video", _no_render)
+    main._resume_jobs()
+    st = _wait(jid)
+    assert st["status"] == "success" and st["output_path"] == str(d / "out.mp4") and st.get("resumed_at")
+    assert set(main._read_json(str(jobs_dir / jid / "manifest.json"))) == {"rendered", "captioned"}
+
+def test_reprise_sans_manifest_reprend_les_parts(jobs_dir, tmp_path, fake_ffmpeg):
+    jid = f"{tmp_path.name}-parts"
+    work = jobs_dir / jid / "work"
+    work.mkdir(parents=True)
+    _persist(jid, tmp_path, "running")
+    # crash après le premier part : parts.json du workdir stable du job
+    pkey = vg._part_key(("http://x/a.mp4", 1.0, "default"), 1080, 1920, 30, vg.PROFILES["faster"]["segment"])
+    (work / "part_000.mp4").write_text("http://x/a.mp4")
+    vg._save_parts_index(str(work), {pkey: str(work / "part_000.mp4")})
+
+    main._resume_jobs()
+    assert _wait(jid)["status"] == "success"
+    assert fake_ffmpeg["encodes"] == ["http://x/b.mp4"]
+
+def test_jobs_termines_recharges_non_relances(jobs_dir, tmp_path, monkeypatch):
+    jid = f"{tmp_path.name}-fini"
+    _persist(jid, tmp_path, "success")
+    monkeypatch.setattr(main, "_schedule", lambda *a: pytest.fail("job terminé resoumis"))
+    main._resume_jobs()
+    assert main.JOBS[jid]["status"] == "success" and main.JOB_FIELDS[jid]["output_name"] == f"{jid}.mp4"
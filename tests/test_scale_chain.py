@@ -0,0 +1,12 @@
+import video_generator as vg
+
+GIF = {"width": 240, "height": 240, "is_gif": True, "pix_fmt": "pal8", "r_frame_rate": 10.0, "avg_frame_rate": 10.0}
+
+
+def test_gif_upscale_bicubic_par_defaut():
+    assert vg.GIF_SCALE_FLAGS == "bicubic"
+    assert "scale=1080:1080:flags=bicubic" in vg._default_vf(1080, 1080, 1920, 30, probe=GIF)
+
+def test_gif_upscale_rapide_en_opt_in(monkeypatch):
+    monkeypatch.setattr(vg, "GIF_SCALE_FLAGS", "fast_bilinear")
+    assert "flags=fast_bilinear" in vg._default_vf(1080, 1080, 1920, 30, probe=GIF)
@@ -0,0 +1,69 @@
+import json, os, subprocess, sys, time
+
+import pytest
+
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _job(jobs_dir, jid, **state):
+    d = os.path.join(jobs_dir, jid)
+    os.makedirs(d, exist_ok=True)
+    with open(os.path.join(d, "state.json"), "w") as f:
+        json.dump({"job_id": jid, **state}, f)
+    return d
+
+
+def test_import_sans_effet_de_bord(tmp_path):
+    jobs, outbox = tmp_path / "jobs", tmp_path / "outbox"
+    _job(str(jobs), "j1", status="queued", enqueued_at=int(time.time()))
+    env = {**os.environ, "JOBS_DIR": str(jobs), "OUTBOX_DIR": str(outbox), "RESUME_JOBS": "1", "WARMUP": "1"}
+    code = ("import threading, main, delivery, cache; "
+            "assert not main.JOBS, main.JOBS; "
+            "assert not delivery._started and cache._pruner is None; "
+            "names = {t.name for t in threading.enumerate()}; "
+            "assert not names & {'warmup', 'jobs-prune', 'cache-prune', 'delivery-dispatch'}, names")
+    p = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert p.returncode == 0, p.stderr[-2000:]
+    assert not outbox.exists()
+
+
+@pytest.fixture
+def jobs_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "JOBS", {})
+    monkeypatch.setattr(main, "JOB_FIELDS", {})
+    monkeypatch.setattr(main, "FINGERPRINTS", {})
+    return str(tmp_path)
+
+def test_prune_jobs_supprime_les_jobs_termines_expires(jobs_dir):
+    old = int(time.time()) - main.JOBS_RETENTION_SEC - 10
+    expired = _job(jobs_dir, "old", status="success", finished_at=old)
+    recent = _job(jobs_dir, "new", status="failed", finished_at=int(time.time()))
+    running = _job(jobs_dir, "run", status="running", enqueued_at=old)
+    main.JOBS.update(old={"job_id": "old", "status": "success", "finished_at": old, "fingerprint": "fp"},
+                     run={"job_id": "run", "status": "running", "enqueued_at": old})
+    main.FINGERPRINTS["fp"] = "old"
+
+    assert main._prune_jobs() == ["old"]
+    assert not os.path.exists(expired) and os.path.exists(recent) and os.path.exists(running)
+    assert "old" not in main.JOBS and not main.FINGERPRINTS
+
+def test_prune_jobs_supprime_le_spool_du_job(jobs_dir, tmp_path):
+    old = int(time.time()) - main.JOBS_RETENTION_SEC - 10
+    spools = {}
+    for jid in ("mem", "disk", "legacy"):
+        spools[jid] = tmp_path / "spool" / f"enqueue_{jid}_abc"
+        spools[jid].mkdir(parents=True)
+        (spools[jid] / "voice.mp3").write_bytes(b"x")
+        _job(jobs_dir, jid, status="success", finished_at=old)
+    main.JOBS["mem"] = {"job_id": "mem", "status": "success", "finished_at": old}
+    main.JOB_FIELDS["mem"] = {"spool_dir": str(spools["mem"])}
+    with open(os.path.join(jobs_dir, "disk", "fields.json"), "w") as f:   # pas en mémoire (non rechargé)
+        json.dump({"spool_dir": str(spools["disk"])}, f)
+    with open(os.path.join(jobs_dir, "legacy", "fields.json"), "w") as f:  # job d'avant spool_dir
+        json.dump({"plan_path": str(spools["legacy"] / "plan.json")}, f)
+
+    assert sorted(main._prune_jobs()) == ["disk", "legacy", "mem"]
+    assert not any(p.exists() for p in spools.values())
@@ -0,0 +1,14 @@
+import pytest
+
+import captions
+import main
+
+
+def test_warm_captions_produit_des_events():
+    events = main._warm_captions()["events"]
+    assert set(events) == set(captions.PRESETS) and all(n > 0 for n in events.values())
+
+def test_warm_captions_echoue_sans_event(monkeypatch):
+    monkeypatch.setattr(captions, "build_ass_from_srt", lambda payload, preset="default": captions.ASS_HEADER)
+    with pytest.raises(RuntimeError):
+        main._warm_captions()
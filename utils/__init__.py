@@ -1,2 +1,2 @@
-from .text_overlay import make_text_clip
-__all__ = ["make_text_clip"]
+from .text_overlay import make_text_clip, render_text_image, text_png
+__all__ = ["make_text_clip", "render_text_image", "text_png"]
@@ -1,8 +1,8 @@
 import os, math
+from functools import lru_cache
 from typing import Tuple, Optional
 from PIL import Image, ImageDraw, ImageFont
-import numpy as np
-from moviepy.editor import ImageClip
+# numpy / moviepy : importés dans make_text_clip seulement (lourds, inutiles pour les sprites PNG)
 
 def _pick_font() -> Optional[str]:
     env = os.getenv("FONT_PATH")
@@ -20,79 +20,130 @@ def _pick_font() -> Optional[str]:
         if os.path.isfile(p): return p
     return None
 
-_FONT_PATH = _pick_font()
+@lru_cache(maxsize=1)
+def font_path() -> Optional[str]:
+    """Police choisie au premier usage (pas à l'import) ; main.warmup() peut la précharger."""
+    return _pick_font()
+
+@lru_cache(maxsize=64)
+def _truetype(path: str, size: int) -> ImageFont.FreeTypeFont:
+    # une seule construction FreeType par (police, taille) pour tout le process
+    return ImageFont.truetype(path, size=size)
 
 def _load_font(size: int) -> ImageFont.ImageFont:
     try:
-        if _FONT_PATH: return ImageFont.truetype(_FONT_PATH, size=size)
+        if font_path(): return _truetype(font_path(), size)
     except Exception:
         pass
     return ImageFont.load_default()
 
-def _wrap(text: str, max_w: int, font: ImageFont.ImageFont, stroke_width:int):
-    if not text: text = ""
-    tmp = Image.new("RGBA", (max_w, 10), (0,0,0,0))
-    d = ImageDraw.Draw(tmp)
-    words = text.split()
+def _measure(text: str, max_w: int, font: ImageFont.ImageFont, stroke_width: int):
+    """
+    Découpe en lignes + mesures. Largeur incrémentale : chaque mot est mesuré une fois
+    (avance FreeType), puis une seule bbox par ligne finale (plus d'image brouillon).
+    Retourne (lines, text_w, text_h, sizes) avec sizes = ((w, h), ...) par ligne.
+    """
+    space = font.getlength(" ")
     lines = []
-    cur = ""
-    for w in words:
-        test = (cur + " " + w).strip()
-        bbox = d.textbbox((0,0), test, font=font, stroke_width=stroke_width)
-        if bbox[2] > max_w and cur:
-            lines.append(cur); cur = w
-        else:
-            cur = test
-    if cur: lines.append(cur)
+    for para in text.split("\n"):  # retours à la ligne explicites conservés
+        cur, cur_w = [], 0.0
+        for w in para.split():
+            ww = font.getlength(w)
+            test_w = cur_w + (space if cur else 0.0) + ww
+            if test_w + 2*stroke_width > max_w and cur:
+                lines.append(" ".join(cur)); cur, cur_w = [w], ww
+            else:
+                cur.append(w); cur_w = test_w
+        if cur: lines.append(" ".join(cur))
     if not lines: lines = [""]
 
-    line_heights = []
-    max_line_w = 0
+    sizes = []
     for ln in lines:
-        bbox = d.textbbox((0,0), ln, font=font, stroke_width=stroke_width)
-        max_line_w = max(max_line_w, bbox[2])
-        line_heights.append(bbox[3]-bbox[1])
-    text_w = max_line_w
-    text_h = sum(line_heights) + (len(lines)-1)*int(font.size*0.3)
-    return lines, text_w, text_h
+        bbox = font.getbbox(ln, stroke_width=stroke_width)
+        sizes.append((bbox[2], bbox[3]-bbox[1]))
+    text_w = max(w for w, _ in sizes)
+    text_h = sum(h for _, h in sizes) + (len(lines)-1)*int(font.size*0.3)
+    return tuple(lines), text_w, text_h, tuple(sizes)
+
+@lru_cache(maxsize=4096)
+def _measure_cached(text: str, max_w: int, font_key: Tuple[str, int], stroke_width: int):
+    return _measure(text, max_w, _truetype(*font_key), stroke_width)
+
+def _layout(text: str, max_w: int, font: ImageFont.ImageFont, stroke_width: int):
+    """_measure mémoïsé par (texte, largeur, police, contour) pour les polices TrueType."""
+    path = getattr(font, "path", None)
+    if path is None:  # police bitmap par défaut : pas de clé stable
+        return _measure(text or "", max_w, font, stroke_width)
+    return _measure_cached(text or "", max_w, (path, font.size), stroke_width)
 
-def make_text_clip(
+def _wrap(text: str, max_w: int, font: ImageFont.ImageFont, stroke_width:int):
+    lines, text_w, text_h, _ = _layout(text, max_w, font, stroke_width)
+    return list(lines), text_w, text_h
+
+def render_text_image(
     text: str,
-    W: int,
-    max_w_ratio: float = 0.92,
+    max_w: int,
     fontsize: int = 56,
-    start: float = 0.0,
-    duration: float = None,
-    position: str = "bottom",  # "bottom" or "top"
-    y_margin: int = 64,
     text_rgb: Tuple[int,int,int] = (255,255,255),
     stroke_rgb: Tuple[int,int,int] = (0,0,0),
     stroke_width: int = 4,
-    bg_alpha: int = 128,
+    bg_rgba: Tuple[int,int,int,int] = (0,0,0,128),
     radius: int = 28,
-):
-    if not text:
-        return None
-    max_w = int(W*max_w_ratio)
+    pad: Tuple[int,int] = (24, 16),
+) -> Image.Image:
+    """Boîte arrondie + texte centré (retour à la ligne auto), en RGBA."""
     font = _load_font(fontsize)
-    lines, text_w, text_h = _wrap(text, max_w, font, stroke_width)
+    lines, text_w, text_h, sizes = _layout(text, max_w, font, stroke_width)
 
-    pad_x, pad_y = 24, 16
+    pad_x, pad_y = pad
     box_w = text_w + 2*pad_x
     box_h = text_h + 2*pad_y
 
     img = Image.new("RGBA", (box_w, box_h), (0,0,0,0))
     d = ImageDraw.Draw(img)
-    d.rounded_rectangle((0,0,box_w-1,box_h-1), radius, fill=(0,0,0,bg_alpha))
+    d.rounded_rectangle((0,0,box_w-1,box_h-1), radius, fill=tuple(bg_rgba))
 
     y = pad_y
-    for ln in lines:
-        bbox = d.textbbox((0,0), ln, font=font, stroke_width=stroke_width)
-        w = bbox[2]
-        h = bbox[3]-bbox[1]
+    for ln, (w, h) in zip(lines, sizes):
         x = (box_w - w)//2
         d.text((x,y), ln, font=font, fill=text_rgb+(255,), stroke_width=stroke_width, stroke_fill=stroke_rgb+(255,))
         y += h + int(font.size*0.3)
+    return img
+
+def text_png(text: str, max_w: int, **style) -> str:
+    """
+    Rend `text` une seule fois en PNG RGBA dans le cache disque partagé (namespace "sprites") :
+    même texte + même style => même fichier, dans la vidéo comme entre jobs.
+    """
+    from cache import key_of, get_or_create
+    key = key_of("text_png/v1", text, max_w, font_path(), sorted(style.items()))
+    return get_or_create("sprites", key, ".png",
+                         lambda tmp: render_text_image(text, max_w, **style).save(tmp, format="PNG"))
+
+def make_text_clip(
+    text: str,
+    W: int,
+    max_w_ratio: float = 0.92,
+    fontsize: int = 56,
+    start: float = 0.0,
+    duration: float = None,
+    position: str = "bottom",  # "bottom" or "top"
+    y_margin: int = 64,
+    text_rgb: Tuple[int,int,int] = (255,255,255),
+    stroke_rgb: Tuple[int,int,int] = (0,0,0),
+    stroke_width: int = 4,
+    bg_alpha: int = 128,
+    radius: int = 28,
+):
+    if not text:
+        return None
+    import numpy as np
+    from moviepy.editor import ImageClip
+    img = render_text_image(
+        text, int(W*max_w_ratio), fontsize=fontsize,
+        text_rgb=text_rgb, stroke_rgb=stroke_rgb, stroke_width=stroke_width,
+        bg_rgba=(0,0,0,bg_alpha), radius=radius,
+    )
 
     arr = np.array(img)
     clip = ImageClip(arr).set_start(start)
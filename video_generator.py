@@ -1,16 +1,42 @@
 # video_generator.py — encodage standard vs styles externes (carré constant sans downscale)
-import os, time, shutil, subprocess, logging, urllib.request, json, shlex
-from typing import Any, Dict, List, Tuple
+import os, time, shutil, subprocess, logging, urllib.request, json, shlex, hashlib, signal, threading, itertools
+from typing import Any, Dict, List, Optional, Tuple
 
 # Laisse le support "styles" si tu veux, mais en pratique passe style="default" pour ce rendu.
 try:
-    from styles import build as build_style  # seulement si style != "default"
+    from styles import build as build_style, has_style, estimate_cost  # seulement si style != "default"
 except Exception:
     build_style = None  # garde le fichier autonome si styles.py n'est pas présent
+    has_style = lambda _key: False
+    estimate_cost = lambda _key, need_dur, *_a: need_dur
+from encode_profile import PROFILES
+import hls, joblog
 
 FFMPEG_THREADS = os.getenv("FFMPEG_THREADS", "1").strip()
 FFMPEG_FILTER_THREADS = os.getenv("FFMPEG_FILTER_THREADS", "1").strip()
 UA = "Mozilla/5.0 (compatible; RenderBot/1.0)"
+# scaler pour les upscales (sources plus petites que le carré) ; GIF : même rendu par défaut,
+# GIF_SCALE_FLAGS=fast_bilinear (opt-in) pour un upscale plus rapide mais plus flou
+SCALE_FLAGS = os.getenv("SCALE_FLAGS", "bicubic").strip() or "bicubic"
+GIF_SCALE_FLAGS = os.getenv("GIF_SCALE_FLAGS", "bicubic").strip() or "bicubic"
+# GIF : une boucle encodée une fois (cache partagé) puis bouclée en copie jusqu'à need_dur
+GIF_NORMALIZE = os.getenv("GIF_NORMALIZE", "1") == "1"
+X264_SEGMENT = "-c:v libx264 -preset superfast -crf 26"
+# paramètres de sortie communs à TOUS les encodeurs de parts : GOP fixe, profil/niveau, timebase, pas d'audio
+# => SPS/PPS identiques d'un part à l'autre, la concat en copie est garantie
+X264_LEVEL = os.getenv("X264_LEVEL", "4.1")
+# normalisation loudness (optionnelle, aussi par requête via loudnorm=1)
+AUDIO_LOUDNORM = os.getenv("AUDIO_LOUDNORM", "0") == "1"
+AUDIO_LOUDNORM_TARGET = os.getenv("AUDIO_LOUDNORM_TARGET", "I=-16:TP=-1.5:LRA=11")
+# renditions (copies basse déf, poster, aperçu animé) : tirées du même décodage que la sortie
+RENDITIONS_MAX = int(os.getenv("RENDITIONS_MAX", "6"))
+RENDITION_PREVIEW_WIDTH = int(os.getenv("RENDITION_PREVIEW_WIDTH", "360"))
+RENDITION_PREVIEW_FPS = int(os.getenv("RENDITION_PREVIEW_FPS", "10"))
+
+def _uniform(fps: int) -> str:
+    gop = 2 * int(fps)
+    return (f"-pix_fmt yuv420p -profile:v high -level:v {X264_LEVEL} -g {gop} -keyint_min {gop} "
+            f"-sc_threshold 0 -r {int(fps)} -an -video_track_timescale 90000")
 
 def _with_threads(cmd: str) -> str:
     extra = []
@@ -20,13 +46,92 @@ def _with_threads(cmd: str) -> str:
         extra.append(f"-threads {FFMPEG_THREADS}")
     return f"{cmd} {' '.join(extra)}".strip()
 
+# ---------- Annulation ----------
+# Le worker d'un job async ouvre une exécution (start_job) : un jeton propre à ce run, valable jusqu'à
+# end_job (finally du worker). Chaque ffmpeg lancé depuis ce thread est lancé dans son propre groupe
+# de process et rattaché au jeton ; cancel_job(job_id) vise le run en cours de ce job, tue ce qui tourne
+# et fait échouer les commandes suivantes (JobCancelled). Deux runs (même job_id relancé, même req_id)
+# ne partagent jamais de clé, et rien ne survit à un run.
+class JobCancelled(Exception):
+    pass
+
+_PLOCK = threading.Lock()
+_RUNS: Dict[str, str] = {}    # job_id -> jeton du run en cours
+_PROCS: Dict[str, set] = {}   # jeton -> Popen vivants
+_CANCELLED: set = set()       # jetons dont l'annulation est demandée
+_SEQ = itertools.count(1)
+_current = threading.local()  # jeton du run du thread (worker)
+
+def start_job(job_id: str) -> str:
+    run = f"{job_id}#{next(_SEQ)}"
+    with _PLOCK:
+        _RUNS[job_id] = run
+        _PROCS[run] = set()
+    _current.run = run
+    return run
+
+def end_job(run: Optional[str]):
+    if not run:
+        return
+    with _PLOCK:
+        _PROCS.pop(run, None)
+        _CANCELLED.discard(run)
+        job_id = run.rpartition("#")[0]
+        if _RUNS.get(job_id) == run:
+            del _RUNS[job_id]
+    _current.run = None
+
+def _kill(p: subprocess.Popen):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def cancel_job(job_id: str) -> Optional[int]:
+    """Job en cours : son run est marqué annulé, process tués (retourne leur nb). Pas (ou plus) en cours : None."""
+    with _PLOCK:
+        run = _RUNS.get(job_id)
+        if run is None:
+            return None
+        _CANCELLED.add(run)
+        procs = list(_PROCS[run])
+    for p in procs:
+        _kill(p)
+    return len(procs)
+
+def check_cancelled(run: Optional[str] = None):
+    run = run or getattr(_current, "run", None)
+    if run and run in _CANCELLED:
+        raise JobCancelled(run.rpartition("#")[0])
+
 def _run(cmd: str, logger: logging.Logger, req_id: str):
-    logger.info(f"[{req_id}] CMD: {cmd}")
-    p = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    logger.info(f"[{req_id}] STDERR: {p.stdout}")
+    run = getattr(_current, "run", None)
+    check_cancelled(run)
+    logger.debug(f"[{req_id}] CMD: {cmd}")
+    p = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                         start_new_session=True)
+    with _PLOCK:
+        if run in _PROCS:
+            _PROCS[run].add(p)
+        cancelled = run in _CANCELLED
+    if cancelled:   # annulé entre le contrôle et le lancement
+        _kill(p)
+    try:
+        out, _ = p.communicate()
+    finally:
+        with _PLOCK:
+            if run in _PROCS:
+                _PROCS[run].discard(p)
+    # sortie ffmpeg : ring buffer du job (GET /jobs/<id>/logs), pas stdout
+    joblog.capture(req_id, cmd, out, p.returncode)
+    check_cancelled(run)
     if p.returncode != 0:
+        err = "\n".join((out or "").rstrip().splitlines()[-10:])
+        logger.warning(f"[{req_id}] commande en échec (rc={p.returncode}): {cmd}\n{err}")
         raise RuntimeError(f"Command failed: {cmd}")
 
+run_cmd = _run  # pour main (captions) : mêmes logs, même annulation
+
 def _ffprobe_json(path: str) -> dict:
     try:
         out = subprocess.check_output(
@@ -37,12 +142,40 @@ def _ffprobe_json(path: str) -> dict:
     except Exception:
         return {}
 
-def _kind(path: str) -> Tuple[bool, bool]:
+def _probe_source(path: str) -> Dict[str, Any]:
+    """
+    Un seul ffprobe par source : type + géométrie utile au choix de la chaîne de filtres.
+    width/height sont les dimensions APRÈS autorotation (ffmpeg tourne les vidéos de téléphone).
+    """
     info = _ffprobe_json(path)
     fm = (info.get("format",{}) or {}).get("format_name","") or ""
-    has_video = any((s or {}).get("codec_type") == "video" for s in info.get("streams",[]))
-    is_gif = ("gif" in fm.lower()) or path.lower().endswith(".gif")
-    return has_video, is_gif
+    vs = next((s for s in info.get("streams",[]) if (s or {}).get("codec_type") == "video"), None) or {}
+    w, h = int(vs.get("width") or 0), int(vs.get("height") or 0)
+    rot = (vs.get("tags") or {}).get("rotate")
+    for sd in vs.get("side_data_list") or []:
+        rot = sd.get("rotation", rot)
+    try:
+        if abs(int(float(rot or 0))) % 180 == 90:
+            w, h = h, w
+    except Exception:
+        pass
+    try:
+        duration = float((info.get("format") or {}).get("duration") or 0.0)
+    except Exception:
+        duration = 0.0
+    return {
+        "has_video": bool(vs),
+        "is_gif": ("gif" in fm.lower()) or path.lower().endswith(".gif"),
+        "width": w, "height": h,
+        "pix_fmt": vs.get("pix_fmt") or "",
+        "r_frame_rate": vs.get("r_frame_rate") or "",
+        "avg_frame_rate": vs.get("avg_frame_rate") or "",
+        "duration": duration,
+    }
+
+def _kind(path: str) -> Tuple[bool, bool]:
+    p = _probe_source(path)
+    return p["has_video"], p["is_gif"]
 
 def _download(url: str, dst_noext: str, logger: logging.Logger, req_id: str) -> str:
     os.makedirs(os.path.dirname(dst_noext), exist_ok=True)
@@ -74,8 +207,65 @@ def _download(url: str, dst_noext: str, logger: logging.Logger, req_id: str) ->
     return dst
 
 # ---------- Encodage par défaut (carré 1080 constant, SANS DOWNSCALE) ----------
+def _legacy_vf(box: int, width: int, height: int, fps: int) -> str:
+    # chaîne générique (expressions évaluées par frame) : quand on ne connaît pas la source
+    return ",".join([
+        "setsar=1",
+        "crop='min(iw,ih)':'min(iw,ih)':'(iw-min(iw,ih))/2':'(ih-min(iw,ih))/2'",
+        f"crop='if(gte(iw,{box}),{box},iw)':'if(gte(ih,{box}),{box},ih)':(iw-out_w)/2:(ih-out_h)/2",
+        f"scale='if(lt(iw,{box}),{box},iw)':'if(lt(ih,{box}),{box},ih)':flags=bicubic",
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black",
+        f"fps={fps}",
+        "format=yuv420p"
+    ])
+
+def _default_vf(box: int, width: int, height: int, fps: int,
+                probe: Optional[Dict[str, Any]] = None, is_gif: bool = False) -> str:
+    """
+    Plus petite chaîne correcte pour une source de dimensions connues (même rendu que _legacy_vf) :
+      - source carrée >= box : un seul crop centré (aucun si déjà box x box)
+      - source plus petite   : crop carré éventuel + scale direct (GIF : GIF_SCALE_FLAGS)
+      - palette GIF / RGB    : conversion yuv420p avant scale/pad
+      - pad / fps seulement s'ils changent quelque chose ; fps en tête si la source est plus rapide
+    """
+    iw, ih = int((probe or {}).get("width") or 0), int((probe or {}).get("height") or 0)
+    if iw <= 0 or ih <= 0:
+        return _legacy_vf(box, width, height, fps)
+    is_gif = is_gif or bool(probe.get("is_gif"))
+
+    def _rate(r: str) -> float:
+        try:
+            n, d = (r or "0/1").split("/")
+            return float(n) / float(d or 1)
+        except Exception:
+            return 0.0
+
+    vf = []
+    # source plus rapide que la cible : on jette les frames AVANT crop/scale/pad
+    fps_first = not is_gif and _rate(probe.get("avg_frame_rate")) > fps + 0.01
+    if fps_first:
+        vf.append(f"fps={fps}")
+    s = min(iw, ih)
+    if s >= box:
+        if (iw, ih) != (box, box):
+            vf.append(f"crop={box}:{box}:{(iw - box) // 2}:{(ih - box) // 2}")
+    elif iw != ih:
+        vf.append(f"crop={s}:{s}:{(iw - s) // 2}:{(ih - s) // 2}")
+    if probe.get("pix_fmt") != "yuv420p":
+        # palette GIF / RGB : conversion au plus tôt, scale et pad travaillent en yuv420p
+        vf.append("format=yuv420p")
+    if s < box:
+        vf.append(f"scale={box}:{box}:flags={GIF_SCALE_FLAGS if is_gif else SCALE_FLAGS}")
+    if (width, height) != (box, box):
+        vf.append(f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black")
+    if not fps_first and (is_gif or not (probe.get("r_frame_rate") == probe.get("avg_frame_rate") == f"{fps}/1")):
+        vf.append(f"fps={fps}")
+    vf.append("setsar=1")
+    return ",".join(vf)
+
 def _encode_segment_default(src: str, dst: str, need_dur: float, width: int, height: int, fps: int,
-                            logger: logging.Logger, req_id: str):
+                            logger: logging.Logger, req_id: str, probe: Optional[Dict[str, Any]] = None,
+                            x264: str = X264_SEGMENT):
     """
     Objectif: rendu TYPE demandé
       - carré centré constant (1080x1080 si sortie 1080x1920)
@@ -104,31 +294,57 @@ def _encode_segment_default(src: str, dst: str, need_dur: float, width: int, hei
         in_flags = f'-stream_loop -1 -t {need_dur:.3f} -i {shlex.quote(src)}'
     # --- FIN MODIF ---
 
-    vf = ",".join([
-        "setsar=1",
-        "crop='min(iw,ih)':'min(iw,ih)':'(iw-min(iw,ih))/2':'(ih-min(iw,ih))/2'",
-        f"crop='if(gte(iw,{box}),{box},iw)':'if(gte(ih,{box}),{box},ih)':(iw-out_w)/2:(ih-out_h)/2",
-        f"scale='if(lt(iw,{box}),{box},iw)':'if(lt(ih,{box}),{box},ih)':flags=bicubic",
-        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black",
-        f"fps={fps}",
-        "format=yuv420p"
-    ])
+    vf = _default_vf(box, width, height, fps, probe, is_gif=src_low.endswith(".gif"))
+
+    cmd = (
+        "ffmpeg -y -hide_banner -loglevel error "
+        f"{in_flags} " + (f"-vf \"{vf}\" " if vf else "") +
+        f"{x264} {_uniform(fps)} "
+        "-movflags +faststart "
+        f"{shlex.quote(dst)}"
+    )
+    _run(_with_threads(cmd), logger, req_id)
+
+# ---------- GIF : normalisation une fois, bouclage en copie ----------
+def _gif_intermediate(src: str, probe: Dict[str, Any], width: int, height: int, fps: int,
+                      logger: logging.Logger, req_id: str, x264: str = X264_SEGMENT) -> str:
+    """
+    Une seule boucle du GIF (le démuxeur GIF la lit une fois par défaut), décodée / upscalée /
+    encodée UNE fois à la taille et au fps cibles. Clé = contenu du GIF + géométrie + réglages
+    x264 : le même GIF est réutilisé dans la vidéo et entre jobs (cache "gif_norm").
+    """
+    from cache import key_of, file_sha1, get_or_create
+    key = key_of("gif_norm/v2", file_sha1(src), width, height, fps, x264, _uniform(fps))
 
+    def _encode(tmp: str):
+        vf = _default_vf(min(width, height), width, height, fps, probe, is_gif=True)
+        cmd = (
+            "ffmpeg -y -hide_banner -loglevel error "
+            f"-i {shlex.quote(src)} -vf \"{vf}\" {x264} {_uniform(fps)} "
+            "-movflags +faststart "
+            f"{shlex.quote(tmp)}"
+        )
+        _run(_with_threads(cmd), logger, req_id)
+
+    return get_or_create("gif_norm", key, ".mp4", _encode)
+
+def _loop_copy(src: str, dst: str, need_dur: float, logger: logging.Logger, req_id: str):
+    # la boucle commence par une IDR : bouclage en stream copy, sans décodage ni ré-encodage
     cmd = (
         "ffmpeg -y -hide_banner -loglevel error "
-        f"{in_flags} -vf \"{vf}\" "
-        "-c:v libx264 -preset superfast -crf 26 "
-        "-movflags +faststart -video_track_timescale 90000 "
+        f"-stream_loop -1 -t {need_dur:.3f} -i {shlex.quote(src)} "
+        "-map 0:v:0 -c copy -movflags +faststart -video_track_timescale 90000 "
         f"{shlex.quote(dst)}"
     )
     _run(_with_threads(cmd), logger, req_id)
 
 # ---------- Encodage via style (laisse pour compat, mais inutile ici) ----------
 def _encode_segment_with_style(src: str, dst: str, need_dur: float, width: int, height: int, fps: int,
-                               style_key: str, logger: logging.Logger, req_id: str, temp_dir: str):
+                               style_key: str, logger: logging.Logger, req_id: str, temp_dir: str,
+                               x264: str = X264_SEGMENT):
     if not build_style:
         # fallback : utilise le défaut si styles.py n'est pas dispo
-        return _encode_segment_default(src, dst, need_dur, width, height, fps, logger, req_id)
+        return _encode_segment_default(src, dst, need_dur, width, height, fps, logger, req_id, x264=x264)
 
     src_low = src.lower()
     if src_low.startswith("http") and ".m3u8" in src_low:
@@ -147,14 +363,121 @@ def _encode_segment_with_style(src: str, dst: str, need_dur: float, width: int,
         "ffmpeg -y -hide_banner -loglevel error "
         f"{in_flags} {extra_inputs} "
         f'-filter_complex "{filter_complex}" -map {map_label} '
-        "-c:v libx264 -preset superfast -crf 26 "
-        "-movflags +faststart -video_track_timescale 90000 "
+        f"{x264} {_uniform(fps)} "
+        "-movflags +faststart "
         f"{shlex.quote(dst)}"
     )
     _run(_with_threads(cmd), logger, req_id)
 
 # ---------- Concat + audio ----------
-def _concat_copy_strict(parts: List[str], out_path: str, logger: logging.Logger, req_id: str) -> str:
+# métrique process : combien de concats ont dû ré-encoder (tout, ou seulement des parts non conformes)
+CONCAT_STATS: Dict[str, int] = {"concat_copy": 0, "concat_filter": 0, "parts_conformed": 0}
+_CLOCK = threading.Lock()
+
+def concat_stats() -> Dict[str, Any]:
+    with _CLOCK:
+        st = dict(CONCAT_STATS)
+    total = st["concat_copy"] + st["concat_filter"]
+    st["fallback_rate"] = round(st["concat_filter"] / total, 4) if total else 0.0
+    return st
+
+def _mp4_boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """(type, début du contenu, fin) des boîtes filles de data[start:end]."""
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind, hdr = int.from_bytes(data[start:start + 4], "big"), data[start + 4:start + 8], 8
+        if size == 1:
+            size, hdr = int.from_bytes(data[start + 8:start + 16], "big"), 16
+        elif size == 0:
+            size = end - start
+        if size < hdr or start + size > end:
+            return
+        yield kind, start + hdr, start + size
+        start += size
+
+def _mp4_child(data: bytes, start: int, end: int, *path: bytes) -> Optional[Tuple[int, int]]:
+    for kind in path:
+        start, end = next(((s, e) for k, s, e in _mp4_boxes(data, start, end) if k == kind), (None, None))
+        if start is None:
+            return None
+    return start, end
+
+def _mp4_moov(path: str) -> bytes:
+    # en-têtes de premier niveau seulement : mdat (quelle que soit sa position) est sauté sans être lu
+    with open(path, "rb") as f:
+        pos, total = 0, os.fstat(f.fileno()).st_size
+        while pos + 8 <= total:
+            f.seek(pos)
+            head = f.read(16)
+            size, hdr = int.from_bytes(head[:4], "big"), 8
+            if size == 1:
+                size, hdr = int.from_bytes(head[8:16], "big"), 16
+            elif size == 0:
+                size = total - pos
+            if size < hdr:
+                break
+            if head[4:8] == b"moov":
+                f.seek(pos + hdr)
+                return f.read(size - hdr)
+            pos += size
+    return b""
+
+def _part_signature(path: str) -> Tuple:
+    """
+    Ce qui doit être identique pour une concat en copie : avcC (SPS/PPS => profil, niveau, taille,
+    SAR, refs, entropie) + timescale de la piste + nb de pistes. Lu dans l'arbre du moov, jamais dans mdat.
+    """
+    moov = _mp4_moov(path)
+    traks = [(s, e) for k, s, e in _mp4_boxes(moov) if k == b"trak"]
+    avcc = timescale = None
+    for s, e in traks:
+        mdhd = _mp4_child(moov, s, e, b"mdia", b"mdhd")
+        if timescale is None and mdhd and mdhd[1] - mdhd[0] >= 16 and moov[mdhd[0]] == 0:
+            timescale = int.from_bytes(moov[mdhd[0] + 12:mdhd[0] + 16], "big")
+        stsd = _mp4_child(moov, s, e, b"mdia", b"minf", b"stbl", b"stsd")
+        # stsd : version/flags + nb d'entrées (8 octets) ; entrée avc1 : 78 octets avant ses boîtes filles
+        avc1 = stsd and _mp4_child(moov, stsd[0] + 8, stsd[1], b"avc1")
+        box = avc1 and _mp4_child(moov, avc1[0] + 78, avc1[1], b"avcC")
+        if avcc is None and box:
+            avcc = moov[box[0]:box[1]]
+    return (hashlib.sha1(avcc).hexdigest() if avcc else None, timescale, len(traks))
+
+def _reference_signature(width: int, height: int, fps: int, x264: str,
+                         logger: logging.Logger, req_id: str) -> Tuple:
+    # SPS/PPS ne dépendent pas du contenu : 1 frame noire encodée avec les mêmes réglages suffit (cache)
+    from cache import key_of, get_or_create
+    def _encode(tmp: str):
+        cmd = ("ffmpeg -y -hide_banner -loglevel error "
+               f"-f lavfi -i color=c=black:s={width}x{height}:r={fps} -frames:v 1 -vf setsar=1 "
+               f"{x264} {_uniform(fps)} -movflags +faststart {shlex.quote(tmp)}")
+        _run(cmd, logger, req_id)
+    ref = get_or_create("concat_ref", key_of("concat_ref/v1", width, height, fps, x264, _uniform(fps)), ".mp4", _encode)
+    return _part_signature(ref)
+
+def _conform_parts(parts: List[str], width: int, height: int, fps: int, x264: str,
+                   logger: logging.Logger, req_id: str) -> Tuple[List[str], int]:
+    """
+    Validation avant concat : un part non conforme (source exotique, part hérité d'anciens réglages…)
+    est ré-encodé SEUL, au lieu de laisser la concat retomber sur un ré-encodage complet.
+    """
+    ref = _reference_signature(width, height, fps, x264, logger, req_id)
+    fixed: Dict[str, str] = {}
+    for p in dict.fromkeys(parts):
+        sig = _part_signature(p)
+        if sig == ref:
+            continue
+        dst = p[:-4] + "_conform.mp4"
+        logger.warning(f"[{req_id}] part non conforme {os.path.basename(p)} {sig} != {ref} -> ré-encodage")
+        cmd = ("ffmpeg -y -hide_banner -loglevel error "
+               f"-i {shlex.quote(p)} -map 0:v:0 "
+               f'-vf "scale={width}:{height}:flags={SCALE_FLAGS},setsar=1,fps={fps}" '
+               f"{x264} {_uniform(fps)} -movflags +faststart {shlex.quote(dst)}")
+        _run(_with_threads(cmd), logger, req_id)
+        fixed[p] = dst
+    return [fixed.get(p, p) for p in parts], len(fixed)
+
+def _concat_copy_strict(parts: List[str], out_path: str, logger: logging.Logger, req_id: str,
+                        x264: str = X264_SEGMENT, fps: int = 30) -> str:
     list_path = out_path + ".txt"
     with open(list_path, "w") as f:
         for p in parts:
@@ -165,42 +488,207 @@ def _concat_copy_strict(parts: List[str], out_path: str, logger: logging.Logger,
            "-c copy -movflags +faststart "
            f"{shlex.quote(out_path)}")
     try:
-        _run(_with_threads(cmd), logger, req_id); return "concat_copy"
+        _run(_with_threads(cmd), logger, req_id)
+        with _CLOCK:
+            CONCAT_STATS["concat_copy"] += 1
+        return "concat_copy"
+    except JobCancelled:
+        raise
     except Exception:
+        logger.warning(f"[{req_id}] concat en copie impossible -> ré-encodage complet (concat filter)")
+        with _CLOCK:
+            CONCAT_STATS["concat_filter"] += 1
         inputs = " ".join(f"-i {shlex.quote(p)}" for p in parts)
         n = len(parts); maps = "".join(f"[{i}:v:0]" for i in range(n))
         cmd2 = (f"ffmpeg -y -hide_banner -loglevel error {inputs} "
                 f'-filter_complex "{maps}concat=n={n}:v=1:a=0[v]" '
-                '-map "[v]" -c:v libx264 -preset superfast -crf 26 '
-                "-pix_fmt yuv420p -movflags +faststart "
+                f'-map "[v]" {x264} {_uniform(fps)} '
+                "-movflags +faststart "
                 f"{shlex.quote(out_path)}")
         _run(_with_threads(cmd2), logger, req_id); return "concat_filter"
 
-def _mux_audio(video_path: str, audio_path: str, out_path: str, logger: logging.Logger, req_id: str):
+def _audio_codec(path: str) -> str:
+    info = _ffprobe_json(path)
+    a = next((s for s in info.get("streams",[]) if (s or {}).get("codec_type") == "audio"), None) or {}
+    return (a.get("codec_name") or "").lower()
+
+def _mux_audio(video_path: str, audio_path: str, out_path: str, logger: logging.Logger, req_id: str,
+               music_path: str = None, music_start: int = 0, music_volume: float = 0.25,
+               loudnorm: bool = False) -> str:
+    """
+    Étape audio en UN seul process, vidéo copiée :
+      - voix seule déjà en AAC (et sans loudnorm) : audio copié tel quel (aucune génération perdue)
+      - sinon : mix voix + musique (volume, départ à music_start s dans la musique, amix)
+        et/ou loudnorm, encodé une seule fois en AAC directement dans le mux final.
+    Retourne le mode utilisé ("copy" | "aac" | "mix").
+    """
     # ⚠️ SUPPRESSION DE -shortest pour ne plus couper la vidéo trop tôt
+    inputs = f"-i {shlex.quote(video_path)} -i {shlex.quote(audio_path)} "
+    # loudnorm travaille à 192 kHz : on ramène la sortie à 48 kHz
+    norm = f",loudnorm={AUDIO_LOUDNORM_TARGET}" if loudnorm else ""
+    ar = "-ar 48000 " if loudnorm else ""
+    if music_path:
+        # piste du music_store : déjà découpée à l'offset (music_start=0 => pas de seek)
+        start_at = max(0, int(music_start))
+        seek = f"-ss {start_at} " if start_at else ""
+        inputs += f"{seek}-i {shlex.quote(music_path)} "
+        audio = (
+            f'-filter_complex "[2:a]volume={music_volume}[bg];'
+            f'[1:a][bg]amix=inputs=2:duration=first:dropout_transition=2,aresample=async=1{norm}[a]" '
+            f'-map 0:v:0 -map "[a]" -c:a aac -b:a 192k {ar}'
+        )
+        mode = "mix"
+    elif not loudnorm and _audio_codec(audio_path) == "aac":
+        audio = "-map 0:v:0 -map 1:a:0 -c:a copy "
+        mode = "copy"
+    else:
+        af = f'-af "{norm[1:]}" ' if norm else ""
+        audio = f"-map 0:v:0 -map 1:a:0 {af}-c:a aac -b:a 192k {ar}"
+        mode = "aac"
     cmd = ("ffmpeg -y -hide_banner -loglevel error "
-           f"-i {shlex.quote(video_path)} -i {shlex.quote(audio_path)} "
-           "-map 0:v:0 -map 1:a:0 -c:v copy -c:a aac -b:a 192k "
+           f"{inputs}{audio}-c:v copy "
            "-movflags +faststart "
            f"{shlex.quote(out_path)}")
     _run(_with_threads(cmd), logger, req_id)
+    return mode
 
-def _mix_voice_with_music(voice_path: str, music_path: str, start_at_sec: int,
-                          out_audio_path: str, logger: logging.Logger, req_id: str,
-                          music_volume: float = 0.25):
-    start_at = max(0, int(start_at_sec))
-    cmd = (
-        "ffmpeg -y -hide_banner -loglevel error "
-        f"-i {shlex.quote(voice_path)} "
-        f"-ss {start_at} -i {shlex.quote(music_path)} "
-        f'-filter_complex "[1:a]volume={music_volume}[bg];'
-        '[0:a][bg]amix=inputs=2:duration=first:dropout_transition=2,aresample=async=1[a]" '
-        '-map "[a]" -c:a aac -b:a 192k '
-        f"{shlex.quote(out_audio_path)}"
-    )
-    _run(_with_threads(cmd), logger, req_id)
+# ---------- Parts réutilisables entre rendus ----------
+def _part_key(key: Tuple[str, float, str], width: int, height: int, fps: int, x264: str = X264_SEGMENT) -> str:
+    # tout ce qui change les octets d'un part ; le placement dans la timeline n'en fait pas partie
+    url, dur, style_tag = key
+    return hashlib.sha1(repr(("part/v2", url, dur, style_tag, width, height, fps, x264, _uniform(fps),
+                              SCALE_FLAGS, GIF_SCALE_FLAGS, GIF_NORMALIZE)).encode("utf-8")).hexdigest()
+
+def _load_parts_index(workdir: str) -> Dict[str, str]:
+    try:
+        with open(os.path.join(workdir, "parts.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_parts_index(workdir: str, index: Dict[str, str]):
+    p = os.path.join(workdir, "parts.json")
+    with open(p + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({k: os.path.basename(v) for k, v in index.items()}, f, indent=1)
+    os.replace(p + ".tmp", p)
+
+def _adopt_part(src: str, dst: str) -> bool:
+    """Reprend un part d'un autre workdir : hardlink (aucune copie), sinon copie."""
+    if not os.path.isfile(src) or os.path.getsize(src) <= 0:
+        return False
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return True          # reprise dans le même workdir
+    if os.path.exists(dst):
+        os.remove(dst)       # part partiel d'un rendu interrompu
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return True
 
 # ---------- Génération ----------
+# ---------- Renditions ----------
+def parse_renditions(spec) -> List[Dict[str, Any]]:
+    """
+    spec : liste JSON ou "720x1280,poster,webp" ; éléments :
+      "WxH"                 copie mp4 (même audio)
+      "poster" / "poster@T" JPEG de la frame à T s (défaut 1 s)
+      "webp" / "webp@D"     aperçu WebP animé des D premières secondes (défaut 3 s)
+    ou dicts {"kind": "video"|"poster"|"webp", "width", "height", "at", "duration"}.
+    ValueError si un élément est invalide.
+    """
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec)
+        except ValueError:
+            spec = [x for x in spec.split(",") if x.strip()]
+    if isinstance(spec, (str, dict)):
+        spec = [spec]
+    out = []
+    for item in spec:
+        if isinstance(item, str):
+            name, _, arg = item.strip().lower().partition("@")
+            if "x" in name:
+                w, _, h = name.partition("x")
+                item = {"kind": "video", "width": w, "height": h}
+            elif name in ("poster", "jpg", "jpeg"):
+                item = {"kind": "poster", "at": arg or 1.0}
+            elif name in ("webp", "preview"):
+                item = {"kind": "webp", "duration": arg or 3.0}
+            else:
+                raise ValueError(f"rendition inconnue: {item}")
+        try:
+            kind = str(item.get("kind", "video")).lower()
+            r = {"kind": kind}
+            if kind == "video":
+                r.update(width=int(item["width"]) // 2 * 2, height=int(item["height"]) // 2 * 2)
+                if min(r["width"], r["height"]) < 16:
+                    raise ValueError("taille trop petite")
+                r["name"] = f"{r['width']}x{r['height']}"
+            elif kind == "poster":
+                r.update(at=max(0.0, float(item.get("at", 1.0))), name="poster")
+                if item.get("width"):
+                    r["width"] = int(item["width"]) // 2 * 2
+            elif kind == "webp":
+                r.update(duration=min(10.0, max(0.5, float(item.get("duration", 3.0)))), name="preview",
+                         width=int(item.get("width") or RENDITION_PREVIEW_WIDTH) // 2 * 2)
+            else:
+                raise ValueError(f"kind {kind}")
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"rendition invalide {item!r}: {e}")
+        if r["name"] not in [x["name"] for x in out]:
+            out.append(r)
+    if len(out) > RENDITIONS_MAX:
+        raise ValueError(f"trop de renditions ({len(out)} > {RENDITIONS_MAX})")
+    return out
+
+def rendition_graph(label: str, renditions: List[Dict[str, Any]], base_path: str, x264: str,
+                    duration: float = 0.0, main_label: Optional[str] = None):
+    """
+    Branche split à greffer sur un graphe qui décode déjà la vidéo (label = sortie vidéo, ex. "[0:v]").
+    main_label : garde aussi une sortie pour le fichier principal (passe captions).
+    Retourne (filtres, options de sortie ffmpeg, fichiers produits).
+    """
+    n = len(renditions) + (1 if main_label else 0)
+    stem = os.path.splitext(base_path)[0]
+    chains = [f"{label}split={n}{main_label or ''}" + "".join(f"[r{i}]" for i in range(len(renditions)))]
+    args, files = [], []
+    for i, r in enumerate(renditions):
+        if r["kind"] == "video":
+            w, h = r["width"], r["height"]
+            path = f"{stem}_{r['name']}.mp4"
+            chains.append(f"[r{i}]scale={w}:{h}:force_original_aspect_ratio=decrease:flags={SCALE_FLAGS},"
+                          f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1[o{i}]")
+            args.append(f'-map "[o{i}]" -map 0:a? {x264} -pix_fmt yuv420p -c:a copy -movflags +faststart '
+                        f"{shlex.quote(path)}")
+        elif r["kind"] == "poster":
+            # une frame au milieu au plus : jamais après la fin d'une vidéo courte
+            at = min(r["at"], duration / 2) if duration > 0 else r["at"]
+            scale = f",scale={r['width']}:-2:flags={SCALE_FLAGS}" if r.get("width") else ""
+            path = f"{stem}_poster.jpg"
+            chains.append(f"[r{i}]trim=start={at:.3f},setpts=PTS-STARTPTS{scale}[o{i}]")
+            args.append(f'-map "[o{i}]" -frames:v 1 -q:v 3 {shlex.quote(path)}')
+        else:
+            path = f"{stem}_preview.webp"
+            chains.append(f"[r{i}]trim=duration={r['duration']:.3f},setpts=PTS-STARTPTS,"
+                          f"fps={RENDITION_PREVIEW_FPS},scale={r['width']}:-2:flags={SCALE_FLAGS}[o{i}]")
+            args.append(f'-map "[o{i}]" -c:v libwebp -loop 0 -q:v 60 -an {shlex.quote(path)}')
+        files.append({**r, "path": path})
+    return ";".join(chains), " ".join(args), files
+
+def render_renditions(src_path: str, renditions: List[Dict[str, Any]], x264: str,
+                      logger: logging.Logger, req_id: str, duration: float = 0.0) -> List[Dict[str, Any]]:
+    """Toutes les renditions d'une vidéo finie en UN process : un décodage, un split."""
+    if not renditions:
+        return []
+    graph, outs, files = rendition_graph("[0:v]", renditions, src_path, x264, duration)
+    cmd = (f"ffmpeg -y -hide_banner -loglevel error -i {shlex.quote(src_path)} "
+           f'-filter_complex "{graph}" {outs}')
+    _run(_with_threads(cmd), logger, req_id)
+    return files
+
 def generate_video(
     plan: List[Dict[str, Any]],
     audio_path: str,
@@ -215,12 +703,27 @@ def generate_video(
     music_path: str = None,
     music_delay: int = 0,
     music_volume: float = 0.25,
+    loudnorm: bool = None,
+    reuse_dir=None,
+    encode_profile: Optional[str] = None,
+    renditions=None,
     **kwargs
 ):
+    """
+    reuse_dir : workdir (ou liste de workdirs) d'un rendu précédent ; ses parts dont la clé de paramètres
+    est identique (url, durée, style, géométrie, réglages d'encodage) sont repris tels quels.
+    parts.json est mis à jour après chaque part : passer temp_dir lui-même reprend un rendu interrompu.
+    encode_profile : profil x264 (encode_profile.PROFILES) choisi par la politique du job ; défaut = X264_SEGMENT.
+    renditions : voir parse_renditions ; produites depuis la sortie finale (un décodage), listées dans debug.
+    """
+    x264 = PROFILES[encode_profile]["segment"] if encode_profile in PROFILES else X264_SEGMENT
     style_key = str(style or "default").lower().strip()
-    parts: List[str] = []
-    t_running = 0.0
+    # style non déclaré dans le registre => encodage par défaut (pas de chaîne dupliquée)
+    styled = bool(style_key) and style_key != "default" and build_style is not None and has_style(style_key)
+    style_tag = style_key if styled else "default"
 
+    # analyse du plan avant rendu : (url, durée) normalisés par segment
+    segs: List[Tuple[str, float]] = []
     for i, seg in enumerate(plan):
         url = seg.get("gif_url") or seg.get("url") or seg.get("video_url")
         if not url:
@@ -231,61 +734,148 @@ def generate_video(
             dur = 0.0
         if dur <= 0.0:
             dur = 0.5
+        segs.append((url, dur))
+    # dédup : une source = un download + un probe ; un (url, durée, style) = un seul encodage,
+    # la liste de concat référence alors plusieurs fois le même part
+    part_keys = [(url, round(dur, 3), style_tag) for url, dur in segs]
+    logger.info(f"[{req_id}] plan: {len(segs)} segments, {len(set(part_keys))} parts uniques, "
+                f"{len({u for u, _ in segs})} sources uniques")
+
+    sources: Dict[str, Tuple[str, Optional[Dict[str, Any]]]] = {}
+    encoded: Dict[Tuple[str, float, str], str] = {}
+    index: Dict[str, str] = {}              # clé de paramètres -> nom du part (parts.json)
+    base_index: Dict[str, str] = {}     # clé -> chemin absolu ; le 1er workdir listé l'emporte
+    for d in reversed([reuse_dir] if isinstance(reuse_dir, str) else list(reuse_dir or [])):
+        if d:
+            base_index.update({k: os.path.join(d, name) for k, name in _load_parts_index(d).items()})
+    reused_base = 0
+    parts: List[str] = []
+    t_running = 0.0
+    est_cost = 0.0     # travail des parts encodés ici (hors parts réutilisés) ...
+    encode_sec = 0.0   # ... et leur durée d'encodage réelle (hors téléchargements) : même périmètre
+    gif_norm = 0
+    hls_prefetched = 0
 
+    for i, ((url, dur), key) in enumerate(zip(segs, part_keys)):
+        check_cancelled()
+        seg = plan[i]
         start = float(seg.get("start_time")) if seg.get("start_time") is not None else t_running
+        if seg.get("start_time") is None:
+            t_running += dur
+
+        if key in encoded:
+            logger.info(f"[{req_id}] seg#{i} start={start:.3f} dur={dur:.3f} => part réutilisé {encoded[key]}")
+            parts.append(encoded[key])
+            continue
+        part_path = os.path.join(temp_dir, f"part_{i:03d}.mp4")
+        pkey = _part_key(key, width, height, fps, x264)
+        prev = base_index.get(pkey)
+        if prev and _adopt_part(prev, part_path):
+            logger.info(f"[{req_id}] seg#{i} start={start:.3f} dur={dur:.3f} => part repris ({prev})")
+            encoded[key] = index[pkey] = part_path
+            parts.append(part_path)
+            reused_base += 1
+            continue
+        if os.path.exists(part_path):
+            # reste d'un rendu interrompu (peut être un hardlink vers un autre workdir) : jamais réécrit en place
+            os.remove(part_path)
         logger.info(f"[{req_id}] seg#{i} start={start:.3f} dur={dur:.3f} url={url}")
 
-        # source
-        if url.lower().startswith("http") and ".m3u8" in url.lower():
-            src_for_encode = url
-        else:
-            base = os.path.join(temp_dir, f"src_{int(time.time()*1000)}_{i}")
-            src_for_encode = _download(url, base, logger, req_id)
-            has_video, is_gif = _kind(src_for_encode)
-            if not (has_video or is_gif):
-                raise RuntimeError("Downloaded file is not media (got HTML). Lien Drive direct requis.")
+        # source (partagée entre segments de même url)
+        if url not in sources:
+            probe = None
+            if hls.is_hls(url):
+                # segments HLS couvrant la plus longue durée demandée pour cette url, en local (cache)
+                src = hls.prefetch(url, max(d for u, d in segs if u == url), logger, req_id) or url
+                if src != url:
+                    probe = _probe_source(src)
+                    hls_prefetched += 1
+            else:
+                base = os.path.join(temp_dir, f"src_{int(time.time()*1000)}_{i}")
+                src = _download(url, base, logger, req_id)
+                probe = _probe_source(src)
+                if not (probe["has_video"] or probe["is_gif"]):
+                    raise RuntimeError("Downloaded file is not media (got HTML). Lien Drive direct requis.")
+            sources[url] = (src, probe)
+        src_for_encode, probe = sources[url]
 
         # encodage : route default vs styles
-        part_path = os.path.join(temp_dir, f"part_{i:03d}.mp4")
-        if style_key and style_key != "default" and build_style is not None:
+        est_cost += estimate_cost(style_tag, dur, width, height, fps)
+        t_part = time.time()
+        gif_loops = (GIF_NORMALIZE and probe is not None and probe["is_gif"]
+                     and 0.0 < probe["duration"] < dur)
+        if gif_loops and not styled:
+            norm = _gif_intermediate(src_for_encode, probe, width, height, fps, logger, req_id, x264=x264)
+            _loop_copy(norm, part_path, dur, logger, req_id)
+            gif_norm += 1
+        elif styled:
+            if gif_loops:
+                # style : carré normalisé (sans pad), décodage bon marché en boucle
+                box = min(width, height)
+                src_for_encode = _gif_intermediate(src_for_encode, probe, box, box, fps, logger, req_id, x264=x264)
+                gif_norm += 1
             _encode_segment_with_style(
                 src_for_encode, part_path, dur, width, height, fps,
-                style_key, logger, req_id, temp_dir
+                style_key, logger, req_id, temp_dir, x264=x264
             )
         else:
-            _encode_segment_default(src_for_encode, part_path, dur, width, height, fps, logger, req_id)
+            _encode_segment_default(src_for_encode, part_path, dur, width, height, fps, logger, req_id,
+                                    probe=probe, x264=x264)
+        encode_sec += time.time() - t_part
 
+        encoded[key] = index[pkey] = part_path
         parts.append(part_path)
-        if seg.get("start_time") is None:
-            t_running += dur
+        _save_parts_index(temp_dir, index)   # checkpoint : ce part est complet
+
+    _save_parts_index(temp_dir, index)
 
     if not parts:
         raise ValueError("empty parts")
 
     # concat vidéo + audio
     video_only = os.path.join(temp_dir, "_video.mp4")
-    concat_mode = _concat_copy_strict(parts, video_only, logger, req_id)
-
-    audio_for_mux = audio_path
-    if music_path:
-        mixed = os.path.join(temp_dir, "voice_mix.m4a")
-        _mix_voice_with_music(
-            voice_path=audio_path, music_path=music_path,
-            start_at_sec=int(music_delay), out_audio_path=mixed,
-            logger=logger, req_id=req_id, music_volume=float(music_volume),
-        )
-        audio_for_mux = mixed
+    parts, conformed = _conform_parts(parts, width, height, fps, x264, logger, req_id)
+    if conformed:
+        with _CLOCK:
+            CONCAT_STATS["parts_conformed"] += conformed
+    concat_mode = _concat_copy_strict(parts, video_only, logger, req_id, x264=x264, fps=fps)
 
+    if loudnorm is None:
+        loudnorm = AUDIO_LOUDNORM
     out_path = os.path.join(temp_dir, output_name)
-    _mux_audio(video_only, audio_for_mux, out_path, logger, req_id)
+    audio_mode = _mux_audio(
+        video_only, audio_path, out_path, logger, req_id,
+        music_path=music_path, music_start=int(music_delay),
+        music_volume=float(music_volume), loudnorm=bool(loudnorm),
+    )
+
+    rendition_files = render_renditions(out_path, parse_renditions(renditions), x264, logger, req_id,
+                                        duration=sum(s[1] for s in segs)) if renditions else []
 
     debug = {
         "mode": concat_mode,
         "items": len(parts),
-        "style": (style_key or "default"),
+        "style": style_tag,
+        "style_cost": round(est_cost, 3),
+        "encode_sec": round(encode_sec, 3),
+        "x264": x264,
+        "gif_normalized": gif_norm,
+        "hls_prefetched": hls_prefetched,
+        "parts_conformed": conformed,
+        "dedup": {
+            "segments": len(parts),
+            "encoded_parts": len(encoded) - reused_base,
+            "reused_parts": len(parts) - len(encoded),
+            "sources": len(sources),
+            "shared_downloads": len(encoded) - reused_base - len(sources),
+            "reused_from_base": reused_base,
+        },
         "effects": "none",
         "music": bool(music_path),
         "music_start_at": int(music_delay) if music_path else 0,
         "music_volume": float(music_volume) if music_path else 0.0,
+        "audio": audio_mode,
+        "loudnorm": bool(loudnorm),
+        "renditions": rendition_files,
     }
     return out_path, debug